@@ -0,0 +1,82 @@
+from typing import (
+    Callable,
+    TypeVar,
+)
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import (
+    close_old_connections,
+    connections,
+)
+
+from googlesheets.metrics import track_request_queries
+
+
+T = TypeVar('T')
+
+
+@lru_cache(maxsize=None)
+def get_db_executor() -> ThreadPoolExecutor:
+    """
+    Получение пула потоков для запросов к БД процесса.
+
+    :return: Пул из ASYNC_DB_THREADS потоков.
+    """
+
+    return ThreadPoolExecutor(
+        max_workers=settings.ASYNC_DB_THREADS,
+        thread_name_prefix='db',
+        initializer=_init_db_thread,
+    )
+
+
+async def run_in_db_thread(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Выполнение синхронной функции, обращающейся к БД, в потоке пула.
+
+    Под ASGI Django выполняет синхронный код и асинхронные методы ORM
+    в отдельном потоке на каждый запрос, поэтому соединение с БД
+    открывается заново для каждого запроса. Потоки пула живут все время
+    работы процесса, и их соединения переиспользуются: перед функцией
+    и после нее соединения проверяются так же, как в начале и в конце
+    запроса, а количество одновременных запросов к БД ограничено
+    размером пула.
+
+    :param function: Функция.
+    :param args: Позиционные аргументы функции.
+    :param kwargs: Именованные аргументы функции.
+    :return: Результат функции.
+    """
+
+    return await sync_to_async(
+        _call_in_db_thread,
+        thread_sensitive=False,
+        executor=get_db_executor(),
+    )(function, *args, **kwargs)
+
+
+def _init_db_thread() -> None:
+    """Настройка времени жизни соединений с БД потока пула"""
+
+    for alias in connections:
+        connection = connections[alias]
+        # Настройки соединения общие для всех потоков, поэтому меняются
+        # в копии.
+        connection.settings_dict = {
+            **connection.settings_dict,
+            'CONN_MAX_AGE': settings.ASYNC_DB_CONN_MAX_AGE,
+        }
+
+
+def _call_in_db_thread(function: Callable[..., T], *args, **kwargs) -> T:
+    """Вызов функции в потоке пула с проверкой соединений с БД"""
+
+    close_old_connections()
+    try:
+        with track_request_queries():
+            return function(*args, **kwargs)
+    finally:
+        close_old_connections()
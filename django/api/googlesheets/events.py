@@ -0,0 +1,139 @@
+import json
+import asyncio
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from django.conf import settings
+
+from googlesheets.broadcast import get_broadcast
+
+
+class OrderEventsApp:
+    """
+    ASGI-приложение потока событий об изменениях заказов (Server-Sent Events).
+
+    Клиент подписывается на поток через EventSource и получает событие
+    orders на каждую ревизию изменений: ревизию, предыдущую ревизию,
+    измененные и удаленные заказы и сумму заказов в долларах. Если
+    предыдущая ревизия не совпадает с ревизией клиента или заказов
+    в событии нет, клиент догружает изменения через ленту изменений
+    (orders/changes/).
+
+    Работает напрямую на ASGI, а не через представление Django: Django
+    4.1 не умеет отдавать потоковые ответы асинхронно, и каждый клиент
+    занимал бы поток. Поэтому открытое соединение стоит только задачу
+    в цикле событий.
+    """
+
+    # Интервал отправки комментария для поддержания соединения в секундах.
+    heartbeat_interval = 15
+    # Задержка переподключения клиента после разрыва в миллисекундах.
+    retry_interval = 3000
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        """
+        Обработка запроса на подписку.
+
+        :param scope: Параметры соединения.
+        :param receive: Получение сообщений от сервера.
+        :param send: Отправка сообщений серверу.
+        """
+
+        if scope['method'] != 'GET':
+            await send({
+                'type': 'http.response.start',
+                'status': 405,
+                'headers': [(b'allow', b'GET'), (b'content-length', b'0')],
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        subscription = await get_broadcast().subscribe()
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        message = asyncio.ensure_future(subscription.get())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': self._get_headers(scope),
+            })
+            await self._send_event(send, f'retry: {self.retry_interval}\n\n')
+
+            while True:
+                done, _ = await asyncio.wait(
+                    (disconnect, message),
+                    timeout=self.heartbeat_interval,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnect in done:
+                    break
+                if message in done:
+                    data = json.dumps(message.result(), separators=(',', ':'))
+                    await self._send_event(send, f'event: orders\ndata: {data}\n\n')
+                    message = asyncio.ensure_future(subscription.get())
+                else:
+                    await self._send_event(send, ': ping\n\n')
+        finally:
+            subscription.close()
+            disconnect.cancel()
+            message.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive: Callable) -> None:
+        """
+        Ожидание отключения клиента.
+
+        :param receive: Получение сообщений от сервера.
+        """
+
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def _send_event(send: Callable, event: str) -> None:
+        """
+        Отправка события клиенту.
+
+        :param send: Отправка сообщений серверу.
+        :param event: Текст события.
+        """
+
+        await send({
+            'type': 'http.response.body',
+            'body': event.encode(),
+            'more_body': True,
+        })
+
+    @staticmethod
+    def _get_headers(scope: Dict[str, Any]) -> List[Tuple[bytes, bytes]]:
+        """
+        Получение заголовков ответа.
+
+        Заголовок CORS добавляется для разрешенных в настройках источников,
+        так же, как его добавляет django-cors-headers для API.
+
+        :param scope: Параметры соединения.
+        :return: Заголовки ответа.
+        """
+
+        headers = [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            # Отключает буферизацию ответа в nginx.
+            (b'x-accel-buffering', b'no'),
+        ]
+
+        origin: Optional[bytes] = dict(scope['headers']).get(b'origin')
+        if origin is not None and (
+                settings.CORS_ORIGIN_ALLOW_ALL
+                or origin.decode('latin-1') in settings.CORS_ORIGIN_WHITELIST
+        ):
+            headers.append((b'access-control-allow-origin', origin))
+            headers.append((b'vary', b'Origin'))
+
+        return headers
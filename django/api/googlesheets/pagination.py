@@ -0,0 +1,186 @@
+import json
+import base64
+import binascii
+from typing import (
+    Any,
+    List,
+    Optional,
+    Tuple,
+)
+from django.db.models import (
+    Q,
+    QuerySet,
+)
+from django.core.exceptions import ValidationError
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Класс постраничной выдачи по ключу сортировки.
+
+    Следующая страница начинается сразу после последней записи предыдущей:
+    курсор хранит значения полей сортировки этой записи, и запрос страницы
+    идет по индексу с нужного места, без OFFSET. Поэтому время ответа
+    не зависит от номера страницы и размера таблицы.
+
+    Сортировка задается двумя полями, второе из которых уникально.
+    Постраничная выдача включается параметрами cursor или page_size.
+    """
+
+    ordering: Tuple[str, str] = ('delivery_time', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self.request: Optional[Request] = None
+        self.next_position: Optional[Tuple[Any, Any]] = None
+
+    def is_requested(self, request: Request) -> bool:
+        """
+        Проверка, запрошена ли постраничная выдача.
+
+        :param request: Объект запроса.
+        :return: True, если в запросе есть курсор или размер страницы.
+        """
+
+        return self.cursor_query_param in request.query_params \
+            or self.page_size_query_param in request.query_params
+
+    def paginate_queryset(
+            self,
+            queryset: QuerySet,
+            request: Request,
+            view=None,
+    ) -> Optional[List]:
+        """
+        Получение страницы записей.
+
+        :param queryset: QuerySet записей.
+        :param request: Объект запроса.
+        :param view: Представление.
+        :return: Список записей страницы или None, если постраничная
+            выдача не запрошена.
+        """
+
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            first, second = self.ordering
+            # Записи после позиции курсора. Условие записано так, чтобы
+            # БД шла по индексу с первого значения курсора.
+            queryset = queryset \
+                .filter(**{f'{first}__gte': position[0]}) \
+                .filter(~Q(**{first: position[0]}) | Q(**{f'{second}__gt': position[1]}))
+
+        # Запрашиваем на одну запись больше, чтобы узнать, есть ли
+        # следующая страница.
+        results = list(queryset[:page_size + 1])
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_position = tuple(getattr(last, field) for field in self.ordering)
+        else:
+            self.next_position = None
+
+        return results
+
+    def get_page_size(self, request: Request) -> int:
+        """
+        Получение размера страницы из запроса.
+
+        :param request: Объект запроса.
+        :return: Размер страницы.
+        """
+
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self) -> Optional[str]:
+        """
+        Получение ссылки на следующую страницу.
+
+        :return: URL следующей страницы или None, если страница последняя.
+        """
+
+        if self.next_position is None:
+            return None
+
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data: Any) -> Response:
+        """
+        Получение ответа со страницей записей.
+
+        :param data: Сериализованные записи страницы.
+        :return: Объект ответа.
+        """
+
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def encode_cursor(self, position: Tuple[Any, Any]) -> str:
+        """
+        Кодирование позиции в курсор.
+
+        :param position: Значения полей сортировки.
+        :return: Курсор в base64.
+        """
+
+        payload = json.dumps(
+            [value.isoformat() if hasattr(value, 'isoformat') else value
+             for value in position],
+            separators=(',', ':'),
+        )
+
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request: Request, queryset: QuerySet) -> Optional[Tuple[Any, Any]]:
+        """
+        Декодирование позиции из курсора запроса.
+
+        :param request: Объект запроса.
+        :param queryset: QuerySet записей.
+        :return: Значения полей сортировки или None, если курсора нет.
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = [queryset.model._meta.get_field(name) for name in self.ordering]
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return tuple(field.to_python(value) for field, value in zip(fields, values))
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
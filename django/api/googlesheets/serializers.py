@@ -1,6 +1,19 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import (
+    ModelSerializer,
+    Serializer,
+    BooleanField,
+    CharField,
+    ChoiceField,
+    DateField,
+    DecimalField,
+    IntegerField,
+)
 
-from googlesheets.models import Order
+from googlesheets.models import (
+    Order,
+    OrderTombstone,
+)
+from googlesheets.order_summary import BUCKETS
 
 
 class OrderSerializer(ModelSerializer):
@@ -10,4 +23,75 @@ class OrderSerializer(ModelSerializer):
         """Класс настроек"""
 
         model = Order
-        fields = '__all__'
+        fields = ('id', 'source', 'number', 'order_number',
+                  'dollars', 'delivery_time', 'rubles')
+
+
+class OrderFilterSerializer(Serializer):
+    """Сериализатор параметров фильтрации заказов"""
+
+    source = IntegerField(required=False, min_value=1)
+    order_number = IntegerField(required=False, min_value=0)
+    delivery_from = DateField(required=False)
+    delivery_to = DateField(required=False)
+    overdue = BooleanField(required=False, allow_null=True, default=None)
+
+
+class OrderTombstoneSerializer(ModelSerializer):
+    """Сериализатор записи об удалении заказа"""
+
+    class Meta:
+        """Класс настроек"""
+
+        model = OrderTombstone
+        fields = ('order_id', 'source', 'order_number', 'revision')
+
+
+class OrderChangesFilterSerializer(Serializer):
+    """Сериализатор параметров ленты изменений заказов"""
+
+    since = IntegerField(required=False, min_value=0)
+    source = IntegerField(required=False, min_value=1)
+
+
+class OrderSummaryFilterSerializer(Serializer):
+    """Сериализатор параметров сводки по заказам"""
+
+    source = IntegerField(required=False, min_value=1)
+    delivery_from = DateField(required=False)
+    delivery_to = DateField(required=False)
+
+
+class OrderDaySummarySerializer(Serializer):
+    """Сериализатор сводки по заказам за день поставки"""
+
+    delivery_time = DateField()
+    count = IntegerField()
+    total_dollars = DecimalField(max_digits=24, decimal_places=5)
+    total_rubles = DecimalField(max_digits=24, decimal_places=5)
+    max_dollars = DecimalField(max_digits=18, decimal_places=5)
+
+
+class OrderSummarySerializer(Serializer):
+    """Сериализатор сводки по заказам"""
+
+    count = IntegerField()
+    overdue_count = IntegerField()
+    total_dollars = DecimalField(max_digits=24, decimal_places=5, allow_null=True)
+    total_rubles = DecimalField(max_digits=24, decimal_places=5, allow_null=True)
+    max_dollars = DecimalField(max_digits=18, decimal_places=5, allow_null=True)
+    days = OrderDaySummarySerializer(many=True)
+
+
+class OrderChartFilterSerializer(OrderSummaryFilterSerializer):
+    """Сериализатор параметров графика заказов"""
+
+    bucket = ChoiceField(choices=BUCKETS, default='day')
+    points = IntegerField(required=False, min_value=3, max_value=10000)
+
+
+class OrderChartSerializer(Serializer):
+    """Сериализатор графика заказов"""
+
+    bucket = CharField()
+    points = OrderDaySummarySerializer(many=True)
@@ -0,0 +1,139 @@
+import json
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+from django.db import models
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class RowEncoder:
+    """
+    Класс кодирования строк values_list() в JSON-объекты.
+
+    По полям модели один раз генерируется функция, которая собирает
+    объект одной f-строкой, поэтому на строку не создаются ни объекты
+    модели, ни поля сериализатора. Результат совпадает с выводом
+    ModelSerializer и JSONRenderer DRF: десятичные числа - строки
+    с количеством знаков поля, даты - в ISO 8601.
+    """
+
+    def __init__(self, model: type, fields: Sequence[str]) -> None:
+        """
+        Инициализатор класса.
+
+        :param model: Класс модели.
+        :param fields: Имена полей в порядке значений строки.
+        """
+
+        self.fields = tuple(fields)
+
+        namespace: Dict[str, Any] = {}
+        variables = [f'v{i}' for i in range(len(self.fields))]
+        template = ''
+        for i, (name, variable) in enumerate(zip(self.fields, variables)):
+            key = ('{' if i == 0 else ',') + json.dumps(name) + ':'
+            template += key.replace('{', '{{').replace('}', '}}')
+            template += self._get_expression(
+                model._meta.get_field(name),
+                variable,
+                namespace,
+            )
+        template += '}}'
+
+        exec(
+            f'def encode(row):\n'
+            f'    {", ".join(variables)}, = row\n'
+            f'    return f{template!r}\n',
+            namespace,
+        )
+        self.encode: Callable[[Sequence[Any]], str] = namespace['encode']
+
+    @staticmethod
+    def _get_expression(field: models.Field, variable: str, namespace: Dict[str, Any]) -> str:
+        """
+        Получение выражения f-строки для значения поля.
+
+        Значения обязательных полей простых типов форматируются прямо
+        в f-строке, остальные - функцией преобразования.
+
+        :param field: Поле модели.
+        :param variable: Имя переменной со значением.
+        :param namespace: Пространство имен функции кодирования, куда
+            добавляются функции преобразования.
+        :return: Часть f-строки.
+        """
+
+        if isinstance(field, models.DecimalField) and api_settings.COERCE_DECIMAL_TO_STRING:
+            template = f'"{{:.{field.decimal_places}f}}"'
+        elif isinstance(field, models.DateField) and not isinstance(field, models.DateTimeField):
+            template = '"{.isoformat()}"'
+        elif isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+            template = '{}'
+        else:
+            # Формат остальных значений, например, даты и времени, зависит
+            # от настроек DRF, поэтому они кодируются общим кодировщиком.
+            namespace['_dumps'] = _dumps
+            return f'{{_dumps({variable})}}'
+
+        if not field.null:
+            return template.replace('{', '{' + variable, 1)
+
+        convert = template.format
+        namespace[f'_{variable}'] = lambda value: 'null' if value is None else convert(value)
+        return f'{{_{variable}({variable})}}'
+
+
+def iter_json_object(
+        head: Dict[str, Any],
+        array_key: str,
+        rows: Iterable[Sequence[Any]],
+        encoder: RowEncoder,
+        chunk_size: int = 1000,
+) -> Iterator[bytes]:
+    """
+    Потоковое кодирование JSON-объекта с массивом строк в конце.
+
+    :param head: Поля объекта перед массивом.
+    :param array_key: Ключ массива.
+    :param rows: Строки массива.
+    :param encoder: Объект кодирования строк.
+    :param chunk_size: Количество строк в одной части ответа.
+    :return: Итератор по частям JSON в UTF-8.
+    """
+
+    # Начало объекта до открывающей скобки массива включительно.
+    chunk = [_dumps({**head, array_key: []})[:-2]]
+    separator = ''
+
+    for row in rows:
+        chunk.append(separator + encoder.encode(row))
+        separator = ','
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk).encode()
+            chunk = []
+
+    chunk.append(']}')
+    yield ''.join(chunk).encode()
+
+
+def _dumps(value: Any) -> str:
+    """
+    Кодирование значения в JSON так же, как это делает JSONRenderer DRF.
+
+    :param value: Значение.
+    :return: JSON.
+    """
+
+    return json.dumps(
+        value,
+        cls=JSONEncoder,
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+    )
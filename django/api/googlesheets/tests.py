@@ -0,0 +1,888 @@
+import os
+import asyncio
+import json
+import runpy
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from prometheus_client import CONTENT_TYPE_LATEST
+from rest_framework.renderers import JSONRenderer
+
+from channelservice import settings as settings_module
+from channelservice.asgi import application
+from channelservice.db_router import (
+    PRIMARY_PIN_COOKIE,
+    PrimaryReplicaRouter,
+    ReplicaReadsMiddleware,
+    pin_primary,
+    use_primary,
+    use_replica,
+)
+from googlesheets.models import (
+    Order,
+    OrderTombstone,
+    SheetSource,
+    CurrencyRate,
+    SyncRevision,
+)
+from googlesheets.order_observer import OrderObserver
+from googlesheets.currency_rates import CbrRateProvider
+from googlesheets.broadcast import get_broadcast
+from googlesheets.change_log import (
+    SYNC_REVISION_PK,
+    compact_changes,
+)
+from googlesheets.tests import (
+    FakeSheetsService,
+    get_sample,
+    make_rows,
+)
+from .serializers import (
+    OrderSerializer,
+    OrderTombstoneSerializer,
+)
+from .db_threads import (
+    get_db_executor,
+    run_in_db_thread,
+)
+from .events import OrderEventsApp
+from .streaming import (
+    RowEncoder,
+    iter_json_object,
+)
+from . import views
+
+
+# Адреса API заказов.
+ORDERS_URL = '/api/googlesheets/orders/'
+CHANGES_URL = f'{ORDERS_URL}changes/'
+SUMMARY_URL = f'{ORDERS_URL}summary/'
+CHART_URL = f'{ORDERS_URL}chart/'
+
+
+@override_settings(
+    ORDERS_BROADCAST_BACKEND='googlesheets.broadcast.InMemoryBroadcast',
+    ASYNC_DB_CONN_MAX_AGE=0,
+)
+class APITestCase(TransactionTestCase):
+    """
+    Базовый класс тестов API заказов.
+
+    Представления API выполняются в потоках пула запросов к БД, которые
+    не видят незафиксированную транзакцию TestCase, поэтому данные тестов
+    фиксируются. Соединения потоков пула закрываются после каждого
+    запроса, чтобы тестовую БД можно было удалить.
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        get_broadcast.cache_clear()
+        self.addCleanup(get_broadcast.cache_clear)
+        get_db_executor.cache_clear()
+        self.addCleanup(self._shutdown_db_executor)
+        CbrRateProvider._local_cache.clear()
+        CurrencyRate.objects.create(char_code='USD', date=timezone.localdate(), value=Decimal(60))
+        # Записи из миграций удаляются после каждого теста.
+        SyncRevision.objects.get_or_create(pk=SYNC_REVISION_PK)
+        self.source = SheetSource.objects.create(spreadsheet_id='sheet', range_name='A1:D')
+
+    @staticmethod
+    def _shutdown_db_executor() -> None:
+        """Остановка пула потоков запросов к БД теста"""
+
+        get_db_executor().shutdown()
+        get_db_executor.cache_clear()
+
+    def sync(self, rows: List[List[str]], source: Optional[SheetSource] = None) -> None:
+        """
+        Синхронизация источника с таблицей.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        :param source: Источник данных. По умолчанию - источник теста.
+        """
+
+        source = source or self.source
+        source.refresh_from_db()
+        OrderObserver(source, FakeSheetsService(rows)).run()
+
+    @staticmethod
+    def serialize_orders(orders) -> List[Dict[str, Any]]:
+        """
+        Сериализация заказов так, как их отдает API.
+
+        :param orders: QuerySet заказов.
+        :return: Заказы в порядке постраничной выдачи.
+        """
+
+        return OrderSerializer(orders.order_by('delivery_time', 'id'), many=True).data
+
+
+class OrdersPaginationTests(APITestCase):
+    """Тесты постраничной выдачи заказов по курсору"""
+
+    def test_pages_cover_all_orders(self):
+        self.sync(make_rows(250))
+
+        pages = []
+        response = self.client.get(ORDERS_URL, {'page_size': 100})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pages.append(data)
+            if data['next'] is None:
+                break
+            response = self.client.get(data['next'])
+
+        self.assertEqual([len(page['orders']) for page in pages], [100, 100, 50])
+        self.assertEqual(
+            [order for page in pages for order in page['orders']],
+            self.serialize_orders(Order.objects.all()),
+        )
+        # Сумма считается только для первой страницы.
+        self.assertEqual(
+            Decimal(pages[0]['total_dollars']),
+            sum(Order.objects.values_list('dollars', flat=True)),
+        )
+        self.assertNotIn('total_dollars', pages[1])
+
+    def test_page_size_is_limited(self):
+        self.sync(make_rows(1100))
+
+        response = self.client.get(ORDERS_URL, {'page_size': 5000})
+
+        self.assertEqual(len(response.json()['orders']), 1000)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(ORDERS_URL, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters(self):
+        other = SheetSource.objects.create(spreadsheet_id='other', range_name='A1:D')
+        self.sync(make_rows(30))
+        self.sync(make_rows(20, seed=1), other)
+        today = timezone.localdate()
+        Order.objects.filter(source=other, number__lte=5).update(delivery_time=today)
+
+        cases = (
+            ({'source': other.pk}, Order.objects.filter(source=other)),
+            ({'order_number': 1003}, Order.objects.filter(order_number=1003)),
+            (
+                {'delivery_from': '2022-03-01', 'delivery_to': '2022-06-30'},
+                Order.objects.filter(delivery_time__range=('2022-03-01', '2022-06-30')),
+            ),
+            ({'overdue': 'true'}, Order.objects.filter(delivery_time__lt=today)),
+            ({'overdue': 'false'}, Order.objects.filter(delivery_time__gte=today)),
+        )
+        for params, orders in cases:
+            with self.subTest(params=params):
+                response = self.client.get(ORDERS_URL, {**params, 'page_size': 1000})
+                self.assertEqual(response.json()['orders'], self.serialize_orders(orders))
+
+    def test_invalid_filter(self):
+        response = self.client.get(ORDERS_URL, {'delivery_from': '01.01.2022', 'page_size': 10})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class OrdersCacheTests(APITestCase):
+    """Тесты кэширования ответов API заказов по версии данных"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rows = make_rows(20)
+        self.sync(self.rows)
+
+    def test_not_modified(self):
+        response = self.client.get(ORDERS_URL, {'page_size': 10})
+        etag = response['ETag']
+
+        response = self.client.get(ORDERS_URL, {'page_size': 10}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_depends_on_query(self):
+        first = self.client.get(ORDERS_URL, {'page_size': 10})
+        second = self.client.get(ORDERS_URL, {'page_size': 5})
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        response = self.client.get(ORDERS_URL, {'page_size': 5}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_response_is_cached_until_sync(self):
+        first = self.client.get(ORDERS_URL, {'page_size': 10})
+        # Изменение в обход синхронизации не меняет версию данных.
+        Order.objects.update(dollars=1)
+
+        cached = self.client.get(ORDERS_URL, {'page_size': 10})
+
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        self.rows[1][2] = '2'
+        self.sync(self.rows)
+        response = self.client.get(ORDERS_URL, {'page_size': 10}, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['orders'], self.serialize_orders(Order.objects.all())[:10])
+
+    def test_unchanged_sync_keeps_etag(self):
+        first = self.client.get(ORDERS_URL, {'page_size': 10})
+
+        self.sync(self.rows)
+
+        response = self.client.get(ORDERS_URL, {'page_size': 10}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class CacheSettingsTests(SimpleTestCase):
+    """Тесты проверки кэша в настройках"""
+
+    def load_settings(self, **env: str) -> Dict[str, Any]:
+        """
+        Загрузка модуля настроек с переменными окружения.
+
+        :param env: Переменные окружения.
+        :return: Значения настроек.
+        """
+
+        with mock.patch.dict(os.environ, env):
+            return runpy.run_path(settings_module.__file__)
+
+    def test_process_cache_is_refused_without_debug(self):
+        for backend in ('locmem.LocMemCache', 'filebased.FileBasedCache', 'memcached.PyMemcacheCache'):
+            with self.subTest(backend=backend), self.assertRaises(ImproperlyConfigured):
+                self.load_settings(DEBUG='False', CACHE_BACKEND=f'django.core.cache.backends.{backend}')
+
+    def test_shared_cache_is_allowed_without_debug(self):
+        values = self.load_settings(
+            DEBUG='False',
+            CACHE_BACKEND='django.core.cache.backends.redis.RedisCache',
+            CACHE_LOCATION='redis://redis:6379/1',
+        )
+
+        self.assertEqual(values['CACHES']['default']['LOCATION'], 'redis://redis:6379/1')
+
+    def test_process_cache_is_allowed_with_debug(self):
+        values = self.load_settings(DEBUG='True', CACHE_BACKEND='django.core.cache.backends.locmem.LocMemCache')
+
+        self.assertTrue(values['DEBUG'])
+
+
+class OrderChangesTests(APITestCase):
+    """Тесты ленты изменений заказов"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rows = make_rows(30)
+        self.sync(self.rows)
+
+    def get_changes(self, **params: Any) -> Dict[str, Any]:
+        """
+        Получение изменений заказов.
+
+        :param params: Параметры запроса.
+        :return: Данные ответа.
+        """
+
+        response = self.client.get(CHANGES_URL, params)
+        self.assertEqual(response.status_code, 200)
+
+        return json.loads(b''.join(response.streaming_content) if response.streaming else response.content)
+
+    def get_revision(self) -> int:
+        """Получение последней ревизии"""
+
+        return SyncRevision.objects.get(pk=SYNC_REVISION_PK).value
+
+    def test_first_request_returns_all_orders(self):
+        data = self.get_changes()
+
+        self.assertTrue(data['reset'])
+        self.assertEqual(data['revision'], self.get_revision())
+        self.assertEqual(data['deleted'], [])
+        self.assertEqual(
+            sorted(data['upserted'], key=lambda order: order['id']),
+            OrderSerializer(Order.objects.order_by('id'), many=True).data,
+        )
+        self.assertEqual(
+            Decimal(data['total_dollars']),
+            sum(Order.objects.values_list('dollars', flat=True)),
+        )
+
+    def test_changes_after_revision(self):
+        since = self.get_changes()['revision']
+        self.rows[1][2] = '4321'
+        removed = self.rows.pop(2)
+        self.rows.append(['31', '9000', '10', '01.01.2023'])
+        self.sync(self.rows)
+
+        data = self.get_changes(since=since)
+
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['revision'], self.get_revision())
+        self.assertEqual(
+            data['upserted'],
+            OrderSerializer(Order.objects.filter(order_number__in=(1001, 9000)).order_by('id'), many=True).data,
+        )
+        self.assertEqual(
+            [(order['order_number'], order['revision']) for order in data['deleted']],
+            [(int(removed[1]), data['revision'])],
+        )
+
+        data = self.get_changes(since=data['revision'])
+
+        self.assertFalse(data['reset'])
+        self.assertEqual((data['upserted'], data['deleted']), ([], []))
+
+    def test_source_filter(self):
+        other = SheetSource.objects.create(spreadsheet_id='other', range_name='A1:D')
+        since = self.get_revision()
+        self.sync(make_rows(5, seed=1), other)
+
+        self.assertEqual(self.get_changes(since=since, source=self.source.pk)['upserted'], [])
+        self.assertEqual(len(self.get_changes(since=since, source=other.pk)['upserted']), 5)
+        self.assertEqual(len(self.get_changes(source=other.pk)['upserted']), 5)
+
+    def test_compacted_feed_requires_reset(self):
+        since = self.get_revision()
+        self.rows.pop(1)
+        self.sync(self.rows)
+        OrderTombstone.objects.update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(compact_changes(timedelta(hours=1)), 1)
+
+        data = self.get_changes(since=since)
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['upserted']), len(self.rows) - 1)
+        self.assertFalse(self.get_changes(since=data['revision'])['reset'])
+
+    def test_reprice_requires_reset(self):
+        since = self.get_revision()
+        CurrencyRate.objects.update(value=Decimal(70))
+        CbrRateProvider._local_cache.clear()
+        cache.clear()
+
+        self.sync(self.rows)
+
+        data = self.get_changes(since=since)
+        self.assertTrue(data['reset'])
+        for order in data['upserted']:
+            self.assertEqual(order['rubles'], f'{Decimal(order["dollars"]) * 70:.5f}')
+
+    def test_invalid_revision(self):
+        response = self.client.get(CHANGES_URL, {'since': -1})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_reset_is_streamed(self):
+        reset = self.client.get(CHANGES_URL)
+        changes = self.client.get(CHANGES_URL, {'since': self.get_revision()})
+
+        self.assertTrue(reset.streaming)
+        self.assertEqual(reset['Content-Type'], 'application/json')
+        self.assertEqual(reset['Cache-Control'], 'no-cache')
+        self.assertFalse(changes.streaming)
+
+
+@override_settings(ORDERS_BROADCAST_BACKEND='googlesheets.broadcast.InMemoryBroadcast')
+class OrderEventsTests(SimpleTestCase):
+    """Тесты потока событий об изменениях заказов"""
+
+    def setUp(self) -> None:
+        get_broadcast.cache_clear()
+        self.addCleanup(get_broadcast.cache_clear)
+
+    @staticmethod
+    async def request(method: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Запрос к потоку событий.
+
+        После подписки публикуются сообщения, затем клиент отключается.
+
+        :param method: Метод запроса.
+        :param messages: Сообщения для публикации.
+        :return: Сообщения ASGI, отправленные клиенту.
+        """
+
+        sent: List[Dict[str, Any]] = []
+        received = asyncio.Event()
+        disconnect = asyncio.Event()
+
+        async def receive() -> Dict[str, Any]:
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message: Dict[str, Any]) -> None:
+            sent.append(message)
+            received.set()
+
+        scope = {
+            'type': 'http',
+            'method': method,
+            'headers': [(b'origin', b'http://localhost:8080')],
+        }
+        request = asyncio.ensure_future(OrderEventsApp()(scope, receive, send))
+        for message in messages:
+            # Ожидание подписки или предыдущего события.
+            await received.wait()
+            received.clear()
+            get_broadcast().publish(message)
+        if messages:
+            await received.wait()
+        disconnect.set()
+        await asyncio.wait_for(request, timeout=5)
+
+        return sent
+
+    def test_messages_are_sent_as_events(self):
+        message = {'revision': 2, 'base_revision': 1, 'reset': False, 'upserted': [], 'deleted': []}
+
+        sent = asyncio.run(self.request('GET', [message, {**message, 'revision': 3}]))
+
+        start, *body = sent
+        self.assertEqual(start['status'], 200)
+        headers = dict(start['headers'])
+        self.assertEqual(headers[b'content-type'], b'text/event-stream; charset=utf-8')
+        self.assertEqual(headers[b'access-control-allow-origin'], b'http://localhost:8080')
+        events = [part['body'].decode() for part in body]
+        self.assertTrue(events[0].startswith('retry: '))
+        self.assertEqual(
+            [json.loads(event.split('data: ', 1)[1]) for event in events[1:]],
+            [message, {**message, 'revision': 3}],
+        )
+        self.assertTrue(all(event.startswith('event: orders\n') for event in events[1:]))
+
+    def test_only_get_is_allowed(self):
+        start, body = asyncio.run(self.request('POST', []))
+
+        self.assertEqual(start['status'], 405)
+        self.assertEqual(body['body'], b'')
+
+
+class OrderSummaryTests(APITestCase):
+    """Тесты API сводки по заказам"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.other = SheetSource.objects.create(spreadsheet_id='other', range_name='A1:D')
+        self.sync(make_rows(40))
+        self.sync(make_rows(25, seed=1), self.other)
+
+    def test_summary(self):
+        response = self.client.get(SUMMARY_URL)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 65)
+        self.assertEqual(data['overdue_count'], 65)
+        self.assertEqual(Decimal(data['total_dollars']), sum(Order.objects.values_list('dollars', flat=True)))
+        self.assertEqual(Decimal(data['max_dollars']), max(Order.objects.values_list('dollars', flat=True)))
+        days = Order.objects.order_by('delivery_time').values_list('delivery_time', flat=True).distinct()
+        self.assertEqual([day['delivery_time'] for day in data['days']], [day.isoformat() for day in days])
+        self.assertEqual(sum(day['count'] for day in data['days']), 65)
+
+    def test_filters(self):
+        data = self.client.get(SUMMARY_URL, {
+            'source': self.other.pk,
+            'delivery_from': '2022-04-01',
+            'delivery_to': '2022-09-30',
+        }).json()
+
+        orders = Order.objects.filter(
+            source=self.other,
+            delivery_time__range=('2022-04-01', '2022-09-30'),
+        )
+        self.assertEqual(data['count'], orders.count())
+        self.assertEqual(Decimal(data['total_rubles']), sum(orders.values_list('rubles', flat=True)))
+
+    def test_empty_summary(self):
+        data = self.client.get(SUMMARY_URL, {'delivery_from': '2030-01-01'}).json()
+
+        self.assertEqual(data, {
+            'count': 0,
+            'overdue_count': 0,
+            'total_dollars': None,
+            'total_rubles': None,
+            'max_dollars': None,
+            'days': [],
+        })
+
+
+class OrdersStreamTests(APITestCase):
+    """Тесты потоковой выдачи всех заказов"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.sync(make_rows(300))
+
+    def test_stream_matches_serializer(self):
+        response = self.client.get(ORDERS_URL)
+
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data, {
+            'total_dollars': float(sum(Order.objects.values_list('dollars', flat=True))),
+            'orders': self.serialize_orders(Order.objects.all()),
+        })
+
+    def test_filtered_stream(self):
+        response = self.client.get(ORDERS_URL, {'delivery_to': '2022-02-28'})
+
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(
+            data['orders'],
+            self.serialize_orders(Order.objects.filter(delivery_time__lte='2022-02-28')),
+        )
+
+    def test_stream_is_cached(self):
+        content = b''.join(self.client.get(ORDERS_URL).streaming_content)
+
+        response = self.client.get(ORDERS_URL)
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, content)
+
+    @override_settings(ORDERS_API_STREAM_CACHE_MAX_SIZE=1000)
+    def test_large_stream_is_not_cached(self):
+        content = b''.join(self.client.get(ORDERS_URL).streaming_content)
+
+        response = self.client.get(ORDERS_URL)
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+
+class RowEncoderTests(SimpleTestCase):
+    """Тесты кодирования строк в JSON"""
+
+    def test_encoding_matches_serializer(self):
+        encoder = RowEncoder(OrderTombstone, OrderTombstoneSerializer.Meta.fields)
+        tombstones = [
+            OrderTombstone(order_id=1, source_id=2, order_number=3, revision=4),
+            OrderTombstone(order_id=5, source_id=6, order_number=7, revision=None),
+        ]
+
+        for tombstone in tombstones:
+            row = [getattr(tombstone, field if field != 'source' else 'source_id') for field in encoder.fields]
+            self.assertEqual(
+                encoder.encode(row),
+                JSONRenderer().render(OrderTombstoneSerializer(tombstone).data).decode(),
+            )
+
+    def test_json_object_is_chunked(self):
+        encoder = RowEncoder(OrderTombstone, ('order_id', 'revision'))
+        rows = [(i, i * 10) for i in range(5)]
+
+        chunks = list(iter_json_object({'total': Decimal('1.5')}, 'items', rows, encoder, chunk_size=2))
+
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(json.loads(b''.join(chunks)), {
+            'total': 1.5,
+            'items': [{'order_id': i, 'revision': i * 10} for i in range(5)],
+        })
+        self.assertEqual(
+            b''.join(iter_json_object({}, 'items', [], encoder)),
+            b'{"items":[]}',
+        )
+
+
+class OrderChartTests(APITestCase):
+    """Тесты API графика заказов"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.sync(make_rows(200))
+
+    def test_day_points(self):
+        data = self.client.get(CHART_URL).json()
+
+        self.assertEqual(data['bucket'], 'day')
+        days = Order.objects.order_by('delivery_time').values_list('delivery_time', flat=True).distinct()
+        self.assertEqual([point['delivery_time'] for point in data['points']], [day.isoformat() for day in days])
+
+    def test_week_and_month_points(self):
+        for bucket in ('week', 'month'):
+            with self.subTest(bucket=bucket):
+                data = self.client.get(CHART_URL, {'bucket': bucket}).json()
+
+                self.assertEqual(data['bucket'], bucket)
+                self.assertEqual(sum(point['count'] for point in data['points']), 200)
+                self.assertEqual(
+                    sum(Decimal(point['total_dollars']) for point in data['points']),
+                    sum(Order.objects.values_list('dollars', flat=True)),
+                )
+                if bucket == 'month':
+                    self.assertTrue(all(point['delivery_time'].endswith('-01') for point in data['points']))
+
+    def test_points_are_downsampled(self):
+        days = self.client.get(CHART_URL).json()['points']
+
+        points = self.client.get(CHART_URL, {'points': 20}).json()['points']
+
+        self.assertEqual(len(points), 20)
+        self.assertEqual((points[0], points[-1]), (days[0], days[-1]))
+        self.assertTrue(all(point in days for point in points))
+
+    def test_invalid_params(self):
+        for params in ({'bucket': 'year'}, {'points': 2}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(CHART_URL, params).status_code, 400)
+
+
+class MetricsTests(APITestCase):
+    """Тесты метрик API"""
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_are_served(self):
+        self.sync(make_rows(5))
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], CONTENT_TYPE_LATEST)
+        self.assertIn(b'channelservice_sync_rows_total{operation="fetched"}', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_require_token(self):
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer other'}, {'HTTP_AUTHORIZATION': 'secret'}):
+            with self.subTest(headers=headers):
+                response = self.client.get('/metrics', **headers)
+
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_disabled_without_token(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_request_is_measured(self):
+        route = 'api/googlesheets/orders/'
+        labels = {'route': route, 'method': 'GET', 'status': '200'}
+        count = get_sample('channelservice_api_request_seconds_count', **labels)
+        queries = get_sample('channelservice_api_db_queries_total', route=route)
+        self.sync(make_rows(5))
+        response = self.client.get(ORDERS_URL, {'page_size': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_sample('channelservice_api_request_seconds_count', **labels) - count, 1)
+        # Запросы выполняются в потоке пула, но учитываются в ответе.
+        self.assertGreater(get_sample('channelservice_api_db_queries_total', route=route), queries)
+
+    def test_streamed_response_is_measured_after_reading(self):
+        route = 'api/googlesheets/orders/'
+        labels = {'route': route, 'method': 'GET', 'status': '200'}
+        count = get_sample('channelservice_api_request_seconds_count', **labels)
+        self.sync(make_rows(5))
+        response = self.client.get(ORDERS_URL)
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(get_sample('channelservice_api_request_seconds_count', **labels) - count, 0)
+        b''.join(response.streaming_content)
+        self.assertEqual(get_sample('channelservice_api_request_seconds_count', **labels) - count, 1)
+
+
+class DbThreadsTests(APITestCase):
+    """Тесты выполнения представлений API в пуле потоков запросов к БД"""
+
+    def test_function_runs_in_db_thread(self):
+        def get_thread() -> Dict[str, Any]:
+            return {
+                'name': threading.current_thread().name,
+                'conn_max_age': connections['default'].settings_dict['CONN_MAX_AGE'],
+            }
+
+        thread = asyncio.run(run_in_db_thread(get_thread))
+
+        self.assertTrue(thread['name'].startswith('db'))
+        self.assertEqual(thread['conn_max_age'], 0)
+
+    def test_only_get_is_allowed(self):
+        response = self.client.post(ORDERS_URL)
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response['Allow'], 'GET')
+
+    @staticmethod
+    def request_asgi(sent: List[Dict[str, Any]], send_limit: Optional[int] = None) -> None:
+        """
+        Запрос потоковой выдачи заказов через ASGI-приложение сервиса.
+
+        :param sent: Список, в который добавляются сообщения ASGI клиенту.
+        :param send_limit: Количество сообщений, после которого клиент
+            отключается.
+        """
+
+        async def receive() -> Dict[str, Any]:
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message: Dict[str, Any]) -> None:
+            if send_limit is not None and len(sent) >= send_limit:
+                raise OSError('клиент отключился')
+            sent.append(message)
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': ORDERS_URL,
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+        }
+        asyncio.run(application(scope, receive, send))
+
+    def patch_stream(self, fail_after: Optional[int] = None):
+        """
+        Подмена генератора потоковой выдачи, который запоминает потоки чтения.
+
+        :param fail_after: Количество частей, после которого чтение
+            завершается ошибкой.
+        :return: Контекстный менеджер подмены.
+        """
+
+        self.threads = []
+        self.closed_in = []
+
+        def iter_parts(*args, **kwargs) -> Iterator[bytes]:
+            try:
+                for index, part in enumerate(iter_json_object(*args, chunk_size=5, **kwargs)):
+                    if index == fail_after:
+                        raise RuntimeError('ошибка чтения')
+                    self.threads.append(threading.current_thread().name)
+                    yield part
+            finally:
+                self.closed_in.append(threading.current_thread().name)
+
+        return mock.patch.object(views, 'iter_json_object', iter_parts)
+
+    def test_streamed_parts_are_read_in_one_db_thread(self):
+        self.sync(make_rows(30))
+        sent: List[Dict[str, Any]] = []
+        with self.patch_stream(), mock.patch.object(views.OrdersAPIView, 'stream_chunk_size', 10):
+            self.request_asgi(sent)
+
+        start, *body = sent
+        self.assertEqual(start['status'], 200)
+        self.assertFalse(body[-1].get('more_body', False))
+        data = json.loads(b''.join(part.get('body', b'') for part in body))
+        self.assertEqual(data['orders'], self.serialize_orders(Order.objects.all()))
+        # Курсор читается до конца в одном потоке пула.
+        self.assertGreater(len(self.threads), 3)
+        self.assertEqual(set(self.threads), set(self.closed_in))
+        self.assertEqual(len(set(self.threads)), 1)
+        self.assertTrue(self.threads[0].startswith('db'))
+
+    def test_read_error_breaks_response(self):
+        self.sync(make_rows(30))
+        sent: List[Dict[str, Any]] = []
+        with self.patch_stream(fail_after=2), self.assertRaisesMessage(RuntimeError, 'ошибка чтения'):
+            self.request_asgi(sent)
+
+        # Ответ не завершен: клиент видит разрыв, а не укороченный ответ.
+        self.assertEqual(len(sent), 3)
+        self.assertTrue(sent[-1]['more_body'])
+
+    def test_disconnect_closes_stream(self):
+        self.sync(make_rows(30))
+        sent: List[Dict[str, Any]] = []
+        with self.patch_stream(), mock.patch.object(views.OrdersAPIView, 'stream_chunk_size', 10), \
+                self.assertRaises(OSError):
+            self.request_asgi(sent, send_limit=2)
+
+        self.assertEqual(len(sent), 2)
+        # Чтение остановлено, а генератор закрыт в потоке, который его читал.
+        self.assertLess(len(self.threads), 5)
+        self.assertEqual(self.closed_in, self.threads[:1])
+
+
+@mock.patch('channelservice.db_router.has_replica', return_value=True)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Тесты выбора БД для чтения при заданной реплике"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_outside_requests_use_primary(self, has_replica):
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+        with use_replica(), use_primary():
+            self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_request_reads_use_replica(self, has_replica):
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Order), 'replica')
+            # Сессии, которой еще нет в реплике, клиент лишился бы.
+            self.assertEqual(self.router.db_for_read(Session), 'default')
+
+    def test_reads_after_write_use_primary(self, has_replica):
+        with use_replica():
+            self.assertEqual(self.router.db_for_write(Order), 'default')
+            self.assertEqual(self.router.db_for_read(Order), 'default')
+
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Order), 'replica')
+
+    def test_pinned_primary_is_read(self, has_replica):
+        pin_primary()
+
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_replica_is_not_migrated(self, has_replica):
+        self.assertIs(self.router.allow_migrate('replica', 'googlesheets'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'googlesheets'))
+
+    def request(self, method: str, **cookies: str) -> HttpResponse:
+        """
+        Запрос через промежуточный слой выбора БД.
+
+        :param method: Метод запроса.
+        :param cookies: Cookie клиента.
+        :return: Ответ с БД, из которой читаются заказы, в содержимом.
+        """
+
+        factory = RequestFactory()
+        factory.cookies.load(cookies)
+        request = factory.generic(method, ORDERS_URL)
+        middleware = ReplicaReadsMiddleware(lambda request: HttpResponse(self.router.db_for_read(Order)))
+
+        return middleware(request)
+
+    def test_middleware_reads_replica(self, has_replica):
+        response = self.request('GET')
+
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_middleware_pins_client_after_write(self, has_replica):
+        response = self.request('POST')
+
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(response.cookies[PRIMARY_PIN_COOKIE]['max-age'], settings.SQL_REPLICA_MAX_LAG)
+
+        response = self.request('GET', **{PRIMARY_PIN_COOKIE: '1'})
+        self.assertEqual(response.content, b'default')
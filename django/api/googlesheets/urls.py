@@ -1,8 +1,18 @@
 from django.urls import path
 
-from .views import OrdersAPIView
+from .views import (
+    AsyncAPIView,
+    OrdersAPIView,
+    OrderChangesAPIView,
+    OrderSummaryAPIView,
+    OrderChartAPIView,
+)
 
 
+# Представления API выполняются в потоках пула запросов к БД.
 urlpatterns = [
-    path('orders/', OrdersAPIView.as_view()),
+    path('orders/', AsyncAPIView.as_view(api_view=OrdersAPIView.as_view())),
+    path('orders/changes/', AsyncAPIView.as_view(api_view=OrderChangesAPIView.as_view())),
+    path('orders/summary/', AsyncAPIView.as_view(api_view=OrderSummaryAPIView.as_view())),
+    path('orders/chart/', AsyncAPIView.as_view(api_view=OrderChartAPIView.as_view())),
 ]
@@ -1,30 +1,484 @@
+import hashlib
+from decimal import Decimal
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+from rest_framework import status
 from rest_framework.generics import ListAPIView
+from rest_framework.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
-from django.db.models import Sum
+from django.db.models import (
+    Sum,
+    QuerySet,
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBase
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.http import parse_etags
 
-from googlesheets.models import Order
-from .serializers import OrderSerializer
+from googlesheets.models import (
+    Order,
+    OrderDaySummary,
+    OrderTombstone,
+    SyncRevision,
+)
+from googlesheets.change_log import SYNC_REVISION_PK
+from googlesheets.order_summary import (
+    get_summary,
+    get_bucket_totals,
+)
+from googlesheets.downsampling import lttb
+from googlesheets.sync_version import get_sync_version
+from .serializers import (
+    OrderSerializer,
+    OrderFilterSerializer,
+    OrderTombstoneSerializer,
+    OrderChangesFilterSerializer,
+    OrderSummaryFilterSerializer,
+    OrderSummarySerializer,
+    OrderChartFilterSerializer,
+    OrderChartSerializer,
+)
+from .pagination import KeysetPagination
+from .db_threads import run_in_db_thread
+from .streaming import (
+    RowEncoder,
+    iter_json_object,
+)
 
 
 class OrdersAPIView(ListAPIView):
-    """API для получения списка заказов"""
+    """
+    API для получения списка заказов.
+
+    Поддерживает фильтрацию по источнику данных (source), номеру заказа
+    (order_number), диапазону сроков поставки (delivery_from, delivery_to)
+    и просрочке (overdue), а также постраничную выдачу по курсору
+    (cursor, page_size).
+
+    Ответ кэшируется в общем кэше под версией данных о заказах, которая
+    меняется только при их изменении. ETag ответа строится из версии и
+    запроса без обращения к БД, поэтому на запрос с If-None-Match
+    с той же версией сразу отдается 304.
+
+    Без постраничной выдачи заказы читаются из БД кортежами и отдаются
+    потоком по мере кодирования в JSON, минуя сериализатор.
+    """
 
     http_method_names = ('get', )
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
+    # Кодирование заказов для потоковой выдачи. Поля совпадают с полями
+    # сериализатора.
+    order_encoder = RowEncoder(Order, OrderSerializer.Meta.fields)
+    # Количество заказов, читаемых из БД за раз при потоковой выдаче.
+    stream_chunk_size = 2000
 
-    def get(self, request: Request, *args, **kwargs) -> Response:
+    def get(self, request: Request, *args, **kwargs) -> HttpResponseBase:
         """Получение списка заказов и суммы всех заказов в долларах"""
 
-        # Получим объект ответа с сериализованным списком заказов.
-        response = super(OrdersAPIView, self).get(request, *args, **kwargs)
+        # Запрос зависит от текущей даты из-за фильтра просрочки, а ссылка
+        # на следующую страницу - от адреса сервиса.
+        request_hash = hashlib.sha256(
+            f'{timezone.localdate()}:{request.build_absolute_uri()}'.encode()
+        ).hexdigest()[:32]
+        version = get_sync_version()
+        etag = f'"{version}-{request_hash}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        # Клиент уже получил эту версию ответа.
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if not self.paginator.is_requested(request):
+            return self.stream_orders(f'orders-api-stream:{version}:{request_hash}', headers)
+
+        cache_key = f'orders-api:{version}:{request_hash}'
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.get_orders_data(request)
+            cache.set(cache_key, data, settings.ORDERS_API_CACHE_TIMEOUT)
+
+        return Response(data=data, headers=headers)
+
+    def get_orders_data(self, request: Request) -> Dict[str, Any]:
+        """
+        Получение данных страницы заказов из БД.
+
+        Сумма считается только для первой страницы, также в ответ
+        добавляется ссылка на следующую страницу.
+
+        :param request: Объект запроса.
+        :return: Данные ответа.
+        """
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+
+        data = {}
+        if KeysetPagination.cursor_query_param not in request.query_params:
+            # Вычислим общую сумму заказов в долларах и добавим в ответ.
+            data['total_dollars'] = self.get_total_dollars(queryset)
+        data['orders'] = self.get_serializer(page, many=True).data
+        data['next'] = self.paginator.get_next_link()
+
+        return data
+
+    def stream_orders(self, cache_key: str, headers: Dict[str, str]) -> HttpResponseBase:
+        """
+        Потоковая выдача всех заказов.
+
+        Готовый JSON кэшируется целиком, если его размер не больше
+        ORDERS_API_STREAM_CACHE_MAX_SIZE. Ответы большего размера
+        каждый раз собираются заново, но не занимают память целиком.
+
+        :param cache_key: Ключ ответа в кэше.
+        :param headers: Заголовки ответа.
+        :return: Объект ответа.
+        """
+
+        content = cache.get(cache_key)
+        if content is not None:
+            return HttpResponse(content, content_type='application/json', headers=headers)
+
+        # Параметры проверяются и сумма считается до начала выдачи, чтобы
+        # ошибка вернулась обычным ответом.
+        queryset = self.filter_queryset(self.get_queryset())
+        head = {'total_dollars': self.get_total_dollars(queryset)}
+        # Порядок совпадает с порядком постраничной выдачи и однозначен.
+        # Части ответа читаются после выхода из представления, поэтому БД
+        # для чтения выбирается сейчас (см. channelservice.db_router).
+        rows = queryset \
+            .using(queryset.db) \
+            .order_by(*KeysetPagination.ordering) \
+            .values_list(*self.order_encoder.fields) \
+            .iterator(chunk_size=self.stream_chunk_size)
+
+        return StreamingHttpResponse(
+            self._cache_content(
+                iter_json_object(head, 'orders', rows, self.order_encoder),
+                cache_key,
+            ),
+            content_type='application/json',
+            headers=headers,
+        )
+
+    def get_total_dollars(self, queryset: QuerySet) -> Optional[Decimal]:
+        """
+        Получение суммы отфильтрованных заказов в долларах.
+
+        Без фильтра по номеру заказа сумма складывается из сводок по дням,
+        а не из всех заказов.
+
+        :param queryset: Отфильтрованный QuerySet заказов.
+        :return: Сумма в долларах или None, если заказов нет.
+        """
+
+        if 'order_number' in self.filter_params:
+            return queryset.aggregate(Sum('dollars'))['dollars__sum']
+
+        return filter_day_summaries(
+            OrderDaySummary.objects.all(),
+            self.filter_params,
+        ).aggregate(Sum('total_dollars'))['total_dollars__sum']
+
+    @staticmethod
+    def _cache_content(chunks: Iterator[bytes], cache_key: str) -> Iterator[bytes]:
+        """
+        Передача частей ответа с сохранением ответа в кэш после выдачи.
+
+        :param chunks: Части ответа.
+        :param cache_key: Ключ ответа в кэше.
+        :return: Итератор по частям ответа.
+        """
+
+        max_size = settings.ORDERS_API_STREAM_CACHE_MAX_SIZE
+        parts: Optional[List[bytes]] = []
+        size = 0
+
+        for chunk in chunks:
+            if parts is not None:
+                size += len(chunk)
+                if size <= max_size:
+                    parts.append(chunk)
+                else:
+                    # Слишком большой ответ не кэшируем и не копим.
+                    parts = None
+            yield chunk
+
+        if parts is not None:
+            cache.set(cache_key, b''.join(parts), settings.ORDERS_API_CACHE_TIMEOUT)
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        """
+        Фильтрация заказов по параметрам запроса.
+
+        :param queryset: QuerySet заказов.
+        :return: Отфильтрованный QuerySet заказов.
+        """
+
+        filters = OrderFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = self.filter_params = filters.validated_data
+
+        if 'source' in params:
+            queryset = queryset.filter(source_id=params['source'])
+        if 'order_number' in params:
+            queryset = queryset.filter(order_number=params['order_number'])
+        if 'delivery_from' in params:
+            queryset = queryset.filter(delivery_time__gte=params['delivery_from'])
+        if 'delivery_to' in params:
+            queryset = queryset.filter(delivery_time__lte=params['delivery_to'])
+        if params.get('overdue') is True:
+            queryset = queryset.filter(delivery_time__lt=timezone.localdate())
+        elif params.get('overdue') is False:
+            queryset = queryset.filter(delivery_time__gte=timezone.localdate())
+
+        return queryset
+
+
+class OrderChangesAPIView(APIView):
+    """
+    API ленты изменений заказов.
+
+    Возвращает заказы, измененные после ревизии since, и записи об
+    удалении заказов, а также текущую ревизию, которую клиент передает
+    в следующем запросе. Если since не указан или клиент отстал больше,
+    чем хранится лента (или все заказы изменились после пересчета
+    рублей), возвращаются все заказы и признак reset: клиент должен
+    заменить ими свой список. Такой ответ выдается потоком, как полный
+    список в API заказов, и не собирается в памяти. Сумма заказов
+    в долларах (total_dollars) возвращается всегда.
+    """
+
+    http_method_names = ('get', )
+
+    def get(self, request: Request, *args, **kwargs) -> HttpResponseBase:
+        """Получение изменений заказов после указанной ревизии"""
+
+        params_serializer = OrderChangesFilterSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+
+        # Изменения читаются не дальше текущей ревизии: более поздние
+        # клиент получит в следующем запросе.
+        counter = SyncRevision.objects.get(pk=SYNC_REVISION_PK)
+        orders = Order.objects.all()
+        tombstones = OrderTombstone.objects.all()
+        summaries = OrderDaySummary.objects.all()
+        if 'source' in params:
+            orders = orders.filter(source_id=params['source'])
+            tombstones = tombstones.filter(source_id=params['source'])
+            summaries = summaries.filter(source_id=params['source'])
+        total_dollars = summaries.aggregate(Sum('total_dollars'))['total_dollars__sum']
+
+        since = params.get('since')
+        if since is None or since < counter.reset_value:
+            return self.stream_reset(orders, counter.value, total_dollars)
+
+        orders = orders \
+            .filter(revision__gt=since, revision__lte=counter.value) \
+            .order_by('revision', 'id')
+        deleted = tombstones \
+            .filter(revision__gt=since, revision__lte=counter.value) \
+            .order_by('revision', 'id')
 
-        # Вычислим общую сумму заказов в долларах и добавим в ответ.
-        total_dollars = self.get_queryset().aggregate(Sum('dollars'))['dollars__sum']
         data = {
+            'revision': counter.value,
+            'reset': False,
+            'upserted': OrderSerializer(orders, many=True).data,
+            'deleted': OrderTombstoneSerializer(deleted, many=True).data,
             'total_dollars': total_dollars,
-            'orders': response.data,
         }
 
-        return Response(data=data)
+        return Response(data=data, headers={'Cache-Control': 'no-cache'})
+
+    @staticmethod
+    def stream_reset(
+            orders: QuerySet,
+            revision: int,
+            total_dollars: Optional[Decimal],
+    ) -> StreamingHttpResponse:
+        """
+        Потоковая выдача всех заказов вместо изменений.
+
+        Заказы кодируются так же, как в потоковой выдаче API заказов.
+        Заказы, измененные после revision, попадут в ответ уже новыми,
+        а в следующем запросе придут еще раз, что клиенту не мешает.
+
+        :param orders: QuerySet заказов с фильтром по источнику.
+        :param revision: Текущая ревизия.
+        :param total_dollars: Сумма заказов в долларах.
+        :return: Объект ответа.
+        """
+
+        head = {
+            'revision': revision,
+            'reset': True,
+            'deleted': [],
+            'total_dollars': total_dollars,
+        }
+        encoder = OrdersAPIView.order_encoder
+        # Части ответа читаются после выхода из представления, поэтому БД
+        # для чтения выбирается сейчас (см. channelservice.db_router).
+        rows = orders \
+            .using(orders.db) \
+            .order_by(*KeysetPagination.ordering) \
+            .values_list(*encoder.fields) \
+            .iterator(chunk_size=OrdersAPIView.stream_chunk_size)
+
+        return StreamingHttpResponse(
+            iter_json_object(head, 'upserted', rows, encoder),
+            content_type='application/json',
+            headers={'Cache-Control': 'no-cache'},
+        )
+
+
+class OrderSummaryAPIView(APIView):
+    """
+    API сводки по заказам.
+
+    Возвращает количество заказов и просроченных заказов, суммы
+    в долларах и рублях, максимальную стоимость заказа и суммы по дням
+    поставки. Все значения складываются из сводок по дням, которые
+    пересчитываются при синхронизации, поэтому время ответа не зависит
+    от количества заказов. Поддерживает фильтрацию по источнику данных
+    (source) и диапазону сроков поставки (delivery_from, delivery_to).
+    """
+
+    http_method_names = ('get', )
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        """Получение сводки по заказам"""
+
+        params_serializer = OrderSummaryFilterSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+
+        summaries = filter_day_summaries(
+            OrderDaySummary.objects.all(),
+            params_serializer.validated_data,
+        )
+        summary = get_summary(summaries, timezone.localdate())
+        summary['days'] = get_bucket_totals(summaries)
+
+        return Response(
+            data=OrderSummarySerializer(summary).data,
+            headers={'Cache-Control': 'no-cache'},
+        )
+
+
+class OrderChartAPIView(APIView):
+    """
+    API графика сумм заказов по срокам поставки.
+
+    Возвращает итоги по дням, неделям или месяцам поставки (bucket),
+    собранные из сводок по дням, поэтому размер ответа зависит от
+    количества периодов, а не заказов. Если передан points, ряд
+    прореживается алгоритмом LTTB до points точек с сохранением формы
+    графика сумм в долларах. Поддерживает те же фильтры, что и сводка.
+    """
+
+    http_method_names = ('get', )
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        """Получение точек графика заказов"""
+
+        params_serializer = OrderChartFilterSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+
+        summaries = filter_day_summaries(OrderDaySummary.objects.all(), params)
+        points = get_bucket_totals(summaries, params['bucket'])
+        if 'points' in params:
+            points = lttb(
+                points,
+                params['points'],
+                x=lambda point: point['delivery_time'].toordinal(),
+                y=lambda point: float(point['total_dollars']),
+            )
+
+        return Response(
+            data=OrderChartSerializer({'bucket': params['bucket'], 'points': points}).data,
+            headers={'Cache-Control': 'no-cache'},
+        )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    Асинхронное представление, выполняющее представление API в потоке
+    пула запросов к БД.
+
+    Пока представление API ждет БД в потоке пула, цикл событий обслуживает
+    другие запросы, а соединения с БД потоков пула переиспользуются между
+    запросами (см. run_in_db_thread). Ответ собирается в том же потоке,
+    поэтому совпадает с ответом представления API. Части потокового ответа
+    читаются в том же пуле потоков (см. channelservice.asgi). Проверку
+    CSRF, как и DRF, выполняет представление API.
+
+    Использование: AsyncAPIView.as_view(api_view=OrdersAPIView.as_view()).
+    """
+
+    http_method_names = ['get']
+    # Представление API, которое выполняется в потоке пула.
+    api_view: Optional[Callable[..., HttpResponseBase]] = None
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponseBase:
+        """Получение ответа представления API"""
+
+        return await run_in_db_thread(self._get_response, request, *args, **kwargs)
+
+    def _get_response(self, request: HttpRequest, *args, **kwargs) -> HttpResponseBase:
+        """
+        Получение и сборка ответа представления API.
+
+        :param request: Объект запроса.
+        :return: Объект ответа.
+        """
+
+        response = self.api_view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+
+        return response
+
+
+def filter_day_summaries(summaries: QuerySet, params: Dict[str, Any]) -> QuerySet:
+    """
+    Фильтрация сводок по дням по параметрам фильтрации заказов.
+
+    Фильтр по номеру заказа к сводкам не применим и не учитывается.
+
+    :param summaries: QuerySet сводок по дням.
+    :param params: Проверенные параметры запроса.
+    :return: Отфильтрованный QuerySet сводок.
+    """
+
+    if 'source' in params:
+        summaries = summaries.filter(source_id=params['source'])
+    if 'delivery_from' in params:
+        summaries = summaries.filter(delivery_time__gte=params['delivery_from'])
+    if 'delivery_to' in params:
+        summaries = summaries.filter(delivery_time__lte=params['delivery_to'])
+    if params.get('overdue') is True:
+        summaries = summaries.filter(delivery_time__lt=timezone.localdate())
+    elif params.get('overdue') is False:
+        summaries = summaries.filter(delivery_time__gte=timezone.localdate())
+
+    return summaries
@@ -8,9 +8,134 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
 
 import os
+import asyncio
+import threading
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'channelservice.settings')
 
-application = get_asgi_application()
+# Признак конца потокового ответа в очереди частей.
+_END = object()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGI-обработчик Django, который читает потоковые ответы вне цикла событий.
+
+    Django 4.1 перебирает потоковый ответ прямо в цикле событий, поэтому
+    генератор, читающий из БД, падает с SynchronousOnlyOperation, а долгий
+    генератор блокирует остальные соединения. Здесь весь потоковый ответ
+    читается одним вызовом в пуле потоков запросов к БД, в котором
+    выполняются представления API (api.googlesheets.db_threads): курсор,
+    открытый первой частью, до конца читается в том же потоке и через то же
+    соединение, а соединения потока проверяются только до и после чтения.
+    Части разных ответов читаются параллельно, а не по очереди в общем
+    синхронном потоке Django. Поток пула передает части по одной и ждет,
+    пока предыдущая уйдет клиенту, поэтому ответ не копится в памяти.
+
+    Если чтение ответа завершилось ошибкой, ответ обрывается без последней
+    части, и клиент видит разрыв соединения, а не укороченный ответ.
+    """
+
+    async def send_response(self, response, send):
+        """Отправка ответа по ASGI"""
+
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append(
+                (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            )
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+
+        loop = asyncio.get_running_loop()
+        parts: asyncio.Queue = asyncio.Queue(maxsize=1)
+        stopped = threading.Event()
+        reader = asyncio.ensure_future(
+            run_in_db_thread(self._read_parts, response, parts, loop, stopped)
+        )
+        try:
+            while (part := await parts.get()) is not _END:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            # Ошибка чтения обрывает ответ без последней части.
+            await reader
+            await send({'type': 'http.response.body'})
+        finally:
+            stopped.set()
+            # Освободим поток пула, если он ждет места в очереди.
+            while not reader.done():
+                getter = asyncio.ensure_future(parts.get())
+                await asyncio.wait((reader, getter), return_when=asyncio.FIRST_COMPLETED)
+                getter.cancel()
+
+    @staticmethod
+    def _read_parts(
+            response,
+            parts: asyncio.Queue,
+            loop: asyncio.AbstractEventLoop,
+            stopped: threading.Event,
+    ) -> None:
+        """
+        Чтение всех частей потокового ответа в одном потоке пула.
+
+        :param response: Потоковый ответ.
+        :param parts: Очередь частей ответа, в конце - _END.
+        :param loop: Цикл событий, который отправляет части клиенту.
+        :param stopped: Признак того, что части больше не отправляются.
+        """
+
+        def put(part) -> None:
+            asyncio.run_coroutine_threadsafe(parts.put(part), loop).result()
+
+        try:
+            for part in response:
+                if stopped.is_set():
+                    break
+                put(part)
+        finally:
+            try:
+                # Курсор закрывается в потоке, в котором его открыли.
+                response.close()
+            finally:
+                put(_END)
+
+
+django.setup(set_prefix=False)
+django_application = StreamingASGIHandler()
+
+# Импорт после настройки Django: приложению нужны настройки проекта.
+from api.googlesheets.db_threads import run_in_db_thread  # noqa: E402
+from api.googlesheets.events import OrderEventsApp  # noqa: E402
+
+# Адрес потока событий об изменениях заказов.
+ORDER_EVENTS_PATH = '/api/googlesheets/orders/events/'
+
+order_events_application = OrderEventsApp()
+
+
+async def application(scope, receive, send):
+    """Передача потока событий заказов OrderEventsApp, остальных запросов - Django"""
+
+    if scope['type'] == 'http' and scope['path'] == ORDER_EVENTS_PATH:
+        return await order_events_application(scope, receive, send)
+
+    return await django_application(scope, receive, send)
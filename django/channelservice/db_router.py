@@ -0,0 +1,249 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Callable,
+    Iterator,
+    Optional,
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connections,
+)
+
+
+# Основная БД, в которую пишут синхронизация, уведомления и админка.
+PRIMARY_DB = DEFAULT_DB_ALIAS
+# Реплика для чтения, если задан SQL_REPLICA_URL.
+REPLICA_DB = 'replica'
+
+# Ключ в общем кэше: пока он есть, все запросы читают из основной БД.
+PRIMARY_PIN_KEY = 'db-primary-pinned'
+# Cookie клиента, который недавно изменял данные: пока она есть,
+# его запросы читают из основной БД.
+PRIMARY_PIN_COOKIE = 'db_primary_pinned'
+
+# Приложения, чьи данные всегда читаются из основной БД: сессия, которой
+# еще нет в реплике, считается недействительной, и клиент выходит из
+# админки.
+PRIMARY_APP_LABELS = ('sessions', )
+
+# Методы запросов, которые не изменяют данные.
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def has_replica() -> bool:
+    """Задана ли реплика для чтения"""
+
+    return REPLICA_DB in settings.DATABASES
+
+
+def pin_primary() -> None:
+    """
+    Чтение из основной БД во всех процессах на SQL_REPLICA_MAX_LAG секунд.
+
+    Вызывается после фиксации изменений заказов, чтобы клиенты, узнавшие
+    о новой версии данных, не прочитали из реплики старые данные,
+    а кэш ответов API не сохранил их под новой версией.
+    """
+
+    if has_replica():
+        cache.set(PRIMARY_PIN_KEY, True, timeout=settings.SQL_REPLICA_MAX_LAG)
+
+
+class ReplicaReads:
+    """
+    Разрешение читать из реплики в текущем запросе.
+
+    Общий кэш проверяется один раз при первом чтении, а после первой
+    записи запрос до конца читает из основной БД.
+    """
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self.__allowed: Optional[bool] = None
+
+    def is_allowed(self) -> bool:
+        """Можно ли читать из реплики"""
+
+        if self.__allowed is None:
+            self.__allowed = cache.get(PRIMARY_PIN_KEY) is None
+
+        return self.__allowed
+
+    def revoke(self) -> None:
+        """Запрет чтения из реплики до конца запроса"""
+
+        self.__allowed = False
+
+
+# Разрешение читать из реплики. Вне запросов к сервису, например,
+# в задачах Celery, все чтение идет из основной БД.
+_replica_reads: ContextVar[Optional[ReplicaReads]] = ContextVar('replica_reads', default=None)
+
+
+@contextmanager
+def use_replica() -> Iterator[None]:
+    """Чтение из реплики в блоке with, если данные не менялись недавно"""
+
+    token = _replica_reads.set(ReplicaReads())
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def use_primary() -> Iterator[None]:
+    """Чтение из основной БД в блоке with"""
+
+    token = _replica_reads.set(None)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Маршрутизатор запросов между основной БД и репликой.
+
+    Запись всегда идет в основную БД. Чтение идет в реплику только
+    внутри use_replica() (см. ReplicaReadsMiddleware) и только если:
+    - реплика задана;
+    - это не сессии (PRIMARY_APP_LABELS);
+    - нет открытой транзакции в основной БД;
+    - в этом запросе еще не было записи;
+    - данные не менялись последние SQL_REPLICA_MAX_LAG секунд
+      (см. pin_primary()).
+    Так синхронизация и уведомления о просрочке читают то, что только
+    что записали, а API и админка не нагружают основную БД.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        if not has_replica():
+            return None
+
+        replica_reads = _replica_reads.get()
+        if replica_reads is None \
+                or model._meta.app_label in PRIMARY_APP_LABELS \
+                or connections[PRIMARY_DB].in_atomic_block \
+                or not replica_reads.is_allowed():
+            return PRIMARY_DB
+
+        return REPLICA_DB
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        if not has_replica():
+            return None
+
+        replica_reads = _replica_reads.get()
+        if replica_reads is not None:
+            replica_reads.revoke()
+
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # Реплика - копия основной БД.
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY_DB, REPLICA_DB}:
+            return True
+
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, model_name=None, **hints) -> Optional[bool]:
+        # Схема реплики приходит из основной БД.
+        if db == REPLICA_DB:
+            return False
+
+        return None
+
+
+class ReplicaReadsMiddleware:
+    """
+    Промежуточный слой выбора БД для чтения.
+
+    Запросы, которые не изменяют данные, читают из реплики. После
+    запроса, изменяющего данные, клиент получает cookie, и его запросы
+    читают из основной БД еще SQL_REPLICA_MAX_LAG секунд, чтобы он
+    увидел свои изменения, например, в админке после сохранения.
+    Без реплики ничего не делает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable) -> None:
+        """
+        Инициализатор класса.
+
+        :param get_response: Следующий обработчик запроса.
+        """
+
+        self.get_response = get_response
+        self.__is_async = asyncio.iscoroutinefunction(get_response)
+        if self.__is_async:
+            # Признак асинхронного обработчика для Django, как
+            # у MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.__is_async:
+            return self.__acall__(request)
+
+        if not has_replica():
+            return self.get_response(request)
+
+        if self._reads_replica(request):
+            with use_replica():
+                return self.get_response(request)
+
+        return self._pin_client(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        """Обработка запроса в асинхронной цепочке обработчиков"""
+
+        if not has_replica():
+            return await self.get_response(request)
+
+        if self._reads_replica(request):
+            with use_replica():
+                return await self.get_response(request)
+
+        return self._pin_client(request, await self.get_response(request))
+
+    @staticmethod
+    def _reads_replica(request) -> bool:
+        """
+        Может ли запрос читать из реплики.
+
+        :param request: Объект запроса.
+        :return: True, если запрос не изменяет данные и клиент
+            не изменял их недавно.
+        """
+
+        return request.method in SAFE_METHODS \
+            and PRIMARY_PIN_COOKIE not in request.COOKIES
+
+    @staticmethod
+    def _pin_client(request, response):
+        """
+        Чтение из основной БД для клиента, который изменял данные.
+
+        :param request: Объект запроса.
+        :param response: Объект ответа.
+        :return: Объект ответа.
+        """
+
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE,
+                '1',
+                max_age=settings.SQL_REPLICA_MAX_LAG,
+                httponly=True,
+                samesite='Lax',
+            )
+
+        return response
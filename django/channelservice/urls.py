@@ -20,7 +20,10 @@ from django.urls import (
     include,
 )
 
+from googlesheets.views import metrics_view
+
 urlpatterns = [
     path('api/', include('api.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view),
 ]
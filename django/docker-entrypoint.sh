@@ -0,0 +1,12 @@
+#!/bin/sh
+# Каталог метрик Prometheus процессов службы очищается перед запуском:
+# файлы процессов прошлого запуска исказили бы собранные значения.
+# Каталоги других служб в общем томе не затрагиваются.
+set -e
+
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
@@ -1,6 +1,21 @@
+from collections import defaultdict
+from typing import Iterable
 from django.contrib import admin
+from django.db import transaction
 
-from .models import Order
+from .models import (
+    Order,
+    SheetSource,
+    CurrencyRate,
+    QuarantinedRow,
+)
+from .sync_version import bump_sync_version
+from .change_log import (
+    commit_revision,
+    create_tombstones,
+    reset_revision,
+)
+from .order_summary import refresh_day_summaries
 
 
 @admin.register(Order)
@@ -8,5 +23,126 @@ class OrderAdmin(admin.ModelAdmin):
     """Класс администрации данных о заказах"""
 
     list_display = ('order_number', 'delivery_time',
-                    'dollars', 'rubles')
+                    'dollars', 'rubles', 'source')
     list_display_links = ('order_number', )
+    list_filter = ('source', )
+    list_select_related = ('source', )
+
+    def save_model(self, request, obj, form, change) -> None:
+        """Сохранение заказа и смена версии данных о заказах"""
+
+        with transaction.atomic():
+            # Прежние источник и срок поставки нужны для пересчета сводок.
+            previous = Order.objects \
+                .filter(pk=obj.pk) \
+                .values_list('source_id', 'delivery_time') \
+                .first() if change else None
+
+            obj.revision = None
+            # Следующая синхронизация перезапишет заказ строкой таблицы.
+            obj.digest = ''
+            super().save_model(request, obj, form, change)
+
+            vacated_days = []
+            if previous is not None:
+                previous_source_id, previous_day = previous
+                if previous_source_id == obj.source_id:
+                    vacated_days.append(previous_day)
+                else:
+                    refresh_day_summaries(previous_source_id, [previous_day])
+                    self._reset_fingerprints([previous_source_id])
+            refresh_day_summaries(obj.source_id, vacated_days)
+            self._reset_fingerprints([obj.source_id])
+            commit_revision(obj.source_id)
+        bump_sync_version()
+
+    def delete_model(self, request, obj) -> None:
+        """Удаление заказа и смена версии данных о заказах"""
+
+        with transaction.atomic():
+            create_tombstones(Order.objects.filter(pk=obj.pk))
+            super().delete_model(request, obj)
+            refresh_day_summaries(obj.source_id, [obj.delivery_time])
+            self._reset_fingerprints([obj.source_id])
+            commit_revision(obj.source_id)
+        bump_sync_version()
+
+    def delete_queryset(self, request, queryset) -> None:
+        """Удаление заказов и смена версии данных о заказах"""
+
+        with transaction.atomic():
+            vacated_days = defaultdict(set)
+            for source_id, delivery_time in queryset \
+                    .order_by() \
+                    .values_list('source_id', 'delivery_time') \
+                    .distinct():
+                vacated_days[source_id].add(delivery_time)
+
+            create_tombstones(queryset)
+            super().delete_queryset(request, queryset)
+            self._reset_fingerprints(vacated_days.keys())
+            for source_id in sorted(vacated_days):
+                refresh_day_summaries(source_id, vacated_days[source_id])
+                commit_revision(source_id)
+        bump_sync_version()
+
+    @staticmethod
+    def _reset_fingerprints(source_ids: Iterable[int]) -> None:
+        """
+        Сброс отпечатков данных источников.
+
+        Без отпечатка следующая синхронизация сравнит строки таблицы
+        с заказами, даже если таблица не менялась, и вернет заказы,
+        измененные или удаленные в админке.
+
+        :param source_ids: id источников данных.
+        """
+
+        SheetSource.objects.filter(pk__in=source_ids).update(fingerprint='')
+
+
+@admin.register(SheetSource)
+class SheetSourceAdmin(admin.ModelAdmin):
+    """Класс администрации источников данных"""
+
+    list_display = ('__str__', 'spreadsheet_id', 'range_name',
+                    'is_active', 'synced_at')
+    list_filter = ('is_active', )
+    readonly_fields = ('fingerprint', 'synced_at', 'rubles_rate')
+
+    def delete_model(self, request, obj) -> None:
+        """Удаление источника данных вместе с его заказами"""
+
+        super().delete_model(request, obj)
+        reset_revision()
+        bump_sync_version()
+
+    def delete_queryset(self, request, queryset) -> None:
+        """Удаление источников данных вместе с их заказами"""
+
+        super().delete_queryset(request, queryset)
+        reset_revision()
+        bump_sync_version()
+
+
+@admin.register(CurrencyRate)
+class CurrencyRateAdmin(admin.ModelAdmin):
+    """Класс администрации истории курсов валют"""
+
+    list_display = ('char_code', 'date', 'value', 'created_at')
+    list_filter = ('char_code', )
+
+
+@admin.register(QuarantinedRow)
+class QuarantinedRowAdmin(admin.ModelAdmin):
+    """Класс администрации строк таблицы с ошибками"""
+
+    list_display = ('position', 'reason', 'values', 'source', 'created_at')
+    list_filter = ('source', )
+    list_select_related = ('source', )
+    readonly_fields = ('source', 'position', 'values', 'reason', 'created_at')
+
+    def has_add_permission(self, request) -> bool:
+        """Строки с ошибками добавляет только синхронизация"""
+
+        return False
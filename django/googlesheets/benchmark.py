@@ -0,0 +1,535 @@
+import re
+import gc
+import inspect
+import time
+import random
+import tracemalloc
+import threading
+from contextlib import contextmanager
+from datetime import (
+    date,
+    timedelta,
+)
+from decimal import Decimal
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from statistics import (
+    median,
+    quantiles,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from . import order_observer
+from .currency_rates import CbrRateProvider
+from .models import SheetSource
+from .order_observer import OrderObserver
+from .row_parser import RowParser
+from .sync_partitions import PartitionedDiff
+
+
+# Заголовок синтетической таблицы.
+SHEET_HEADER = ['№', 'заказ №', 'стоимость,$', 'срок поставки']
+
+
+class SyntheticSheet:
+    """
+    Класс синтетической таблицы заказов.
+
+    Строки генерируются детерминированно по seed, поэтому запуски
+    на разных коммитах работают с одинаковыми данными. Изменения
+    (churn) тоже детерминированы: доля строк изменяется, удаляется
+    и добавляется поровну.
+    """
+
+    # Первый номер заказа синтетической таблицы.
+    FIRST_ORDER_NUMBER = 1000000
+    # Количество дней, по которым распределяются сроки поставки.
+    DELIVERY_DAYS = 365
+
+    def __init__(self, rows: int, seed: int = 0) -> None:
+        """
+        Инициализатор класса.
+
+        :param rows: Количество строк без заголовка.
+        :param seed: Начальное значение генератора случайных чисел.
+        """
+
+        self.__random = random.Random(seed)
+        self.__first_day = date(2022, 1, 1)
+        self.__next_number = 1
+        self.rows: List[List[str]] = [SHEET_HEADER]
+        for _ in range(rows):
+            self.rows.append(self._create_row())
+
+    def apply_churn(self, rate: float) -> int:
+        """
+        Изменение доли строк таблицы.
+
+        Треть затронутых строк получает новую стоимость или срок поставки,
+        треть удаляется, вместо них добавляется столько же новых строк.
+
+        :param rate: Доля изменяемых строк от 0 до 1.
+        :return: Количество затронутых строк.
+        """
+
+        count = int((len(self.rows) - 1) * rate)
+        updated = count - 2 * (count // 3)
+        deleted = count // 3
+
+        for index in self.__random.sample(range(1, len(self.rows)), updated):
+            row = self.rows[index]
+            if self.__random.random() < 0.5:
+                row[2] = self._get_dollars()
+            else:
+                row[3] = self._get_delivery_time()
+
+        for index in sorted(
+                self.__random.sample(range(1, len(self.rows)), deleted),
+                reverse=True,
+        ):
+            del self.rows[index]
+
+        for _ in range(deleted):
+            self.rows.append(self._create_row())
+
+        return updated + 2 * deleted
+
+    def _create_row(self) -> List[str]:
+        """
+        Создание новой строки таблицы.
+
+        :return: Строка таблицы.
+        """
+
+        number = self.__next_number
+        self.__next_number += 1
+
+        return [
+            str(number),
+            str(self.FIRST_ORDER_NUMBER + number),
+            self._get_dollars(),
+            self._get_delivery_time(),
+        ]
+
+    def _get_dollars(self) -> str:
+        """Получение случайной стоимости заказа"""
+
+        return str(self.__random.randint(1, 5000))
+
+    def _get_delivery_time(self) -> str:
+        """Получение случайного срока поставки"""
+
+        day = self.__first_day + timedelta(days=self.__random.randrange(self.DELIVERY_DAYS))
+
+        return day.strftime('%d.%m.%Y')
+
+
+class FakeSheetsService:
+    """
+    Класс подмены объекта подключения к Google Sheets API.
+
+    Поддерживает запросы, которые делают OrderObserver и SheetReader:
+    spreadsheets().values().get, spreadsheets().values().batchGet и
+    spreadsheets().get с количеством строк листа. Ответы копируют строки,
+    как это происходит при разборе JSON-ответа API.
+    """
+
+    # Номера первой и последней строки окна в A1-нотации.
+    WINDOW_PATTERN = re.compile(r'(\d+):[A-Za-z]+(\d+)$')
+
+    class _Request:
+        """Класс запроса к API"""
+
+        def __init__(self, result: Callable[[], Dict[str, Any]]) -> None:
+            self.__result = result
+
+        def execute(self) -> Dict[str, Any]:
+            return self.__result()
+
+    def __init__(self, sheet: SyntheticSheet) -> None:
+        """
+        Инициализатор класса.
+
+        :param sheet: Синтетическая таблица.
+        """
+
+        self.__sheet = sheet
+        # Суммарное время выполнения запросов в секундах.
+        self.elapsed = 0.0
+
+    def spreadsheets(self) -> 'FakeSheetsService':
+        return self
+
+    def values(self) -> 'FakeSheetsService':
+        return self
+
+    def get(self, spreadsheetId: str, range: Optional[str] = None, **kwargs) -> _Request:
+        if range is None:
+            return self._Request(self._get_metadata)
+
+        return self._Request(lambda: self._get_values(1, len(self.__sheet.rows)))
+
+    def batchGet(self, spreadsheetId: str, ranges: List[str], **kwargs) -> _Request:
+        return self._Request(lambda: self._batch_get(ranges))
+
+    def _get_metadata(self) -> Dict[str, Any]:
+        """Получение метаданных листа"""
+
+        row_count = len(self.__sheet.rows)
+
+        return {'sheets': [{'properties': {'gridProperties': {'rowCount': row_count}}}]}
+
+    def _get_values(self, start_row: int, end_row: int) -> Dict[str, Any]:
+        """
+        Получение строк таблицы.
+
+        :param start_row: Номер первой строки, начиная с 1.
+        :param end_row: Номер последней строки включительно.
+        :return: Ответ API.
+        """
+
+        started_at = time.perf_counter()
+        values = [list(row) for row in self.__sheet.rows[start_row - 1:end_row]]
+        self.elapsed += time.perf_counter() - started_at
+
+        return {'values': values} if values else {}
+
+    def _batch_get(self, ranges: List[str]) -> Dict[str, Any]:
+        """
+        Получение строк нескольких окон таблицы.
+
+        :param ranges: Окна в A1-нотации вида A1:D100.
+        :return: Ответ API.
+        """
+
+        value_ranges = []
+        for window in ranges:
+            match = self.WINDOW_PATTERN.search(window)
+            value_ranges.append({
+                'range': window,
+                **self._get_values(int(match[1]), int(match[2])),
+            })
+
+        return {'valueRanges': value_ranges}
+
+
+class CbrStubServer:
+    """
+    Класс локального HTTP-сервера, отвечающего как API курсов ЦБ.
+
+    Отдает xml-документ с курсом доллара, который можно поменять, чтобы
+    вызвать пересчет рублей.
+    """
+
+    def __init__(self, rate: Decimal = Decimal('60.0000')) -> None:
+        """
+        Инициализатор класса.
+
+        :param rate: Курс доллара к рублю.
+        """
+
+        self.rate = rate
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = stub.get_document()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = (
+            f'http://127.0.0.1:{self.__server.server_port}'
+            '/scripts/XML_daily.asp?date_req={}'
+        )
+
+    def get_document(self) -> bytes:
+        """Получение xml-документа с курсами"""
+
+        value = f'{self.rate:.4f}'.replace('.', ',')
+
+        return (
+            '<?xml version="1.0" encoding="windows-1251"?>'
+            '<ValCurs name="Foreign Currency Market">'
+            '<Valute ID="R01010"><CharCode>AUD</CharCode>'
+            '<Nominal>1</Nominal><Value>40,0000</Value></Valute>'
+            f'<Valute ID="{CbrRateProvider.CURRENCY_IDS["USD"]}"><CharCode>USD</CharCode>'
+            f'<Nominal>1</Nominal><Value>{value}</Value></Valute>'
+            '</ValCurs>'
+        ).encode('cp1251')
+
+    def __enter__(self) -> 'CbrStubServer':
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class PhaseTimer:
+    """
+    Класс замера времени этапов синхронизации.
+
+    Оборачивает этапы OrderObserver, разбор строк таблицы, объект записи
+    заказов и функции сводок и ленты изменений, не меняя их кода. Время
+    вложенных этапов не вычитается из внешних.
+    """
+
+    # Этапы OrderObserver: имя метода и имя этапа.
+    OBSERVER_PHASES = {
+        '_get_dollars_to_rubs': 'rate',
+        '_get_fingerprint': 'fingerprint',
+        '_reprice_orders': 'reprice',
+    }
+    # Методы объекта записи заказов: имя метода и имя этапа.
+    WRITER_PHASES = {
+        'delete': 'delete',
+        'upsert': 'upsert',
+        'stage': 'stage',
+        'create_stage': 'stage',
+        'load_stage': 'stage',
+        'apply_stage': 'apply_stage',
+    }
+    # Функции модуля order_observer: имя функции и имя этапа.
+    FUNCTION_PHASES = {
+        'diff_orders': 'diff',
+        'refresh_day_summaries': 'day_summaries',
+        'rebuild_day_summaries': 'day_summaries',
+        'commit_revision': 'revision',
+        'reset_revision': 'revision',
+    }
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self.phases: Dict[str, float] = {}
+        self.queries = 0
+
+    def wrap(self, function: Callable, phase: str) -> Callable:
+        """
+        Обертка функции с замером времени ее выполнения.
+
+        :param function: Функция.
+        :param phase: Имя этапа.
+        :return: Обернутая функция.
+        """
+
+        def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.phases[phase] = self.phases.get(phase, 0.0) \
+                    + time.perf_counter() - started_at
+
+        return timed
+
+    @contextmanager
+    def patch(self) -> Iterator['PhaseTimer']:
+        """Включение замеров на время блока with"""
+
+        patches = []
+        for name, phase in self.OBSERVER_PHASES.items():
+            method = self.wrap(getattr(OrderObserver, name), phase)
+            # Статические методы должны остаться статическими.
+            if isinstance(inspect.getattr_static(OrderObserver, name), staticmethod):
+                method = staticmethod(method)
+            patches.append(mock.patch.object(OrderObserver, name, method))
+        patches += [
+            mock.patch.object(
+                order_observer,
+                name,
+                self.wrap(getattr(order_observer, name), phase),
+            )
+            for name, phase in self.FUNCTION_PHASES.items()
+        ]
+        patches += [
+            mock.patch.object(cls, name, self.wrap(getattr(cls, name), phase))
+            for cls, name, phase in (
+                (RowParser, 'parse', 'parse'),
+                (PartitionedDiff, 'run', 'partitioned_diff'),
+            )
+        ]
+        patches.append(mock.patch.object(
+            order_observer,
+            'get_bulk_writer',
+            self._wrap_writer_factory(order_observer.get_bulk_writer),
+        ))
+
+        for patch in patches:
+            patch.start()
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+
+    def _wrap_writer_factory(self, get_bulk_writer: Callable) -> Callable:
+        """
+        Обертка получения объекта записи заказов.
+
+        :param get_bulk_writer: Функция получения объекта записи.
+        :return: Функция, оборачивающая методы объекта записи.
+        """
+
+        def get_timed_bulk_writer(*args, **kwargs):
+            writer = get_bulk_writer(*args, **kwargs)
+            for name, phase in self.WRITER_PHASES.items():
+                if hasattr(writer, name):
+                    setattr(writer, name, self.wrap(getattr(writer, name), phase))
+            return writer
+
+        return get_timed_bulk_writer
+
+    def _count_query(self, execute: Callable, sql: str, params, many: bool, context) -> Any:
+        """Подсчет запросов к БД"""
+
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def measure_memory(enabled: bool) -> Iterator[Dict[str, Optional[int]]]:
+    """
+    Замер пикового объема памяти, выделенной в блоке with.
+
+    :param enabled: Замерять ли память. tracemalloc замедляет код
+        в несколько раз, поэтому время при замере памяти не сравнимо
+        со временем без него.
+    :return: Словарь, в который после блока записывается пик в байтах.
+    """
+
+    result: Dict[str, Optional[int]] = {'peak_memory': None}
+    if not enabled:
+        yield result
+        return
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        yield result
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_sync(
+        source: SheetSource,
+        service: FakeSheetsService,
+        trace_memory: bool = False,
+) -> Dict[str, Any]:
+    """
+    Замер одной синхронизации источника данных.
+
+    :param source: Источник данных.
+    :param service: Подмена подключения к Google Sheets API.
+    :param trace_memory: Замерять ли пиковый объем памяти.
+    :return: Общее время, время этапов, количество запросов к БД и пик
+        памяти.
+    """
+
+    source.refresh_from_db()
+    observer = OrderObserver(source, service)
+    timer = PhaseTimer()
+    service.elapsed = 0.0
+
+    with measure_memory(trace_memory) as memory, timer.patch():
+        started_at = time.perf_counter()
+        observer.run()
+        total = time.perf_counter() - started_at
+
+    phases = {'sheets_read': service.elapsed, **timer.phases}
+
+    return {
+        'total': total,
+        'phases': {name: round(value, 6) for name, value in sorted(phases.items())},
+        'queries': timer.queries,
+        **memory,
+    }
+
+
+def run_api(
+        path: str,
+        params: Dict[str, Any],
+        repeat: int,
+        cached: bool = True,
+        trace_memory: bool = False,
+) -> Dict[str, Any]:
+    """
+    Замер времени ответа API.
+
+    Потоковые ответы читаются целиком.
+
+    :param path: Путь API.
+    :param params: Параметры запроса.
+    :param repeat: Количество замеряемых запросов.
+    :param cached: Отвечать ли из кэша ответов. Если нет, кэш очищается
+        перед каждым запросом.
+    :param trace_memory: Замерять ли пиковый объем памяти отдельным
+        запросом после замеряемых.
+    :return: Минимальное, медианное и 95-процентное время ответа, размер
+        ответа и пик памяти.
+    """
+
+    client = Client()
+
+    def request() -> int:
+        if not cached:
+            cache.clear()
+        response = client.get(path, params)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} ответил {response.status_code}')
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    # Тестовый клиент обращается к хосту testserver, которого нет
+    # в ALLOWED_HOSTS вне тестов.
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        # Прогревочный запрос заполняет кэш ответов.
+        size = request()
+
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            request()
+            timings.append(time.perf_counter() - started_at)
+
+        with measure_memory(trace_memory) as memory:
+            request()
+
+    return {
+        'path': path,
+        'params': params,
+        'cached': cached,
+        'min': min(timings),
+        'median': median(timings),
+        # Квантили считаются минимум по двум замерам.
+        'p95': quantiles(timings, n=20, method='inclusive')[-1] if len(timings) > 1 else timings[0],
+        'bytes': size,
+        **memory,
+    }
@@ -0,0 +1,243 @@
+import json
+import asyncio
+import logging
+import threading
+from typing import (
+    Any,
+    Dict,
+    Set,
+    Optional,
+)
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import redis
+import redis.asyncio
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Класс подписки на сообщения канала рассылки.
+
+    Сообщения складываются в очередь цикла событий подписчика. Если
+    подписчик не успевает их забирать, новые сообщения отбрасываются:
+    клиент заметит пропуск по ревизии и догонит изменения сам.
+    """
+
+    def __init__(self, broadcast: 'BaseBroadcast', maxsize: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param broadcast: Канал рассылки.
+        :param maxsize: Максимальное количество сообщений в очереди.
+        """
+
+        self.__broadcast = broadcast
+        self.__loop = asyncio.get_running_loop()
+        self.__queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Цикл событий подписчика"""
+
+        return self.__loop
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        Ожидание следующего сообщения.
+
+        :return: Сообщение.
+        """
+
+        return await self.__queue.get()
+
+    def put(self, message: Dict[str, Any]) -> None:
+        """
+        Передача сообщения подписчику. Можно вызывать из любого потока.
+
+        :param message: Сообщение.
+        """
+
+        self.__loop.call_soon_threadsafe(self._put_nowait, message)
+
+    def close(self) -> None:
+        """Отмена подписки"""
+
+        self.__broadcast.unsubscribe(self)
+
+    def _put_nowait(self, message: Dict[str, Any]) -> None:
+        """
+        Добавление сообщения в очередь в цикле событий подписчика.
+
+        :param message: Сообщение.
+        """
+
+        try:
+            self.__queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning('Подписчик не успевает получать сообщения, сообщение отброшено')
+
+
+class BaseBroadcast:
+    """
+    Базовый класс канала рассылки сообщений об изменениях заказов.
+
+    Публикуют сообщения синхронно, из задач Celery и админки, а получают
+    подписчики в асинхронном коде потоков событий.
+    """
+
+    # Максимальное количество недоставленных сообщений одного подписчика.
+    subscription_maxsize = 100
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        """
+        Публикация сообщения всем подписчикам.
+
+        :param message: Сообщение, сериализуемое в JSON.
+        """
+
+        raise NotImplementedError
+
+    async def subscribe(self) -> Subscription:
+        """
+        Подписка на сообщения в текущем цикле событий.
+
+        :return: Подписка.
+        """
+
+        subscription = Subscription(self, self.subscription_maxsize)
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Отмена подписки.
+
+        :param subscription: Подписка.
+        """
+
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        """
+        Передача сообщения подписчикам этого процесса.
+
+        :param message: Сообщение.
+        """
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+class InMemoryBroadcast(BaseBroadcast):
+    """
+    Класс канала рассылки в памяти процесса.
+
+    Подходит для тестов и локальной разработки, когда сообщения
+    публикуются в том же процессе, где работают подписчики.
+    """
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        """
+        Публикация сообщения всем подписчикам.
+
+        :param message: Сообщение, сериализуемое в JSON.
+        """
+
+        self._dispatch(json.loads(json.dumps(message)))
+
+
+class RedisBroadcast(BaseBroadcast):
+    """
+    Класс канала рассылки через Redis Pub/Sub.
+
+    Каждый процесс держит одно подключение к каналу Redis на цикл
+    событий и раздает полученные сообщения своим подписчикам, поэтому
+    количество подключений к Redis не зависит от количества клиентов.
+    """
+
+    # Пауза перед повторным подключением к Redis в секундах.
+    reconnect_delay = 1
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        super().__init__()
+        self.__url: str = settings.ORDERS_BROADCAST_URL
+        self.__channel: str = settings.ORDERS_BROADCAST_CHANNEL
+        self.__client: Optional[redis.Redis] = None
+        self.__listeners: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        """
+        Публикация сообщения всем подписчикам.
+
+        :param message: Сообщение, сериализуемое в JSON.
+        """
+
+        if self.__client is None:
+            self.__client = redis.Redis.from_url(self.__url)
+        self.__client.publish(self.__channel, json.dumps(message))
+
+    async def subscribe(self) -> Subscription:
+        """
+        Подписка на сообщения в текущем цикле событий.
+
+        При первой подписке в цикле событий запускается прослушивание
+        канала Redis.
+
+        :return: Подписка.
+        """
+
+        subscription = await super().subscribe()
+        listener = self.__listeners.get(subscription.loop)
+        if listener is None or listener.done():
+            self.__listeners[subscription.loop] = asyncio.create_task(self._listen())
+
+        return subscription
+
+    async def _listen(self) -> None:
+        """Прослушивание канала Redis с переподключением при ошибках"""
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.__url)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.__channel)
+                async for message in pubsub.listen():
+                    self._dispatch(json.loads(message['data']))
+            except (redis.RedisError, OSError):
+                logger.exception('Ошибка подключения к каналу рассылки Redis')
+            finally:
+                await pubsub.close()
+                await client.close()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+
+@lru_cache(maxsize=None)
+def get_broadcast() -> BaseBroadcast:
+    """
+    Получение канала рассылки процесса.
+
+    Класс канала задается настройкой ORDERS_BROADCAST_BACKEND.
+
+    :return: Канал рассылки.
+    """
+
+    return import_string(settings.ORDERS_BROADCAST_BACKEND)()
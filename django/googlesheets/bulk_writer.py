@@ -0,0 +1,575 @@
+import io
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+from django.db import (
+    connections,
+    DEFAULT_DB_ALIAS,
+)
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import (
+    Order,
+    OrderTombstone,
+)
+from .change_log import create_tombstones
+
+
+class OrderRow(NamedTuple):
+    """Строка заказа для записи в БД"""
+
+    number: int
+    order_number: int
+    dollars: Decimal
+    delivery_time: date
+    rubles: Decimal
+    digest: str
+
+
+class OrderBulkWriter:
+    """
+    Класс записи заказов одного источника данных в БД пачками.
+
+    Заказы записываются через INSERT ... ON CONFLICT (source_id,
+    order_number) DO UPDATE: новые заказы добавляются, существующие -
+    обновляются одним запросом на пачку. Подходит для SQLite и PostgreSQL.
+
+    Также умеет сравнивать таблицу заказов с данными из Google-таблицы
+    на стороне БД: строки загружаются во временную промежуточную таблицу,
+    а множества заказов для удаления и записи вычисляются соединениями
+    с ней и используют уникальный индекс по источнику и номеру заказа.
+
+    Записанные заказы остаются без ревизии, а для удаленных создаются
+    записи об удалении: ревизия назначается им в конце транзакции
+    синхронизации. Дни поставки удаленных заказов и прежние дни
+    перенесенных заказов собираются в vacated_days для пересчета сводок.
+
+    На SQLite отложенная проверка уникальности номера записи не
+    поддерживается, поэтому ограничение на нем не создается, и номера
+    записей могут меняться местами без конфликтов.
+    """
+
+    # Максимальное количество строк в одном запросе.
+    batch_size = 1000
+
+    def __init__(self, connection: BaseDatabaseWrapper, source_id: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param connection: Подключение к БД.
+        :param source_id: id источника данных, заказы которого записываются.
+        """
+
+        self._connection = connection
+        self._source_id = source_id
+        self._table = connection.ops.quote_name(Order._meta.db_table)
+        self._fields = [Order._meta.get_field(name) for name in OrderRow._fields]
+        self._columns = [connection.ops.quote_name(field.column) for field in self._fields]
+        self._source_column = connection.ops.quote_name(
+            Order._meta.get_field('source').column)
+        self._conflict_column = connection.ops.quote_name(
+            Order._meta.get_field('order_number').column)
+        self._stage_table = connection.ops.quote_name(
+            f'{Order._meta.db_table}_stage')
+        self._stage_index = connection.ops.quote_name(
+            f'{Order._meta.db_table}_stage_idx')
+        self._kept_table = connection.ops.quote_name(
+            f'{Order._meta.db_table}_kept')
+        # Загружены ли номера заказов, которые не удаляются вместе
+        # с отсутствующими в промежуточной таблице.
+        self._has_kept = False
+        # Количество строк, загруженных в промежуточную таблицу.
+        self._staged_rows = 0
+        # Дни поставки, из которых ушли заказы при записи. Может содержать
+        # лишние дни: сводки за них просто пересчитаются.
+        self.vacated_days: Set[date] = set()
+
+    def upsert(self, rows: Iterable[OrderRow]) -> int:
+        """
+        Добавление новых и обновление существующих заказов.
+
+        Должно вызываться внутри транзакции.
+
+        :param rows: Строки заказов.
+        :return: Количество записанных строк.
+        """
+
+        rows = list(rows)
+        for batch in self._batches(rows, self.batch_size):
+            self._collect_vacated_days(
+                Order.objects
+                .using(self._connection.alias)
+                .filter(
+                    source_id=self._source_id,
+                    order_number__in=[row.order_number for row in batch],
+                )
+            )
+
+        with self._connection.cursor() as cursor:
+            return self._insert_values(
+                cursor,
+                self._table,
+                [self._source_column, *self._columns],
+                ((self._source_id, *row) for row in rows),
+                self._get_on_conflict_sql(),
+            )
+
+    def delete(self, order_numbers: Iterable[int]) -> int:
+        """
+        Удаление заказов источника данных по номерам.
+
+        Для удаленных заказов создаются записи об удалении.
+
+        :param order_numbers: Номера заказов.
+        :return: Количество удаленных заказов.
+        """
+
+        count = 0
+        for batch in self._batches(order_numbers, self.batch_size):
+            orders = Order.objects \
+                .using(self._connection.alias) \
+                .filter(source_id=self._source_id, order_number__in=batch)
+            self._collect_vacated_days(orders)
+            create_tombstones(orders)
+            deleted, _ = orders.delete()
+            count += deleted
+
+        return count
+
+    def stage(self, rows: Iterable[OrderRow]) -> int:
+        """
+        Создание промежуточной таблицы и загрузка в нее строк заказов.
+
+        :param rows: Строки заказов.
+        :return: Количество загруженных строк.
+        """
+
+        self.create_stage()
+
+        return self.load_stage(rows)
+
+    def create_stage(self) -> None:
+        """
+        Создание пустой временной промежуточной таблицы.
+
+        Должно вызываться внутри транзакции.
+        """
+
+        columns = ', '.join(self._columns)
+        with self._connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self._stage_table}')
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {self._stage_table} AS '
+                f'SELECT 0 AS row_index, {columns} FROM {self._table} WHERE 1 = 0'
+            )
+        self._staged_rows = 0
+
+    def load_stage(self, rows: Iterable[OrderRow]) -> int:
+        """
+        Загрузка строк заказов в промежуточную таблицу.
+
+        Может вызываться несколько раз, например, для каждой страницы
+        Google-таблицы. Порядковый номер строки сохраняется, чтобы при
+        повторах номера заказа учитывалась последняя строка.
+
+        :param rows: Строки заказов.
+        :return: Количество загруженных строк.
+        """
+
+        with self._connection.cursor() as cursor:
+            count = self._load_stage(cursor, rows, self._staged_rows)
+        self._staged_rows += count
+
+        return count
+
+    def keep(self, order_numbers: Iterable[int]) -> None:
+        """
+        Загрузка номеров заказов, которые apply_stage() не удаляет, даже
+        если их нет в промежуточной таблице.
+
+        Должно вызываться внутри той же транзакции, что и apply_stage().
+
+        :param order_numbers: Номера заказов.
+        """
+
+        with self._connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self._kept_table}')
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {self._kept_table} AS '
+                f'SELECT {self._conflict_column} FROM {self._table} WHERE 1 = 0'
+            )
+            cursor.executemany(
+                f'INSERT INTO {self._kept_table} ({self._conflict_column}) VALUES (%s)',
+                [(order_number, ) for order_number in order_numbers],
+            )
+        self._has_kept = True
+
+    def apply_stage(self) -> Tuple[int, int]:
+        """
+        Применение промежуточной таблицы к таблице заказов.
+
+        Удаляет заказы источника данных, которых нет в промежуточной
+        таблице (кроме загруженных через keep()), с созданием записей
+        об удалении, добавляет
+        новые и обновляет заказы с изменившимся дайджестом, после чего
+        удаляет промежуточную таблицу. Должно вызываться внутри той же
+        транзакции, что и create_stage().
+
+        :return: Количество удаленных и количество записанных заказов.
+        """
+
+        columns = ', '.join(self._columns)
+        stage_columns = ', '.join(f'stage.{column}' for column in self._columns)
+        order_number = self._conflict_column
+        source = self._source_column
+        digest = self._connection.ops.quote_name(
+            Order._meta.get_field('digest').column)
+        delivery_time = self._connection.ops.quote_name(
+            Order._meta.get_field('delivery_time').column)
+
+        missing_orders = (
+            f'FROM {self._table} WHERE {source} = %s AND NOT EXISTS ('
+            f'SELECT 1 FROM {self._stage_table} stage '
+            f'WHERE stage.{order_number} = {self._table}.{order_number})'
+        )
+        if self._has_kept:
+            missing_orders += (
+                f' AND NOT EXISTS (SELECT 1 FROM {self._kept_table} kept '
+                f'WHERE kept.{order_number} = {self._table}.{order_number})'
+            )
+        tombstone_table = self._connection.ops.quote_name(OrderTombstone._meta.db_table)
+        tombstone_columns = ', '.join(
+            self._connection.ops.quote_name(OrderTombstone._meta.get_field(name).column)
+            for name in ('source', 'order_id', 'order_number', 'created_at')
+        )
+        order_id = self._connection.ops.quote_name(Order._meta.pk.column)
+        created_at = OrderTombstone._meta.get_field('created_at') \
+            .get_db_prep_save(timezone.now(), self._connection)
+
+        with self._connection.cursor() as cursor:
+            self._prepare_stage(cursor)
+            # Дни заказов, которые будут удалены или изменены.
+            cursor.execute(
+                f'SELECT DISTINCT existing.{delivery_time} FROM {self._table} existing '
+                f'WHERE existing.{source} = %s AND NOT EXISTS ('
+                f'SELECT 1 FROM {self._stage_table} stage '
+                f'WHERE stage.{order_number} = existing.{order_number} '
+                f'AND stage.{digest} = existing.{digest} '
+                f'AND NOT EXISTS ('
+                f'SELECT 1 FROM {self._stage_table} duplicate '
+                f'WHERE duplicate.{order_number} = stage.{order_number} '
+                f'AND duplicate.row_index > stage.row_index))',
+                [self._source_id],
+            )
+            self._add_vacated_days(cursor)
+
+            cursor.execute(
+                f'INSERT INTO {tombstone_table} ({tombstone_columns}) '
+                f'SELECT {source}, {order_id}, {order_number}, %s {missing_orders}',
+                [created_at, self._source_id],
+            )
+            cursor.execute(f'DELETE {missing_orders}', [self._source_id])
+            deleted = cursor.rowcount
+
+            cursor.execute(
+                f'INSERT INTO {self._table} ({source}, {columns}) '
+                f'SELECT %s, {stage_columns} FROM {self._stage_table} stage '
+                f'LEFT JOIN {self._table} existing '
+                f'ON existing.{source} = %s '
+                f'AND existing.{order_number} = stage.{order_number} '
+                f'WHERE (existing.{order_number} IS NULL '
+                f'OR existing.{digest} <> stage.{digest}) '
+                f'AND NOT EXISTS ('
+                f'SELECT 1 FROM {self._stage_table} duplicate '
+                f'WHERE duplicate.{order_number} = stage.{order_number} '
+                f'AND duplicate.row_index > stage.row_index) '
+                f'{self._get_on_conflict_sql()}',
+                [self._source_id, self._source_id],
+            )
+            upserted = cursor.rowcount
+
+            cursor.execute(f'DROP TABLE {self._stage_table}')
+            if self._has_kept:
+                cursor.execute(f'DROP TABLE {self._kept_table}')
+                self._has_kept = False
+
+        return deleted, upserted
+
+    def _collect_vacated_days(self, orders: QuerySet) -> None:
+        """
+        Запоминание дней поставки заказов перед их изменением или удалением.
+
+        :param orders: QuerySet заказов.
+        """
+
+        self.vacated_days.update(
+            orders
+            .order_by()
+            .values_list('delivery_time', flat=True)
+            .distinct()
+        )
+
+    def _add_vacated_days(self, cursor) -> None:
+        """
+        Запоминание дней поставки из результата запроса.
+
+        :param cursor: Курсор БД с результатом запроса одного столбца
+            со сроками поставки.
+        """
+
+        delivery_time = Order._meta.get_field('delivery_time')
+        self.vacated_days.update(
+            delivery_time.to_python(value)
+            for value, in cursor.fetchall()
+        )
+
+    def _prepare_stage(self, cursor) -> None:
+        """
+        Подготовка заполненной промежуточной таблицы к соединениям.
+
+        :param cursor: Курсор БД.
+        """
+
+        cursor.execute(
+            f'CREATE INDEX {self._stage_index} '
+            f'ON {self._stage_table} ({self._conflict_column}, row_index)'
+        )
+
+    def _load_stage(self, cursor, rows: Iterable[OrderRow], start_index: int) -> int:
+        """
+        Загрузка строк заказов в созданную промежуточную таблицу.
+
+        :param cursor: Курсор БД.
+        :param rows: Строки заказов.
+        :param start_index: Порядковый номер первой строки.
+        :return: Количество загруженных строк.
+        """
+
+        return self._insert_values(
+            cursor,
+            self._stage_table,
+            ['row_index', *self._columns],
+            (
+                (row_index, *row)
+                for row_index, row in enumerate(rows, start_index)
+            ),
+        )
+
+    def _insert_values(
+            self,
+            cursor,
+            table: str,
+            columns: List[str],
+            rows: Iterable[tuple],
+            suffix: str = '',
+    ) -> int:
+        """
+        Вставка строк в таблицу пачками через INSERT ... VALUES.
+
+        :param cursor: Курсор БД.
+        :param table: Имя таблицы.
+        :param columns: Имена столбцов.
+        :param rows:
+            Строки. Последние значения строки соответствуют полям OrderRow.
+        :param suffix: SQL-выражение, добавляемое в конец запроса.
+        :return: Количество вставленных строк.
+        """
+
+        # Учитываем ограничение БД на количество параметров в запросе.
+        batch_size = self.batch_size
+        max_query_params = self._connection.features.max_query_params
+        if max_query_params is not None:
+            batch_size = min(batch_size, max_query_params // len(columns))
+        placeholder = f'({", ".join(["%s"] * len(columns))})'
+        extra_columns = len(columns) - len(self._fields)
+        count = 0
+
+        for batch in self._batches(rows, batch_size):
+            params = []
+            for row in batch:
+                params.extend(row[:extra_columns])
+                params.extend(
+                    field.get_db_prep_save(value, self._connection)
+                    for field, value in zip(self._fields, row[extra_columns:])
+                )
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'VALUES {", ".join([placeholder] * len(batch))} {suffix}',
+                params,
+            )
+            count += len(batch)
+
+        return count
+
+    def _get_on_conflict_sql(self) -> str:
+        """
+        Получение SQL-выражения обновления заказа при конфликте номеров.
+
+        Ревизия обновленного заказа сбрасывается до конца транзакции.
+        Отметка об уведомлении о просрочке сохраняется, только если срок
+        поставки не изменился.
+
+        :return: SQL-выражение ON CONFLICT ... DO UPDATE.
+        """
+
+        assignments = ', '.join(
+            f'{column} = EXCLUDED.{column}'
+            for column in self._columns
+            if column != self._conflict_column
+        )
+
+        # Если срок поставки изменился, о просрочке заказа нужно
+        # уведомить заново.
+        delivery_time = self._connection.ops.quote_name(
+            Order._meta.get_field('delivery_time').column)
+        notified_at = self._connection.ops.quote_name(
+            Order._meta.get_field('expired_notified_at').column)
+        revision = self._connection.ops.quote_name(
+            Order._meta.get_field('revision').column)
+        assignments += (
+            f', {revision} = NULL'
+            f', {notified_at} = CASE '
+            f'WHEN {self._table}.{delivery_time} = EXCLUDED.{delivery_time} '
+            f'THEN {self._table}.{notified_at} ELSE NULL END'
+        )
+
+        return (
+            f'ON CONFLICT ({self._source_column}, {self._conflict_column}) '
+            f'DO UPDATE SET {assignments}'
+        )
+
+    @staticmethod
+    def _batches(items: Iterable, size: int) -> Iterator[List]:
+        """
+        Разбиение элементов на пачки.
+
+        :param items: Элементы.
+        :param size: Размер пачки.
+        :return: Итератор по пачкам.
+        """
+
+        iterator = iter(items)
+        while batch := list(islice(iterator, size)):
+            yield batch
+
+
+class PostgresOrderBulkWriter(OrderBulkWriter):
+    """
+    Класс записи заказов в PostgreSQL.
+
+    Строки потоково загружаются через COPY во временную промежуточную
+    таблицу, откуда переносятся в таблицу заказов одним запросом
+    INSERT ... SELECT ... ON CONFLICT. Уникальность номера записи
+    проверяется отложенно при фиксации транзакции, поэтому заказы могут
+    меняться номерами.
+    """
+
+    # Количество строк, передаваемых в COPY за раз.
+    batch_size = 10000
+
+    def upsert(self, rows: Iterable[OrderRow]) -> int:
+        """
+        Добавление новых и обновление существующих заказов.
+
+        Должно вызываться внутри транзакции.
+
+        :param rows: Строки заказов.
+        :return: Количество записанных строк.
+        """
+
+        count = self.stage(rows)
+        columns = ', '.join(self._columns)
+        order_number = self._conflict_column
+        delivery_time = self._connection.ops.quote_name(
+            Order._meta.get_field('delivery_time').column)
+
+        with self._connection.cursor() as cursor:
+            # Прежние дни заказов, у которых изменится срок поставки.
+            cursor.execute(
+                f'SELECT DISTINCT existing.{delivery_time} '
+                f'FROM {self._table} existing '
+                f'JOIN {self._stage_table} stage '
+                f'ON stage.{order_number} = existing.{order_number} '
+                f'WHERE existing.{self._source_column} = %s '
+                f'AND existing.{delivery_time} <> stage.{delivery_time}',
+                [self._source_id],
+            )
+            self._add_vacated_days(cursor)
+
+            cursor.execute(
+                f'INSERT INTO {self._table} ({self._source_column}, {columns}) '
+                f'SELECT %s, {columns} FROM {self._stage_table} '
+                f'{self._get_on_conflict_sql()}',
+                [self._source_id],
+            )
+            cursor.execute(f'DROP TABLE {self._stage_table}')
+
+        return count
+
+    def _prepare_stage(self, cursor) -> None:
+        """
+        Подготовка заполненной промежуточной таблицы к соединениям.
+
+        Дополнительно собирается статистика, т.к. автоматически для
+        временных таблиц она не собирается.
+
+        :param cursor: Курсор БД.
+        """
+
+        super()._prepare_stage(cursor)
+        cursor.execute(f'ANALYZE {self._stage_table}')
+
+    def _load_stage(self, cursor, rows: Iterable[OrderRow], start_index: int) -> int:
+        """
+        Загрузка строк заказов в промежуточную таблицу через COPY.
+
+        :param cursor: Курсор БД.
+        :param rows: Строки заказов.
+        :param start_index: Порядковый номер первой строки.
+        :return: Количество загруженных строк.
+        """
+
+        columns = ', '.join(['row_index', *self._columns])
+        row_index = start_index
+
+        for batch in self._batches(rows, self.batch_size):
+            buffer = io.StringIO()
+            for row in batch:
+                buffer.write(f'{row_index}\t')
+                buffer.write('\t'.join(map(str, row)))
+                buffer.write('\n')
+                row_index += 1
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {self._stage_table} ({columns}) FROM STDIN',
+                buffer,
+            )
+
+        return row_index - start_index
+
+
+def get_bulk_writer(source_id: int, using: Optional[str] = None) -> OrderBulkWriter:
+    """
+    Получение объекта записи заказов источника данных для указанной БД.
+
+    :param source_id: id источника данных.
+    :param using: Псевдоним подключения к БД.
+    :return: Объект записи заказов, подходящий для бэкенда БД.
+    """
+
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor == 'postgresql':
+        return PostgresOrderBulkWriter(connection, source_id)
+
+    return OrderBulkWriter(connection, source_id)
@@ -0,0 +1,137 @@
+from datetime import timedelta
+from functools import partial
+from django.db import transaction
+from django.db.models import (
+    Max,
+    QuerySet,
+)
+from django.utils import timezone
+
+from .models import (
+    Order,
+    OrderTombstone,
+    SyncRevision,
+)
+from .live_updates import publish_revision
+
+
+# id единственной записи счетчика ревизий.
+SYNC_REVISION_PK = 1
+
+
+def commit_revision(source_id: int) -> int:
+    """
+    Назначение новой ревизии изменениям источника данных.
+
+    Изменения - это записанные заказы и записи об удалении, у которых
+    еще нет ревизии. Должно вызываться в конце транзакции, в которой они
+    сделаны: счетчик ревизий остается заблокированным до ее фиксации.
+    После фиксации изменения ревизии публикуются подписчикам.
+
+    :param source_id: id источника данных.
+    :return: Назначенная ревизия.
+    """
+
+    counter = _lock_counter()
+    counter.value += 1
+    counter.save(update_fields=('value', ))
+
+    Order.objects \
+        .filter(source_id=source_id, revision__isnull=True) \
+        .update(revision=counter.value)
+    OrderTombstone.objects \
+        .filter(source_id=source_id, revision__isnull=True) \
+        .update(revision=counter.value)
+
+    transaction.on_commit(partial(publish_revision, counter.value))
+
+    return counter.value
+
+
+def reset_revision() -> int:
+    """
+    Назначение ревизии, до которой клиентам нужна полная перезагрузка.
+
+    Используется, когда изменились все заказы, например, при пересчете
+    рублей, или источник данных удален целиком. После фиксации
+    подписчики получают сообщение о полной перезагрузке.
+
+    :return: Назначенная ревизия.
+    """
+
+    with transaction.atomic():
+        counter = _lock_counter()
+        counter.value += 1
+        counter.reset_value = counter.value
+        counter.save(update_fields=('value', 'reset_value'))
+        transaction.on_commit(partial(publish_revision, counter.value, reset=True))
+
+    return counter.value
+
+
+def create_tombstones(orders: QuerySet) -> int:
+    """
+    Создание записей об удалении заказов.
+
+    Должно вызываться перед удалением заказов в той же транзакции.
+
+    :param orders: QuerySet удаляемых заказов.
+    :return: Количество созданных записей.
+    """
+
+    tombstones = OrderTombstone.objects.db_manager(orders.db).bulk_create(
+        OrderTombstone(
+            source_id=source_id,
+            order_id=order_id,
+            order_number=order_number,
+        )
+        for order_id, source_id, order_number in orders
+        .order_by()
+        .values_list('pk', 'source_id', 'order_number')
+    )
+
+    return len(tombstones)
+
+
+def compact_changes(retention: timedelta) -> int:
+    """
+    Сжатие ленты изменений: удаление старых записей об удалении заказов.
+
+    Клиентам, которые отстали больше, чем на время хранения, придется
+    перезагрузить заказы целиком.
+
+    :param retention: Время хранения записей об удалении.
+    :return: Количество удаленных записей.
+    """
+
+    cutoff = OrderTombstone.objects \
+        .filter(created_at__lt=timezone.now() - retention) \
+        .aggregate(revision=Max('revision'))['revision']
+    if cutoff is None:
+        return 0
+
+    # Сначала сдвигаем границу перезагрузки, затем удаляем записи, чтобы
+    # клиент не получил ленту с пропущенными удалениями.
+    with transaction.atomic():
+        counter = _lock_counter()
+        if counter.reset_value < cutoff:
+            counter.reset_value = cutoff
+            counter.save(update_fields=('reset_value', ))
+
+    deleted, _ = OrderTombstone.objects \
+        .filter(revision__lte=cutoff) \
+        .delete()
+
+    return deleted
+
+
+def _lock_counter() -> SyncRevision:
+    """
+    Блокировка счетчика ревизий до конца текущей транзакции.
+
+    :return: Счетчик ревизий.
+    """
+
+    return SyncRevision.objects \
+        .select_for_update() \
+        .get(pk=SYNC_REVISION_PK)
@@ -0,0 +1,241 @@
+import time
+import requests
+from typing import (
+    Dict,
+    Tuple,
+    Optional,
+)
+from decimal import Decimal
+from decouple import config
+from datetime import (
+    date,
+    datetime,
+    timedelta,
+)
+from xml.etree import ElementTree
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import CurrencyRate
+from .metrics import count_bytes
+
+
+class CbrRateProvider:
+    """
+    Класс поставщика курсов валют ЦБ РФ.
+
+    Курс меняется раз в день, поэтому полученное значение кэшируется
+    на трех уровнях:
+        1. В памяти процесса.
+        2. В общем кэше Django (Redis) с ключом по дате и временем жизни
+        до конца этой даты.
+        3. В таблице истории курсов CurrencyRate.
+    К API ЦБ обращается только один воркер за раз: остальные ждут, пока
+    курс появится в общем кэше.
+    """
+
+    # id валют в справочнике ЦБ.
+    CURRENCY_IDS: Dict[str, str] = {
+        'USD': 'R01235',
+    }
+
+    # Курсы, уже полученные этим процессом. Ключ - код валюты и дата.
+    _local_cache: Dict[Tuple[str, date], Decimal] = {}
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        # Шаблон URL для получения валют. Для запроса необходимо подставить
+        # через .format() дату формата dd/mm/yy.
+        self.__cbr_currencies_url: str = config('CBR_CURRENCIES_URL')
+        # Таймаут запроса к API ЦБ в секундах.
+        self.__timeout: float = config(
+            'CBR_REQUEST_TIMEOUT',
+            default=10,
+            cast=float,
+        )
+
+    def get_rate(self, char_code: str, rate_date: Optional[date] = None) -> Decimal:
+        """
+        Получение курса валюты к рублю на указанную дату.
+
+        :param char_code: Буквенный код валюты, например, USD.
+        :param rate_date: Дата курса. По умолчанию - сегодняшний день.
+        :return: Объект Decimal с точным значением курса валюты к рублю.
+        """
+
+        if rate_date is None:
+            rate_date = timezone.localdate()
+
+        # Курс в памяти процесса.
+        local_key = (char_code, rate_date)
+        rate = self._local_cache.get(local_key)
+        if rate is not None:
+            return rate
+
+        # Курс в общем кэше или в БД.
+        cache_key = self._get_cache_key(char_code, rate_date)
+        rate = self._get_shared_rate(cache_key, char_code, rate_date)
+
+        if rate is None:
+            # Курса еще нет. Запрашиваем его у ЦБ только в одном воркере,
+            # остальные ждут результата.
+            lock_key = f'{cache_key}:lock'
+            lock_timeout = int(self.__timeout) + 5
+            if cache.add(lock_key, True, timeout=lock_timeout):
+                try:
+                    rate = self._get_shared_rate(cache_key, char_code, rate_date)
+                    if rate is None:
+                        rate = self._fetch_and_store(cache_key, char_code, rate_date)
+                finally:
+                    cache.delete(lock_key)
+            else:
+                rate = self._wait_for_rate(cache_key, lock_timeout)
+                if rate is None:
+                    rate = self._fetch_and_store(cache_key, char_code, rate_date)
+
+        # Курсы за прошедшие дни в памяти больше не нужны.
+        for key in [key for key in self._local_cache if key[1] != rate_date]:
+            del self._local_cache[key]
+        self._local_cache[local_key] = rate
+
+        return rate
+
+    def _get_shared_rate(
+            self,
+            cache_key: str,
+            char_code: str,
+            rate_date: date,
+    ) -> Optional[Decimal]:
+        """
+        Получение курса из общего кэша или из БД.
+
+        :param cache_key: Ключ курса в общем кэше.
+        :param char_code: Буквенный код валюты.
+        :param rate_date: Дата курса.
+        :return: Курс валюты или None, если курс еще не получен.
+        """
+
+        rate = cache.get(cache_key)
+        if rate is not None:
+            return Decimal(rate)
+
+        rate = CurrencyRate.objects \
+            .filter(char_code=char_code, date=rate_date) \
+            .values_list('value', flat=True) \
+            .first()
+        if rate is not None:
+            cache.set(cache_key, str(rate), self._get_cache_timeout(rate_date))
+
+        return rate
+
+    def _wait_for_rate(self, cache_key: str, timeout: int) -> Optional[Decimal]:
+        """
+        Ожидание курса, который запрашивает другой воркер.
+
+        :param cache_key: Ключ курса в общем кэше.
+        :param timeout: Максимальное время ожидания в секундах.
+        :return: Курс валюты или None, если курс так и не появился.
+        """
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            rate = cache.get(cache_key)
+            if rate is not None:
+                return Decimal(rate)
+
+        return None
+
+    def _fetch_and_store(
+            self,
+            cache_key: str,
+            char_code: str,
+            rate_date: date,
+    ) -> Decimal:
+        """
+        Запрос курса у ЦБ и сохранение его в БД и в общий кэш.
+
+        :param cache_key: Ключ курса в общем кэше.
+        :param char_code: Буквенный код валюты.
+        :param rate_date: Дата курса.
+        :return: Курс валюты.
+        """
+
+        rate = self._fetch_rate(char_code, rate_date)
+        CurrencyRate.objects.update_or_create(
+            char_code=char_code,
+            date=rate_date,
+            defaults={'value': rate},
+        )
+        cache.set(cache_key, str(rate), self._get_cache_timeout(rate_date))
+
+        return rate
+
+    def _fetch_rate(self, char_code: str, rate_date: date) -> Decimal:
+        """
+        Запрос курса валюты у API ЦБ.
+
+        xml-документ разбирается потоково, разбор прекращается, как только
+        найдена нужная валюта.
+
+        :param char_code: Буквенный код валюты.
+        :param rate_date: Дата курса.
+        :return: Курс валюты.
+        """
+
+        currency_id = self.CURRENCY_IDS[char_code]
+        # Переводим дату в нужный формат и делаем запрос к API ЦБ.
+        date_for_request = rate_date.strftime('%d/%m/%Y')
+        with requests.get(
+            self.__cbr_currencies_url.format(date_for_request),
+            timeout=self.__timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+
+            try:
+                for _, element in ElementTree.iterparse(response.raw):
+                    if element.tag != 'Valute':
+                        continue
+                    if element.get('ID') == currency_id:
+                        value = Decimal(element.findtext('Value').replace(',', '.'))
+                        nominal = Decimal(element.findtext('Nominal', '1'))
+                        return value / nominal
+                    # Освобождаем память от уже разобранных валют.
+                    element.clear()
+            finally:
+                # Учитываем только прочитанную часть ответа.
+                count_bytes('cbr', response.raw.tell())
+
+        raise ValueError(f'Курс {char_code} на {rate_date} не найден в ответе ЦБ')
+
+    @staticmethod
+    def _get_cache_key(char_code: str, rate_date: date) -> str:
+        """
+        Получение ключа курса в общем кэше.
+
+        :param char_code: Буквенный код валюты.
+        :param rate_date: Дата курса.
+        :return: Ключ кэша.
+        """
+
+        return f'cbr-rate:{char_code}:{rate_date.isoformat()}'
+
+    @staticmethod
+    def _get_cache_timeout(rate_date: date) -> int:
+        """
+        Получение времени жизни курса в общем кэше.
+
+        Курс хранится до конца своей даты, но не меньше минуты.
+
+        :param rate_date: Дата курса.
+        :return: Время жизни в секундах.
+        """
+
+        end_of_date = timezone.make_aware(
+            datetime.combine(rate_date + timedelta(days=1), datetime.min.time()))
+        timeout = int((end_of_date - timezone.now()).total_seconds())
+
+        return max(timeout, 60)
@@ -0,0 +1,73 @@
+from typing import (
+    Callable,
+    List,
+    Sequence,
+    TypeVar,
+)
+
+
+T = TypeVar('T')
+
+
+def lttb(
+        points: Sequence[T],
+        threshold: int,
+        x: Callable[[T], float],
+        y: Callable[[T], float],
+) -> List[T]:
+    """
+    Прореживание ряда точек алгоритмом Largest-Triangle-Three-Buckets.
+
+    Первая и последняя точки сохраняются, остальные делятся на
+    threshold - 2 корзины, и из каждой корзины выбирается точка,
+    образующая треугольник наибольшей площади с выбранной точкой
+    предыдущей корзины и средней точкой следующей. Так сохраняется
+    форма графика: пики и провалы не теряются, как при усреднении.
+
+    :param points: Точки, упорядоченные по x.
+    :param threshold: Количество точек в результате.
+    :param x: Получение координаты x точки.
+    :param y: Получение координаты y точки.
+    :return: Выбранные точки в исходном порядке.
+    """
+
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    xs = [x(point) for point in points]
+    ys = [y(point) for point in points]
+
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    selected = 0
+
+    for i in range(threshold - 2):
+        # Средняя точка следующей корзины.
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        next_count = next_end - next_start
+        average_x = sum(xs[next_start:next_end]) / next_count
+        average_y = sum(ys[next_start:next_end]) / next_count
+
+        # Точка текущей корзины с треугольником наибольшей площади.
+        selected_x, selected_y = xs[selected], ys[selected]
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        max_area = -1.0
+        next_selected = start
+        for j in range(start, end):
+            area = abs(
+                (selected_x - average_x) * (ys[j] - selected_y)
+                - (selected_x - xs[j]) * (average_y - selected_y)
+            )
+            if area > max_area:
+                max_area = area
+                next_selected = j
+
+        sampled.append(points[next_selected])
+        selected = next_selected
+
+    sampled.append(points[-1])
+
+    return sampled
@@ -0,0 +1,131 @@
+import os
+import threading
+import httplib2
+import httplib2shim
+from datetime import (
+    datetime,
+    timedelta,
+)
+from django.conf import settings
+from googleapiclient.discovery import build
+from oauth2client.service_account import ServiceAccountCredentials
+
+from .metrics import count_bytes
+
+
+class SheetsClient:
+    """
+    Класс подключения к Google Sheets API от лица сервисного аккаунта.
+
+    Создается один раз на процесс (и поток) воркера и переиспользуется
+    всеми задачами: учетные данные читаются с диска один раз, описание API
+    берется из документа, поставляемого с googleapiclient, а объект http
+    держит пул соединений с Google. Токен доступа обновляется заранее,
+    до истечения его срока действия.
+    """
+
+    # За сколько до истечения срока действия токена его нужно обновить.
+    TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+    def __init__(self, scopes: str) -> None:
+        """
+        Инициализатор класса.
+
+        :param scopes: Разрешения на работу с API.
+        """
+
+        self.pid = os.getpid()
+        self.scopes = scopes
+
+        # Путь до файла с учетными данными сервисного аккаунта в json-формате.
+        creds_json = settings.CREDS_DIR / settings.FILENAME_SERVICE_ACCOUNT_CREDS
+
+        # Создание учетных данных сервисного аккаунта.
+        self.__credentials = ServiceAccountCredentials \
+            .from_json_keyfile_name(creds_json, (scopes, ))
+        http = self.__credentials.authorize(httplib2.Http())
+        self._count_downloaded_bytes(http)
+
+        # Создание объекта подключения к облаку. Описание API не
+        # запрашивается по сети, а берется из пакета googleapiclient.
+        self.__service = build(
+            serviceName='sheets',
+            version='v4',
+            http=http,
+            cache_discovery=False,
+            static_discovery=True,
+        )
+
+    def get_service(self):
+        """
+        Получение объекта подключения к Google Sheets API.
+
+        :return: Ресурс Google Sheets API со свежим токеном доступа.
+        """
+
+        self._refresh_token()
+
+        return self.__service
+
+    @staticmethod
+    def _count_downloaded_bytes(http: httplib2.Http) -> None:
+        """
+        Учет объема ответов API в метриках.
+
+        Учитывается объем ответа после распаковки.
+
+        :param http: Объект http, через который выполняются запросы.
+        """
+
+        request = http.request
+
+        def counted_request(*args, **kwargs):
+            response, content = request(*args, **kwargs)
+            count_bytes('sheets', len(content))
+            return response, content
+
+        http.request = counted_request
+
+    def _refresh_token(self) -> None:
+        """Обновление токена доступа, если он скоро истечет"""
+
+        expiry = self.__credentials.token_expiry
+        if self.__credentials.access_token is None or expiry is None \
+                or expiry - datetime.utcnow() < self.TOKEN_REFRESH_MARGIN:
+            # Для запроса токена используется отдельный объект http
+            # без авторизации.
+            self.__credentials.refresh(httplib2.Http())
+
+
+# Подключения к API текущего процесса, отдельные для каждого потока,
+# т.к. объекты httplib2 не потокобезопасны.
+_local = threading.local()
+_patch_lock = threading.Lock()
+_patched = False
+
+
+def get_sheets_service(scopes: str):
+    """
+    Получение объекта подключения к Google Sheets API для текущего процесса.
+
+    После fork процесса воркера подключение создается заново.
+
+    :param scopes: Разрешения на работу с API.
+    :return: Ресурс Google Sheets API.
+    """
+
+    global _patched
+
+    # Автоматически настраиваем все объекты http. Без этого аутентификация
+    # в Google Cloud из Celery-воркера не работает.
+    with _patch_lock:
+        if not _patched:
+            httplib2shim.patch()
+            _patched = True
+
+    client = getattr(_local, 'client', None)
+    if client is None or client.pid != os.getpid() or client.scopes != scopes:
+        client = SheetsClient(scopes)
+        _local.client = client
+
+    return client.get_service()
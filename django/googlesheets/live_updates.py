@@ -0,0 +1,137 @@
+import logging
+from decimal import Decimal
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from django.conf import settings
+from django.db.models import Sum
+
+from channelservice.db_router import pin_primary
+from .models import (
+    Order,
+    OrderDaySummary,
+    OrderTombstone,
+)
+from .broadcast import get_broadcast
+
+
+logger = logging.getLogger(__name__)
+
+# Поля заказа в сообщении. Совпадают с полями заказа в API.
+ORDER_FIELDS = (
+    'id',
+    'source',
+    'number',
+    'order_number',
+    'dollars',
+    'delivery_time',
+    'rubles',
+)
+# Поля записи об удалении заказа в сообщении.
+TOMBSTONE_FIELDS = (
+    'order_id',
+    'source',
+    'order_number',
+    'revision',
+)
+# Количество знаков после запятой в суммах заказов.
+DECIMAL_PLACES = Order._meta.get_field('dollars').decimal_places
+
+
+def publish_revision(revision: int, reset: bool = False) -> None:
+    """
+    Публикация изменений заказов одной ревизии подписчикам.
+
+    Сообщение содержит ревизию, предыдущую ревизию, измененные
+    и удаленные заказы и новую сумму заказов в долларах. Клиент, у
+    которого предыдущая ревизия, применяет изменения из сообщения,
+    остальные догоняют изменения через ленту изменений. Если изменений
+    слишком много или нужна полная перезагрузка, заказы в сообщение не
+    включаются (upserted и deleted равны None).
+
+    Вызывается после фиксации транзакции. Ошибки публикации не должны
+    прерывать синхронизацию, поэтому только записываются в лог.
+
+    :param revision: Ревизия изменений.
+    :param reset: Признак ревизии, до которой нужна полная перезагрузка.
+    """
+
+    try:
+        # Подписчики догружают изменения через API: пока реплика догоняет
+        # ревизию, API читает из основной БД.
+        pin_primary()
+        upserted, deleted = None, None
+        if not reset:
+            upserted, deleted = _get_revision_changes(revision)
+
+        total_dollars = OrderDaySummary.objects \
+            .aggregate(Sum('total_dollars'))['total_dollars__sum']
+        get_broadcast().publish({
+            'revision': revision,
+            'base_revision': revision - 1,
+            'reset': reset,
+            'upserted': upserted,
+            'deleted': deleted,
+            'total_dollars': float(total_dollars) if total_dollars is not None else None,
+        })
+    except Exception:
+        logger.exception('Не удалось опубликовать изменения ревизии %s', revision)
+
+
+def _get_revision_changes(
+        revision: int,
+) -> Tuple[Optional[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]:
+    """
+    Получение измененных и удаленных заказов ревизии.
+
+    :param revision: Ревизия изменений.
+    :return: Измененные заказы и записи об удалении или (None, None),
+        если изменений больше ORDERS_PUSH_MAX_CHANGES.
+    """
+
+    limit = settings.ORDERS_PUSH_MAX_CHANGES
+    orders = list(
+        Order.objects
+        .filter(revision=revision)
+        .order_by('id')
+        .values_list(*ORDER_FIELDS)[:limit + 1]
+    )
+    tombstones = list(
+        OrderTombstone.objects
+        .filter(revision=revision)
+        .order_by('id')
+        .values_list(*TOMBSTONE_FIELDS)[:limit + 1 - len(orders)]
+    )
+    if len(orders) + len(tombstones) > limit:
+        return None, None
+
+    upserted = [
+        {field: _to_json(value) for field, value in zip(ORDER_FIELDS, order)}
+        for order in orders
+    ]
+    deleted = [
+        dict(zip(TOMBSTONE_FIELDS, tombstone))
+        for tombstone in tombstones
+    ]
+
+    return upserted, deleted
+
+
+def _to_json(value: Any) -> Any:
+    """
+    Приведение значения поля к виду, в котором его отдает API.
+
+    :param value: Значение поля.
+    :return: Значение для JSON.
+    """
+
+    if isinstance(value, Decimal):
+        return f'{value:.{DECIMAL_PLACES}f}'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+
+    return value
@@ -0,0 +1,311 @@
+import os
+import json
+import platform
+import subprocess
+from datetime import datetime
+from decimal import Decimal
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+    CommandParser,
+)
+from django.db import (
+    connection,
+    connections,
+)
+from django.test.utils import override_settings
+
+from channelservice.db_router import REPLICA_DB
+from googlesheets.benchmark import (
+    CbrStubServer,
+    FakeSheetsService,
+    SyntheticSheet,
+    run_api,
+    run_sync,
+)
+from googlesheets.broadcast import get_broadcast
+from googlesheets.currency_rates import CbrRateProvider
+from googlesheets.models import (
+    CurrencyRate,
+    SheetSource,
+)
+
+
+class Command(BaseCommand):
+    """
+    Команда замера производительности синхронизации и API заказов.
+
+    Работает в отдельной тестовой БД, которая создается и удаляется
+    командой, с синтетической таблицей, подменой Google Sheets API
+    и локальным сервером курсов ЦБ. Для каждого размера таблицы
+    замеряются первая загрузка, синхронизации после изменения доли
+    строк, пересчет рублей после смены курса и время ответа API.
+    Результаты выводятся в JSON, который можно сравнить с результатами
+    другого коммита через --compare.
+    """
+
+    help = 'Замер производительности синхронизации заказов и API заказов'
+
+    # Запросы к API: путь, параметры и отвечать ли из кэша ответов.
+    API_REQUESTS: List[Tuple[str, Dict[str, Any], bool]] = [
+        ('/api/googlesheets/orders/', {}, True),
+        ('/api/googlesheets/orders/', {}, False),
+        ('/api/googlesheets/orders/', {'page_size': 100}, False),
+        ('/api/googlesheets/orders/summary/', {}, False),
+        ('/api/googlesheets/orders/chart/', {'points': 500}, False),
+    ]
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--rows',
+            type=int,
+            nargs='+',
+            default=[1000, 100000, 1000000],
+            help='Размеры синтетической таблицы в строках',
+        )
+        parser.add_argument(
+            '--churn',
+            type=float,
+            nargs='+',
+            default=[0, 0.001, 0.01, 0.1],
+            help='Доли строк, изменяемых перед повторными синхронизациями',
+        )
+        parser.add_argument(
+            '--engine',
+            choices=('python', 'sql'),
+            help='Способ сравнения данных (GS_SYNC_ENGINE)',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            help='Размер страницы постраничного чтения (GS_READ_PAGE_SIZE)',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help='Количество процессов разбора и сравнения (GS_SYNC_PROCESSES)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора синтетических данных',
+        )
+        parser.add_argument(
+            '--api-repeat',
+            type=int,
+            default=5,
+            help='Количество замеряемых запросов к каждому адресу API',
+        )
+        parser.add_argument(
+            '--memory',
+            action='store_true',
+            help='Замерять пиковый объем памяти (замедляет синхронизацию)',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для результатов в JSON. По умолчанию - stdout',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Файл с результатами другого запуска для сравнения',
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options['api_repeat'] < 1:
+            raise CommandError('--api-repeat должен быть не меньше 1')
+        if options['engine'] is not None:
+            os.environ['GS_SYNC_ENGINE'] = options['engine']
+        if options['page_size'] is not None:
+            os.environ['GS_READ_PAGE_SIZE'] = str(options['page_size'])
+        if options['processes'] is not None:
+            os.environ['GS_SYNC_PROCESSES'] = str(options['processes'])
+
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Реплика на время замера совпадает с тестовой БД, как в тестах.
+        replica_settings = None
+        if REPLICA_DB in connections:
+            replica_settings = connections[REPLICA_DB].settings_dict
+            connections[REPLICA_DB].close()
+            connections[REPLICA_DB].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            with CbrStubServer() as cbr_stub, override_settings(
+                # Без DEBUG Django не копит выполненные запросы в памяти.
+                DEBUG=False,
+                CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'benchmark-sync',
+                }},
+                ORDERS_BROADCAST_BACKEND='googlesheets.broadcast.InMemoryBroadcast',
+            ):
+                os.environ['CBR_CURRENCIES_URL'] = cbr_stub.url
+                get_broadcast.cache_clear()
+                CbrRateProvider._local_cache.clear()
+
+                results = {
+                    'meta': self._get_meta(options),
+                    'sync': [],
+                    'api': [],
+                }
+                for rows in options['rows']:
+                    self._run_size(rows, cbr_stub, options, results)
+        finally:
+            get_broadcast.cache_clear()
+            if replica_settings is not None:
+                connections[REPLICA_DB].close()
+                connections[REPLICA_DB].settings_dict = replica_settings
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                self._compare(json.load(file), results)
+
+    def _run_size(
+            self,
+            rows: int,
+            cbr_stub: CbrStubServer,
+            options: Dict[str, Any],
+            results: Dict[str, Any],
+    ) -> None:
+        """
+        Замеры для одного размера таблицы.
+
+        :param rows: Количество строк таблицы.
+        :param cbr_stub: Локальный сервер курсов ЦБ.
+        :param options: Параметры команды.
+        :param results: Результаты, в которые добавляются замеры.
+        """
+
+        sheet = SyntheticSheet(rows, options['seed'])
+        service = FakeSheetsService(sheet)
+        source = SheetSource.objects.create(
+            spreadsheet_id=f'benchmark-{rows}',
+            range_name='A1:D',
+        )
+
+        def sync(scenario: str, **extra) -> None:
+            result = {
+                'rows': rows,
+                'scenario': scenario,
+                **extra,
+                **run_sync(source, service, options['memory']),
+            }
+            results['sync'].append(result)
+            self.stderr.write(
+                f'{rows:>9} {scenario:<8} {extra.get("churn", ""):<6} '
+                f'{result["total"]:.3f} s'
+            )
+
+        sync('initial')
+
+        for churn in options['churn']:
+            changed_rows = sheet.apply_churn(churn)
+            sync('churn', churn=churn, changed_rows=changed_rows)
+
+        # Новый курс доллара вызывает пересчет рублей у всех заказов.
+        cbr_stub.rate += Decimal('1')
+        CbrRateProvider._local_cache.clear()
+        CurrencyRate.objects.all().delete()
+        cache.clear()
+        sync('reprice')
+
+        for path, params, cached in self.API_REQUESTS:
+            result = {
+                'rows': rows,
+                **run_api(path, params, options['api_repeat'], cached, options['memory']),
+            }
+            results['api'].append(result)
+            self.stderr.write(
+                f'{rows:>9} {path} {params} cached={cached} '
+                f'{result["median"] * 1000:.1f} ms'
+            )
+
+        source.delete()
+
+    @staticmethod
+    def _get_meta(options: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Получение параметров запуска.
+
+        :param options: Параметры команды.
+        :return: Коммит, окружение и настройки синхронизации.
+        """
+
+        try:
+            commit = subprocess.run(
+                ('git', 'rev-parse', 'HEAD'),
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'sync_engine': os.environ.get('GS_SYNC_ENGINE', 'python'),
+            'read_page_size': int(os.environ.get('GS_READ_PAGE_SIZE', 0)),
+            'sync_processes': int(os.environ.get('GS_SYNC_PROCESSES', 1)),
+            'seed': options['seed'],
+            'memory': options['memory'],
+        }
+
+    def _compare(self, baseline: Dict[str, Any], results: Dict[str, Any]) -> None:
+        """
+        Вывод изменения времени относительно другого запуска.
+
+        Сравниваются общее время синхронизаций и медианное время ответа
+        API с одинаковыми параметрами.
+
+        :param baseline: Результаты другого запуска.
+        :param results: Результаты этого запуска.
+        """
+
+        def sync_key(result: Dict[str, Any]) -> Tuple:
+            return result['rows'], result['scenario'], result.get('churn')
+
+        def api_key(result: Dict[str, Any]) -> Tuple:
+            return result['rows'], result['path'], json.dumps(result['params']), result['cached']
+
+        rows = []
+        for section, key, metric in (
+                ('sync', sync_key, 'total'),
+                ('api', api_key, 'median'),
+        ):
+            baseline_values = {key(result): result[metric] for result in baseline[section]}
+            for result in results[section]:
+                before = baseline_values.get(key(result))
+                if before:
+                    change = (result[metric] - before) / before * 100
+                    name = ' '.join(str(part) for part in key(result) if part is not None)
+                    rows.append(
+                        f'{section:<4} {name}: '
+                        f'{before:.4f} -> {result[metric]:.4f} ({change:+.1f}%)'
+                    )
+
+        self.stderr.write(
+            f'Сравнение с {baseline["meta"].get("commit")}:\n' + '\n'.join(rows),
+        )
@@ -0,0 +1,483 @@
+import os
+import glob
+import json
+import time
+import asyncio
+import logging
+from contextlib import (
+    ExitStack,
+    contextmanager,
+)
+from contextvars import ContextVar
+from itertools import chain
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+from django.conf import settings
+from django.db import connections
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.metrics_core import Metric
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Признак конца итератора.
+_END = object()
+
+# Границы корзин гистограмм времени в секундах.
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1, 2.5, 5, 10, 25, 60, 120, 300,
+)
+
+PHASE_SECONDS = Histogram(
+    'channelservice_phase_seconds',
+    'Время этапов фоновых задач',
+    ('task', 'phase'),
+    buckets=SECONDS_BUCKETS,
+)
+PHASE_DB_SECONDS = Histogram(
+    'channelservice_phase_db_seconds',
+    'Время запросов к БД на этапах фоновых задач',
+    ('task', 'phase'),
+    buckets=SECONDS_BUCKETS,
+)
+PHASE_DB_QUERIES = Counter(
+    'channelservice_phase_db_queries',
+    'Количество запросов к БД на этапах фоновых задач',
+    ('task', 'phase'),
+)
+SYNC_ROWS = Counter(
+    'channelservice_sync_rows',
+    'Строки, обработанные синхронизацией: fetched - прочитанные из таблицы, '
+    'inserted и updated - добавленные и обновленные заказы, upserted - '
+    'записанные заказы при GS_SYNC_ENGINE=sql, deleted - удаленные, '
+    'repriced - заказы с пересчитанными рублями, quarantined - строки '
+    'с ошибками',
+    ('operation', ),
+)
+DOWNLOADED_BYTES = Counter(
+    'channelservice_downloaded_bytes',
+    'Объем ответов внешних API',
+    ('api', ),
+)
+TELEGRAM_MESSAGES = Counter(
+    'channelservice_telegram_messages',
+    'Попытки отправки сообщений в Telegram по результату: sent - '
+    'отправлено, rate_limited - ответ 429, failed - ошибка',
+    ('outcome', ),
+)
+TELEGRAM_SEND_SECONDS = Histogram(
+    'channelservice_telegram_send_seconds',
+    'Время запроса отправки сообщения в Telegram без ожидания лимитов',
+    buckets=SECONDS_BUCKETS,
+)
+API_REQUEST_SECONDS = Histogram(
+    'channelservice_api_request_seconds',
+    'Время ответа API, включая чтение потокового ответа',
+    ('route', 'method', 'status'),
+    buckets=SECONDS_BUCKETS,
+)
+API_DB_SECONDS = Histogram(
+    'channelservice_api_db_seconds',
+    'Время запросов к БД при ответе API',
+    ('route', ),
+    buckets=SECONDS_BUCKETS,
+)
+API_DB_QUERIES = Counter(
+    'channelservice_api_db_queries',
+    'Количество запросов к БД при ответе API',
+    ('route', ),
+)
+
+
+class QueryStats:
+    """
+    Класс учета запросов к БД.
+
+    Подключается ко всем соединениям с БД через execute_wrapper и считает
+    количество и суммарное время выполненных запросов.
+    """
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self.queries = 0
+        self.seconds = 0.0
+
+    @contextmanager
+    def track(self) -> Iterator['QueryStats']:
+        """Учет запросов, выполненных в блоке with"""
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def __call__(self, execute: Callable, sql: str, params, many: bool, context) -> Any:
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started_at
+
+
+# Учет запросов к БД текущего запроса к API. Контекст передается в потоки,
+# где асинхронные представления выполняют запросы к БД.
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar('request_stats', default=None)
+
+
+@contextmanager
+def track_request_queries() -> Iterator[None]:
+    """
+    Учет запросов к БД, выполненных в блоке with, в замере текущего
+    запроса к API.
+
+    Нужен в потоках, отличных от потока запроса: соединения с БД у каждого
+    потока свои. Вне запроса к API ничего не делает.
+    """
+
+    stats = _request_stats.get()
+    if stats is None:
+        yield
+        return
+
+    with stats.track():
+        yield
+
+
+@contextmanager
+def span(task: str, phase: str, **fields) -> Iterator[Dict[str, Any]]:
+    """
+    Замер этапа фоновой задачи.
+
+    Время этапа, время и количество запросов к БД попадают в метрики,
+    а при METRICS_LOG_JSON - еще и в лог одной JSON-строкой вместе
+    с полями, которые можно дополнить внутри блока with.
+
+    :param task: Задача, например, sync.
+    :param phase: Этап задачи.
+    :param fields: Поля записи в логе, например, id источника данных.
+    :return: Поля записи в логе.
+    """
+
+    stats = QueryStats()
+    started_at = time.perf_counter()
+    error = None
+    try:
+        with stats.track():
+            yield fields
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started_at
+        PHASE_SECONDS.labels(task, phase).observe(seconds)
+        PHASE_DB_SECONDS.labels(task, phase).observe(stats.seconds)
+        PHASE_DB_QUERIES.labels(task, phase).inc(stats.queries)
+        log_event(
+            'span',
+            task=task,
+            phase=phase,
+            seconds=round(seconds, 6),
+            db_seconds=round(stats.seconds, 6),
+            db_queries=stats.queries,
+            error=error,
+            **fields,
+        )
+
+
+def iter_span(task: str, phase: str, items: Iterable[T]) -> Iterator[T]:
+    """
+    Замер получения элементов итератора как одного этапа.
+
+    Замеряется только время внутри итератора, а не обработка элементов.
+
+    :param task: Задача.
+    :param phase: Этап задачи.
+    :param items: Итерируемый объект, например, страницы таблицы.
+    :return: Итератор по тем же элементам.
+    """
+
+    iterator = iter(items)
+    while True:
+        with span(task, phase):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def count_rows(operation: str, count: int) -> None:
+    """
+    Учет строк, обработанных синхронизацией.
+
+    :param operation: Операция (см. SYNC_ROWS).
+    :param count: Количество строк.
+    """
+
+    if count:
+        SYNC_ROWS.labels(operation).inc(count)
+
+
+def count_bytes(api: str, count: int) -> None:
+    """
+    Учет объема ответа внешнего API.
+
+    :param api: Внешний API, например, sheets или cbr.
+    :param count: Количество байт.
+    """
+
+    DOWNLOADED_BYTES.labels(api).inc(count)
+
+
+def log_event(event: str, **fields) -> None:
+    """
+    Запись события в лог одной JSON-строкой, если включен METRICS_LOG_JSON.
+
+    :param event: Тип события.
+    :param fields: Поля события.
+    """
+
+    if settings.METRICS_LOG_JSON:
+        logger.info(json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+
+class MultiServiceCollector:
+    """
+    Класс сбора метрик процессов нескольких служб.
+
+    Каждая служба (веб-сервер, воркер Celery) пишет метрики своих процессов
+    в свой каталог PROMETHEUS_MULTIPROC_DIR и очищает его перед запуском
+    (см. docker-entrypoint.sh), не задевая файлы других служб. Метрики
+    собираются из всех каталогов сразу.
+    """
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        """
+        Инициализатор класса.
+
+        :param paths: Каталоги метрик процессов служб.
+        """
+
+        self.__paths = list(paths)
+
+    def collect(self) -> Iterable[Metric]:
+        files = chain.from_iterable(
+            glob.glob(os.path.join(path, '*.db'))
+            for path in self.__paths
+        )
+
+        return multiprocess.MultiProcessCollector.merge(sorted(files), accumulate=True)
+
+
+def get_metrics_dirs() -> List[str]:
+    """
+    Получение каталогов метрик процессов всех служб.
+
+    :return: Подкаталоги METRICS_MULTIPROC_ROOT, если он задан, иначе -
+        каталог PROMETHEUS_MULTIPROC_DIR текущей службы.
+    """
+
+    root = settings.METRICS_MULTIPROC_ROOT
+    if not root:
+        return [os.environ['PROMETHEUS_MULTIPROC_DIR']]
+
+    return sorted(
+        entry.path
+        for entry in os.scandir(root)
+        if entry.is_dir()
+    )
+
+
+def get_metrics() -> bytes:
+    """
+    Получение метрик в текстовом формате Prometheus.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, метрики собираются из файлов
+    всех процессов веб-сервера и воркеров Celery (см. get_metrics_dirs()),
+    иначе - только текущего процесса.
+
+    :return: Метрики.
+    """
+
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    registry.register(MultiServiceCollector(get_metrics_dirs()))
+
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Отметка завершения процесса для многопроцессного сбора метрик.
+
+    Значения счетчиков и гистограмм завершившегося процесса при этом
+    сохраняются.
+
+    :param pid: id процесса.
+    """
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    Промежуточный слой замера времени ответа API и запросов к БД.
+
+    Потоковые ответы замеряются до конца чтения: запросы к БД выполняются
+    и при формировании частей ответа. Запросы к другим адресам, кроме
+    API, не замеряются.
+
+    Работает и в синхронной, и в асинхронной цепочке обработчиков.
+    Запросы к БД, которые асинхронные представления выполняют в других
+    потоках, учитываются через track_request_queries().
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    # Префикс адресов API.
+    path_prefix = '/api/'
+
+    def __init__(self, get_response: Callable) -> None:
+        """
+        Инициализатор класса.
+
+        :param get_response: Следующий обработчик запроса.
+        """
+
+        self.get_response = get_response
+        self.__is_async = asyncio.iscoroutinefunction(get_response)
+        if self.__is_async:
+            # Признак асинхронного обработчика для Django, как
+            # у MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.__is_async:
+            return self.__acall__(request)
+
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+
+        stats = QueryStats()
+        started_at = time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            with stats.track():
+                response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+
+        return self._observe(request, response, stats, started_at)
+
+    async def __acall__(self, request):
+        """Обработка запроса в асинхронной цепочке обработчиков"""
+
+        if not request.path.startswith(self.path_prefix):
+            return await self.get_response(request)
+
+        stats = QueryStats()
+        started_at = time.perf_counter()
+        token = _request_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+
+        return self._observe(request, response, stats, started_at)
+
+    def _observe(self, request, response, stats: QueryStats, started_at: float):
+        """
+        Запись замеров ответа.
+
+        У потокового ответа замеры записываются после чтения ответа.
+
+        :param request: Объект запроса.
+        :param response: Объект ответа.
+        :param stats: Учет запросов к БД этого запроса.
+        :param started_at: Время начала обработки запроса.
+        :return: Объект ответа.
+        """
+
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+
+        def observe() -> None:
+            seconds = time.perf_counter() - started_at
+            API_REQUEST_SECONDS \
+                .labels(route, request.method, response.status_code) \
+                .observe(seconds)
+            API_DB_SECONDS.labels(route).observe(stats.seconds)
+            API_DB_QUERIES.labels(route).inc(stats.queries)
+            log_event(
+                'request',
+                route=route,
+                method=request.method,
+                status=response.status_code,
+                seconds=round(seconds, 6),
+                db_seconds=round(stats.seconds, 6),
+                db_queries=stats.queries,
+            )
+
+        if response.streaming:
+            response.streaming_content = self._iter_content(
+                response.streaming_content,
+                stats,
+                observe,
+            )
+        else:
+            observe()
+
+        return response
+
+    @staticmethod
+    def _iter_content(
+            content: Iterable[bytes],
+            stats: QueryStats,
+            observe: Callable[[], None],
+    ) -> Iterator[bytes]:
+        """
+        Чтение потокового ответа с учетом запросов к БД.
+
+        Запросы учитываются только во время получения каждой части,
+        поэтому запросы других ответов, которые читаются в том же потоке,
+        не попадают в замер.
+
+        :param content: Части ответа.
+        :param stats: Учет запросов к БД этого ответа.
+        :param observe: Запись замеров после чтения ответа.
+        :return: Итератор по частям ответа.
+        """
+
+        iterator = iter(content)
+        try:
+            while True:
+                with stats.track():
+                    chunk = next(iterator, _END)
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            observe()
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SheetSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spreadsheet_id', models.CharField(max_length=128, verbose_name='ID таблицы')),
+                ('range_name', models.CharField(max_length=255, verbose_name='Диапазон ячеек')),
+                ('fingerprint', models.CharField(blank=True, default='', max_length=64, verbose_name='Отпечаток данных')),
+                ('synced_at', models.DateTimeField(blank=True, null=True, verbose_name='Время последней синхронизации')),
+            ],
+            options={
+                'verbose_name': 'Источник данных',
+                'verbose_name_plural': 'Источники данных',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='order',
+            options={'ordering': ('delivery_time',), 'verbose_name': 'Заказ', 'verbose_name_plural': 'Заказы'},
+        ),
+        migrations.AddConstraint(
+            model_name='sheetsource',
+            constraint=models.UniqueConstraint(fields=('spreadsheet_id', 'range_name'), name='unique_sheet_source'),
+        ),
+    ]
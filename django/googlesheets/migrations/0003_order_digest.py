@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0002_sheetsource'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32, verbose_name='Дайджест строки таблицы'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:35
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0003_order_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('char_code', models.CharField(max_length=3, verbose_name='Код валюты')),
+                ('date', models.DateField(verbose_name='Дата курса')),
+                ('value', models.DecimalField(decimal_places=8, max_digits=18, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Курс к рублю')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время получения')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'ordering': ('-date',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='currencyrate',
+            constraint=models.UniqueConstraint(fields=('char_code', 'date'), name='unique_currency_rate'),
+        ),
+    ]
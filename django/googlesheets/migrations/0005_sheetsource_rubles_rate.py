@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0004_currencyrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sheetsource',
+            name='rubles_rate',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=18, null=True, verbose_name='Курс, по которому посчитаны рубли'),
+        ),
+    ]
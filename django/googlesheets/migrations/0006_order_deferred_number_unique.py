@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:37
+
+from django.db import migrations, models
+import django.db.models.constraints
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0005_sheetsource_rubles_rate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='number',
+            field=models.PositiveIntegerField(verbose_name='Номер записи'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(deferrable=django.db.models.constraints.Deferrable['DEFERRED'], fields=('number',), name='unique_order_row_number'),
+        ),
+    ]
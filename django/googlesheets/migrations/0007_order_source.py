@@ -0,0 +1,62 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_orders_source(apps, schema_editor):
+    """
+    Привязка существующих заказов к источнику данных.
+
+    Если источников еще нет, регистрируется таблица из настроек. Заказы,
+    которые не к чему привязать, удаляются: при следующей синхронизации они
+    будут загружены заново.
+    """
+
+    Order = apps.get_model('googlesheets', 'Order')
+    SheetSource = apps.get_model('googlesheets', 'SheetSource')
+    db_alias = schema_editor.connection.alias
+
+    source = SheetSource.objects.using(db_alias).order_by('pk').first()
+    if source is None and settings.GS_SPREADSHEET_ID and settings.GS_RANGE_NAME:
+        source = SheetSource.objects.using(db_alias).create(
+            spreadsheet_id=settings.GS_SPREADSHEET_ID,
+            range_name=settings.GS_RANGE_NAME,
+        )
+
+    orders = Order.objects.using(db_alias).filter(source__isnull=True)
+    if source is None:
+        orders.delete()
+    else:
+        orders.update(source=source)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0006_order_deferred_number_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='order',
+            name='unique_order_row_number',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='googlesheets.sheetsource', verbose_name='Источник данных'),
+        ),
+        migrations.AddField(
+            model_name='sheetsource',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Синхронизировать'),
+        ),
+        migrations.AddField(
+            model_name='sheetsource',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Название'),
+        ),
+        migrations.RunPython(assign_orders_source, migrations.RunPython.noop),
+    ]
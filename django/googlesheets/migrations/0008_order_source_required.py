@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:46
+
+from django.db import migrations, models
+import django.db.models.constraints
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0007_order_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='googlesheets.sheetsource', verbose_name='Источник данных'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.PositiveIntegerField(verbose_name='Номер заказа'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('source', 'order_number'), name='unique_source_order_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(deferrable=django.db.models.constraints.Deferrable['DEFERRED'], fields=('source', 'number'), name='unique_source_row_number'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:49
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_expired_orders_notified(apps, schema_editor):
+    """
+    Пометка уже просроченных заказов уведомленными.
+
+    О них уже сообщалось в отчетах, поэтому повторно в уведомления о новых
+    просрочках они не попадают.
+    """
+
+    Order = apps.get_model('googlesheets', 'Order')
+    Order.objects \
+        .using(schema_editor.connection.alias) \
+        .filter(delivery_time__lt=timezone.localdate()) \
+        .update(expired_notified_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0008_order_source_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='expired_notified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Время уведомления о просрочке'),
+        ),
+        migrations.RunPython(mark_expired_orders_notified, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['delivery_time'], name='order_delivery_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('expired_notified_at__isnull', True)), fields=['delivery_time'], name='order_expiry_pending_idx'),
+        ),
+    ]
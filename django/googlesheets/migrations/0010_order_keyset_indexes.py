@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0009_order_expired_notified_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_delivery_time_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['delivery_time', 'id'], name='order_delivery_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['source', 'delivery_time', 'id'], name='order_source_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_number', 'delivery_time'], name='order_number_delivery_idx'),
+        ),
+    ]
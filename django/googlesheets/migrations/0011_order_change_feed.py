@@ -0,0 +1,67 @@
+# Generated by Django 4.0.6 on 2026-10-17 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_sync_revision(apps, schema_editor):
+    """Создание счетчика ревизий данных о заказах"""
+
+    SyncRevision = apps.get_model('googlesheets', 'SyncRevision')
+    SyncRevision.objects.using(schema_editor.connection.alias).get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0010_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.PositiveBigIntegerField(verbose_name='id заказа')),
+                ('order_number', models.PositiveIntegerField(verbose_name='Номер заказа')),
+                ('revision', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Ревизия')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время удаления')),
+            ],
+            options={
+                'verbose_name': 'Удаленный заказ',
+                'verbose_name_plural': 'Удаленные заказы',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='Последняя ревизия')),
+                ('reset_value', models.PositiveBigIntegerField(default=0, verbose_name='Ревизия, до которой нужна полная перезагрузка')),
+            ],
+            options={
+                'verbose_name': 'Ревизия данных',
+                'verbose_name_plural': 'Ревизии данных',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='revision',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='Ревизия'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['revision'], name='order_revision_idx'),
+        ),
+        migrations.AddField(
+            model_name='ordertombstone',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='googlesheets.sheetsource', verbose_name='Источник данных'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertombstone',
+            index=models.Index(fields=['revision'], name='order_tombstone_revision_idx'),
+        ),
+        migrations.RunPython(create_sync_revision, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.0.6 on 2026-10-17 12:06
+
+from django.db import migrations, models
+from django.db.models import (
+    Count,
+    Max,
+    Sum,
+)
+import django.db.models.deletion
+
+
+def fill_order_day_summaries(apps, schema_editor):
+    """Построение сводок по дням для уже загруженных заказов"""
+
+    Order = apps.get_model('googlesheets', 'Order')
+    OrderDaySummary = apps.get_model('googlesheets', 'OrderDaySummary')
+    db_alias = schema_editor.connection.alias
+
+    OrderDaySummary.objects.using(db_alias).bulk_create(
+        (
+            OrderDaySummary(**row)
+            for row in Order.objects
+            .using(db_alias)
+            .order_by()
+            .values('source_id', 'delivery_time')
+            .annotate(
+                count=Count('id'),
+                total_dollars=Sum('dollars'),
+                total_rubles=Sum('rubles'),
+                max_dollars=Max('dollars'),
+            )
+            .iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0011_order_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDaySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_time', models.DateField(verbose_name='Срок поставки')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество заказов')),
+                ('total_dollars', models.DecimalField(decimal_places=5, max_digits=24, verbose_name='Сумма в долларах США')),
+                ('total_rubles', models.DecimalField(decimal_places=5, max_digits=24, verbose_name='Сумма в рублях РФ')),
+                ('max_dollars', models.DecimalField(decimal_places=5, max_digits=18, verbose_name='Максимальная стоимость в долларах США')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_summaries', to='googlesheets.sheetsource', verbose_name='Источник данных')),
+            ],
+            options={
+                'verbose_name': 'Сводка по заказам за день',
+                'verbose_name_plural': 'Сводки по заказам за день',
+                'ordering': ('delivery_time',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderdaysummary',
+            constraint=models.UniqueConstraint(fields=('source', 'delivery_time'), name='unique_source_delivery_day'),
+        ),
+        migrations.RunPython(fill_order_day_summaries, migrations.RunPython.noop),
+    ]
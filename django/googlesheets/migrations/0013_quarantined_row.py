@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-17 12:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('googlesheets', '0012_order_day_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuarantinedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Порядковый номер строки данных')),
+                ('values', models.JSONField(verbose_name='Значения ячеек')),
+                ('reason', models.CharField(max_length=255, verbose_name='Причина')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время обнаружения')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quarantined_rows', to='googlesheets.sheetsource', verbose_name='Источник данных')),
+            ],
+            options={
+                'verbose_name': 'Строка с ошибкой',
+                'verbose_name_plural': 'Строки с ошибками',
+                'ordering': ('source', 'position'),
+            },
+        ),
+    ]
@@ -1,17 +1,22 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
 class Order(models.Model):
     """Модель данных о заказе"""
 
+    source = models.ForeignKey(
+        'SheetSource',
+        on_delete=models.CASCADE,
+        related_name='orders',
+        verbose_name=_('Источник данных'),
+    )
     number = models.PositiveIntegerField(
-        unique=True,
         verbose_name=_('Номер записи'),
     )
     order_number = models.PositiveIntegerField(
-        unique=True,
         verbose_name=_('Номер заказа'),
     )
     dollars = models.DecimalField(
@@ -29,6 +34,27 @@ class Order(models.Model):
         validators=(MinValueValidator(0), ),
         verbose_name=_('Рубли РФ'),
     )
+    digest = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name=_('Дайджест строки таблицы'),
+    )
+    expired_notified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('Время уведомления о просрочке'),
+    )
+    # Ревизия, в которой заказ изменился последний раз. Пока транзакция
+    # синхронизации не завершена, ревизия не назначена.
+    revision = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('Ревизия'),
+    )
 
     class Meta:
         """Настройки модели"""
@@ -36,8 +62,330 @@ class Order(models.Model):
         verbose_name = _('Заказ')
         verbose_name_plural = _('Заказы')
         ordering = ('delivery_time', )
+        indexes = (
+            # Индекс под сортировку по умолчанию и постраничную выдачу
+            # по курсору (delivery_time, id).
+            models.Index(
+                fields=('delivery_time', 'id'),
+                name='order_delivery_time_id_idx',
+            ),
+            models.Index(
+                fields=('source', 'delivery_time', 'id'),
+                name='order_source_delivery_idx',
+            ),
+            models.Index(
+                fields=('order_number', 'delivery_time'),
+                name='order_number_delivery_idx',
+            ),
+            # Индекс по заказам, о просрочке которых еще не уведомляли.
+            # Остается маленьким, т.к. уведомленные заказы в него не входят.
+            models.Index(
+                fields=('delivery_time', ),
+                name='order_expiry_pending_idx',
+                condition=models.Q(expired_notified_at__isnull=True),
+            ),
+            models.Index(
+                fields=('revision', ),
+                name='order_revision_idx',
+            ),
+        )
+        constraints = (
+            # Номера заказов и номера записей уникальны в пределах
+            # источника данных.
+            models.UniqueConstraint(
+                fields=('source', 'order_number'),
+                name='unique_source_order_number',
+            ),
+            # Проверка откладывается до конца транзакции, чтобы при
+            # синхронизации заказы могли меняться номерами записей.
+            models.UniqueConstraint(
+                fields=('source', 'number'),
+                name='unique_source_row_number',
+                deferrable=models.Deferrable.DEFERRED,
+            ),
+        )
 
     def __str__(self) -> str:
         """Строковое представление объекта"""
 
         return f'Заказ#{self.order_number}'
+
+
+class SheetSource(models.Model):
+    """
+    Модель источника данных - диапазона ячеек Google-таблицы.
+
+    Источники ведутся в админке. Каждый активный источник синхронизируется
+    отдельной задачей, также модель хранит состояние последней
+    синхронизации таблицы с БД.
+    """
+
+    title = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name=_('Название'),
+    )
+    spreadsheet_id = models.CharField(
+        max_length=128,
+        verbose_name=_('ID таблицы'),
+    )
+    range_name = models.CharField(
+        max_length=255,
+        verbose_name=_('Диапазон ячеек'),
+    )
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name=_('Синхронизировать'),
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name=_('Отпечаток данных'),
+    )
+    synced_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Время последней синхронизации'),
+    )
+    rubles_rate = models.DecimalField(
+        max_digits=18,
+        decimal_places=8,
+        null=True,
+        blank=True,
+        verbose_name=_('Курс, по которому посчитаны рубли'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Источник данных')
+        verbose_name_plural = _('Источники данных')
+        constraints = (
+            models.UniqueConstraint(
+                fields=('spreadsheet_id', 'range_name'),
+                name='unique_sheet_source',
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return self.title or f'{self.spreadsheet_id} ({self.range_name})'
+
+
+class CurrencyRate(models.Model):
+    """Модель истории курсов валют ЦБ РФ к рублю"""
+
+    char_code = models.CharField(
+        max_length=3,
+        verbose_name=_('Код валюты'),
+    )
+    date = models.DateField(
+        verbose_name=_('Дата курса'),
+    )
+    value = models.DecimalField(
+        max_digits=18,
+        decimal_places=8,
+        validators=(MinValueValidator(0), ),
+        verbose_name=_('Курс к рублю'),
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Время получения'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Курс валюты')
+        verbose_name_plural = _('Курсы валют')
+        ordering = ('-date', )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('char_code', 'date'),
+                name='unique_currency_rate',
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return f'{self.char_code} {self.date}: {self.value}'
+
+
+class OrderTombstone(models.Model):
+    """
+    Модель записи об удалении заказа для ленты изменений.
+
+    Старые записи удаляются при сжатии ленты.
+    """
+
+    source = models.ForeignKey(
+        'SheetSource',
+        on_delete=models.CASCADE,
+        related_name='tombstones',
+        verbose_name=_('Источник данных'),
+    )
+    order_id = models.PositiveBigIntegerField(
+        verbose_name=_('id заказа'),
+    )
+    order_number = models.PositiveIntegerField(
+        verbose_name=_('Номер заказа'),
+    )
+    revision = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_('Ревизия'),
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_('Время удаления'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Удаленный заказ')
+        verbose_name_plural = _('Удаленные заказы')
+        indexes = (
+            models.Index(
+                fields=('revision', ),
+                name='order_tombstone_revision_idx',
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return f'Заказ#{self.order_number} удален в ревизии {self.revision}'
+
+
+class SyncRevision(models.Model):
+    """
+    Модель счетчика ревизий данных о заказах.
+
+    Единственная запись. Блокируется на время назначения ревизии до конца
+    транзакции, поэтому ревизии фиксируются в порядке возрастания.
+    """
+
+    value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name=_('Последняя ревизия'),
+    )
+    reset_value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name=_('Ревизия, до которой нужна полная перезагрузка'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Ревизия данных')
+        verbose_name_plural = _('Ревизии данных')
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return f'Ревизия {self.value}'
+
+
+class OrderDaySummary(models.Model):
+    """
+    Модель сводки по заказам источника данных за один день поставки.
+
+    Пересчитывается для дней, в которых изменились заказы, в той же
+    транзакции, что и изменения. Итоги по всем заказам складываются
+    из сводок по дням, поэтому не зависят от размера таблицы заказов.
+    """
+
+    source = models.ForeignKey(
+        'SheetSource',
+        on_delete=models.CASCADE,
+        related_name='day_summaries',
+        verbose_name=_('Источник данных'),
+    )
+    delivery_time = models.DateField(
+        verbose_name=_('Срок поставки'),
+    )
+    count = models.PositiveIntegerField(
+        verbose_name=_('Количество заказов'),
+    )
+    total_dollars = models.DecimalField(
+        max_digits=24,
+        decimal_places=5,
+        verbose_name=_('Сумма в долларах США'),
+    )
+    total_rubles = models.DecimalField(
+        max_digits=24,
+        decimal_places=5,
+        verbose_name=_('Сумма в рублях РФ'),
+    )
+    max_dollars = models.DecimalField(
+        max_digits=18,
+        decimal_places=5,
+        verbose_name=_('Максимальная стоимость в долларах США'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Сводка по заказам за день')
+        verbose_name_plural = _('Сводки по заказам за день')
+        ordering = ('delivery_time', )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('source', 'delivery_time'),
+                name='unique_source_delivery_day',
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return f'{self.delivery_time}: {self.count} заказов'
+
+
+class QuarantinedRow(models.Model):
+    """
+    Модель строки Google-таблицы, которую не удалось разобрать.
+
+    Строки с ошибками не прерывают синхронизацию, а сохраняются здесь
+    с причиной ошибки. Заказ из такой строки в БД не попадает, пока
+    строку не исправят. Записи источника заменяются при каждой
+    синхронизации, в которой изменилась таблица.
+    """
+
+    source = models.ForeignKey(
+        'SheetSource',
+        on_delete=models.CASCADE,
+        related_name='quarantined_rows',
+        verbose_name=_('Источник данных'),
+    )
+    position = models.PositiveIntegerField(
+        verbose_name=_('Порядковый номер строки данных'),
+    )
+    values = models.JSONField(
+        verbose_name=_('Значения ячеек'),
+    )
+    reason = models.CharField(
+        max_length=255,
+        verbose_name=_('Причина'),
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_('Время обнаружения'),
+    )
+
+    class Meta:
+        """Настройки модели"""
+
+        verbose_name = _('Строка с ошибкой')
+        verbose_name_plural = _('Строки с ошибками')
+        ordering = ('source', 'position')
+
+    def __str__(self) -> str:
+        """Строковое представление объекта"""
+
+        return f'Строка {self.position}: {self.reason}'
@@ -1,4 +1,4 @@
-import telebot
+from itertools import groupby
 from typing import (
     Optional,
     Collection,
@@ -8,38 +8,56 @@ from django.conf import settings
 
 
 from .models import Order
+from .telegram_delivery import TelegramDelivery
+from .metrics import span
 
 
 class NotifierExpiredOrders:
     """
     Класс уведомителя о просроченных заказах в Telegram.
 
-    Принимает не вход коллекцию заказов и строит по ним отчет.
+    Принимает не вход коллекцию заказов и строит по ним отчет. Заказы
+    в отчете группируются по источникам данных, поэтому должны быть
+    упорядочены по источнику.
     """
 
-    def __init__(self, expired_orders: Optional[Collection[Order]] = None) -> None:
-        """Инициализатор класса"""
+    def __init__(
+            self,
+            expired_orders: Optional[Collection[Order]] = None,
+            title: str = 'Просроченные заказы',
+    ) -> None:
+        """
+        Инициализатор класса.
+
+        :param expired_orders: Просроченные заказы.
+        :param title: Заголовок отчета.
+        """
 
+        self.__title = title
         self.__access_user_id: List[str] = settings.TELEGRAM_ACCESS_USER_ID
-        self.__bot = telebot.TeleBot(settings.TELEGRAM_TOKEN)
-        self.__expired_orders: List[Order] = expired_orders \
+        self.__delivery = TelegramDelivery()
+        self.__expired_orders: List[Order] = list(expired_orders) \
             if expired_orders is not None else []
 
-    def send_report(self) -> None:
-        """Формирование и отправка отчета о просроченных заказах"""
+    def send_report(self) -> int:
+        """
+        Формирование и отправка отчета о просроченных заказах.
+
+        :return: Количество чатов, получивших отчет целиком.
+        """
+
+        if not self.__expired_orders:
+            return 0
 
-        if len(self.__expired_orders) > 0:
-            # Формирование сообщения.
-            message = 'Просроченные заказы:\n'
-            for i, order in enumerate(self.__expired_orders):
-                message += f'{i + 1}. ' \
-                           f'Заказ#{order.order_number} ' \
-                           f'Дата: {order.delivery_time} ' \
-                           f'Цена: {order.dollars}\n'
+        # Формирование сообщения.
+        with span('notify', 'build_message', orders=len(self.__expired_orders)):
+            message = self._build_message()
 
-            # Отправка сообщений.
-            for user_id in self.__access_user_id:
-                self.__bot.send_message(user_id, message)
+        # Отправка сообщений всем пользователям одновременно.
+        with span('notify', 'telegram') as fields:
+            fields['delivered'] = self.__delivery.send(self.__access_user_id, message)
+
+        return fields['delivered']
 
     def add_order(self, expired_order: Order) -> None:
         """
@@ -58,3 +76,23 @@ class NotifierExpiredOrders:
         """
 
         self.__expired_orders.remove(order)
+
+    def _build_message(self) -> str:
+        """
+        Формирование текста отчета.
+
+        :return: Текст отчета.
+        """
+
+        lines = [f'{self.__title}:']
+        for source, orders in groupby(self.__expired_orders, key=lambda order: order.source):
+            lines.append(f'\n{source}:')
+            lines.extend(
+                f'{i}. '
+                f'Заказ#{order.order_number} '
+                f'Дата: {order.delivery_time} '
+                f'Цена: {order.dollars}'
+                for i, order in enumerate(orders, 1)
+            )
+
+        return '\n'.join(lines)
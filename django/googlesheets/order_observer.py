@@ -1,268 +1,614 @@
-import httplib2
-import requests
-from enum import (
-    IntEnum,
-    auto,
-)
-import httplib2shim
+import json
+import hashlib
+import logging
+from enum import Enum
 from typing import (
     List,
     Dict,
     Any,
     Optional,
     Set,
+    Tuple,
 )
+from itertools import chain
 from decimal import Decimal
 from decouple import config
-from datetime import datetime
-from bs4 import BeautifulSoup
-from django.conf import settings
 from django.db import transaction
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Order,
+    QuarantinedRow,
+    SheetSource,
+)
+from .currency_rates import CbrRateProvider
+from .bulk_writer import (
+    OrderRow,
+    OrderBulkWriter,
+    get_bulk_writer,
+)
+from .row_parser import (
+    RowError,
+    RowParser,
+    get_error_order_numbers,
+)
+from .sync_partitions import (
+    PartitionedDiff,
+    diff_orders,
+    get_processes_count,
+)
+from .sheet_reader import SheetReader
+from .google_client import get_sheets_service
+from .sync_version import bump_sync_version
+from .change_log import (
+    commit_revision,
+    reset_revision,
+)
+from .order_summary import (
+    refresh_day_summaries,
+    rebuild_day_summaries,
+)
+from .metrics import (
+    span,
+    iter_span,
+    count_rows,
+)
 
-from .models import Order
+
+logger = logging.getLogger(__name__)
 
 
 class OrderObserver:
     """
-    Класс для мониторинга и обработки заказов из Google Sheets.
+    Класс для мониторинга и обработки заказов одного источника данных.
+
+    Все запросы к таблице заказов ограничены заказами этого источника,
+    поэтому разные источники могут синхронизироваться параллельно.
 
     Алгоритм работы:
-        1. Получает все данные из таблицы.
-        2. Формирует из данных словарь, чтобы можно было получать данные о
-        каком-либо заказе по номеру этого заказа.
-        3. Формирует множества номеров заказов для удаления, обновления
-        и создания:
-            - заказы, которые есть и в таблице, и в БД, могут быть обновлены;
+        1. Получает курс доллара на текущий день.
+        2. Получает все данные из таблицы.
+        3. Сравнивает отпечаток данных с отпечатком прошлой синхронизации.
+        Если таблица не менялась, сразу переходит к шагу 9.
+        4. Разбирает строки таблицы по столбцам (googlesheets.row_parser)
+        и формирует из них словарь, чтобы можно было получать данные о
+        каком-либо заказе по номеру этого заказа. Строки с неверными
+        значениями не прерывают синхронизацию, а сохраняются в
+        QuarantinedRow. Заказы из таких строк остаются в БД в последнем
+        верном виде, пока строку не исправят. Удаляются только заказы,
+        номера которых в строках с ошибками не разобрать.
+        5. Сравнивает дайджесты строк таблицы с дайджестами заказов в БД
+        и формирует множества номеров заказов для удаления, обновления
+        и создания (в памяти процесса либо, при GS_SYNC_ENGINE=sql, в БД
+        через промежуточную таблицу):
+            - заказы, которые есть и в таблице, и в БД, обновляются, только
+            если изменился дайджест;
             - заказы, которые есть только в БД, должны быть удалены;
             - заказы, которые есть только в таблице, должны быть добавлены.
-        4. Удаляет заказы, которые нужно удалить.
-        5. Получает курс доллара на текущий день.
-        6. Обновляет только те записи, которые действительно изменились.
-        7. Создает новые записи и добавляет их в БД.
+        6. Удаляет заказы, которые нужно удалить.
+        7. Добавляет новые и обновляет изменившиеся записи одним
+        upsert-запросом на пачку.
+        8. Пересчитывает сводки по дням, в которых изменились заказы,
+        назначает изменениям новую ревизию ленты изменений и запоминает
+        отпечаток синхронизированных данных.
+        9. Если курс изменился с прошлого пересчета, пересчитывает рубли
+        у всех заказов источника на стороне БД и все сводки источника.
+        После первой загрузки курс только запоминается.
+        10. Если хоть один заказ изменился, после фиксации транзакции
+        увеличивает версию данных о заказах.
+
+    При GS_READ_PAGE_SIZE > 0 таблица читается страницами, и шаги 4-7
+    выполняются для каждой страницы по мере ее получения. Проверка
+    отпечатка в этом режиме не выполняется, лишние записи отсекаются
+    сравнением дайджестов.
+
+    При GS_SYNC_PROCESSES != 1 шаги 4-5 для таблицы, прочитанной целиком,
+    выполняются в нескольких процессах (googlesheets.sync_partitions),
+    если в ней не меньше PARALLEL_MIN_ROWS строк, а удаление и запись -
+    по-прежнему одной транзакцией. Действует только при
+    GS_SYNC_ENGINE=python: при sql сравнение выполняет БД.
+
+    Время этапов, запросы к БД на них и количество прочитанных, записанных
+    и удаленных строк учитываются в метриках (googlesheets.metrics).
     """
 
-    class ColumnIndex(IntEnum):
-        """Индексы столбцов в Google-таблице"""
+    class SyncEngine(Enum):
+        """Способы сравнения данных таблицы с БД"""
+
+        # Множества заказов вычисляются в памяти процесса.
+        PYTHON = 'python'
+        # Множества заказов вычисляются в БД через промежуточную таблицу.
+        SQL = 'sql'
 
-        NUMBER = 0
-        ORDER_NUMBER = auto()
-        DOLLARS = auto()
-        DELIVERY_TIME = auto()
+    # Минимальное количество строк таблицы, которые разбираются и
+    # сравниваются в нескольких процессах. Для меньших таблиц создание
+    # процессов и передача результатов дороже самого сравнения.
+    PARALLEL_MIN_ROWS = 50000
 
-    def __init__(self, spreadsheet_id: str, range_name: str) -> None:
+    def __init__(self, source: SheetSource, service=None) -> None:
         """
         Инициализатор класса.
 
-        :param spreadsheet_id: id таблицы в Google Sheets.
-        :param range_name:
-            Диапазон ячеек, из которых необходимо считывать значения.
+        :param source:
+            Источник данных - таблица и диапазон ячеек, из которых
+            необходимо считывать значения.
+        :param service:
+            Объект подключения к Google Sheets API. По умолчанию
+            используется подключение, общее для процесса воркера.
         """
 
-        # Шаблон URL для получения валют. Для запроса необходимо подставить
-        # через .format() дату формата dd/mm/yy.
-        self.__cbr_currencies_url: str = config('CBR_CURRENCIES_URL')
+        # Поставщик курсов валют ЦБ с дневным кэшем.
+        self.__rate_provider = CbrRateProvider()
+        # Количество заказов, у которых рубли пересчитываются одним запросом.
+        self.__reprice_batch_size: int = config(
+            'ORDER_REPRICE_BATCH_SIZE',
+            default=10000,
+            cast=int,
+        )
+        # Способ сравнения данных таблицы с БД.
+        self.__sync_engine = self.SyncEngine(
+            config('GS_SYNC_ENGINE', default=self.SyncEngine.PYTHON.value))
+        # Количество строк в странице при постраничном чтении таблицы и
+        # количество страниц в одном запросе. 0 - таблица читается целиком.
+        self.__read_page_size: int = config(
+            'GS_READ_PAGE_SIZE',
+            default=0,
+            cast=int,
+        )
+        self.__read_pages_per_request: int = config(
+            'GS_READ_PAGES_PER_REQUEST',
+            default=1,
+            cast=int,
+        )
+        # Количество процессов разбора и сравнения большой таблицы.
+        # 1 - в процессе воркера, 0 - по количеству доступных ядер.
+        self.__sync_processes = get_processes_count(config(
+            'GS_SYNC_PROCESSES',
+            default=1,
+            cast=int,
+        ))
 
         # Настройка параметров для работы с Google Cloud.
         self.__gs_scopes: str = config('GS_SCOPES')
-        self.__gs_spreadsheet_id = spreadsheet_id
-        self.__gs_range_name = range_name
-
-        # Автоматически настраиваем все объекты http. Без этого аутентификация
-        # в Google Cloud из Celery-воркера не работает.
-        httplib2shim.patch()
+        self.__source = source
 
         # Получаем объект сервисного аккаунта для работы с API.
-        self.__service = self._create_service_account()
+        self.__service = service if service is not None \
+            else get_sheets_service(self.__gs_scopes)
 
     def run(self) -> None:
         """Запуск обработчика таблицы"""
 
+        with span('sync', 'total', source_id=self.__source.pk) as fields:
+            # Получим курс доллара за сегодняшний день.
+            with span('sync', 'cbr_rate'):
+                dollars_to_rubles = self._get_dollars_to_rubs()
+
+            # При первой загрузке все заказы записываются по текущему курсу.
+            initial_load = self.__source.rubles_rate is None \
+                and not Order.objects.filter(source=self.__source).exists()
+
+            # Большие таблицы читаем и синхронизируем постранично.
+            if self.__read_page_size > 0:
+                changed = self._sync_pages(self.__source, dollars_to_rubles)
+            else:
+                changed = self._sync_range(self.__source, dollars_to_rubles)
+
+            # Пересчитаем рубли у всех заказов источника, если курс изменился.
+            changed += self._reprice_orders(self.__source, dollars_to_rubles, initial_load)
+
+            # Сообщим о новой версии данных, только если заказы изменились.
+            if changed:
+                bump_sync_version()
+
+            fields['changed'] = changed
+
+    def _sync_range(self, source: SheetSource, dollars_to_rubles: Decimal) -> int:
+        """
+        Синхронизация заказов с диапазоном таблицы, прочитанным целиком.
+
+        :param source: Источник данных.
+        :param dollars_to_rubles: Курс доллара к рублю.
+        :return: Количество удаленных и записанных заказов.
+        """
+
         # Делаем запрос к указанной таблице на указанный диапазон.
-        result: Dict[str, Any] = self.__service.spreadsheets().values().get(
-            spreadsheetId=self.__gs_spreadsheet_id,
-            range=self.__gs_range_name,
-        ).execute()
+        with span('sync', 'sheets_fetch'):
+            result: Dict[str, Any] = self.__service.spreadsheets().values().get(
+                spreadsheetId=source.spreadsheet_id,
+                range=source.range_name,
+            ).execute()
 
         # Получаем данные из таблицы.
         data: Optional[List[List[str]]] = result.get('values', None)
         if data is None:
-            return
+            return 0
 
         # Удаляем заголовки из данных. Они не нужны.
         data.pop(0)
+        count_rows('fetched', len(data))
+
+        # Сравним отпечаток данных с отпечатком прошлой синхронизации.
+        # Если таблица не менялась, разбор данных, сравнение с БД
+        # и транзакция не нужны.
+        with span('sync', 'fingerprint'):
+            fingerprint = self._get_fingerprint(data)
+        if source.fingerprint == fingerprint:
+            return 0
+
+        writer = get_bulk_writer(source.pk)
+        if self.__sync_engine == self.SyncEngine.SQL:
+            # Разберем строки таблицы. Строки с ошибками отложим в карантин.
+            with span('sync', 'parse'):
+                order_rows, errors = RowParser(dollars_to_rubles).parse(data)
+
+            # Все делаем в рамках одной транзакции.
+            with transaction.atomic():
+                with span('sync', 'stage'):
+                    writer.stage(order_rows)
+                    writer.keep(get_error_order_numbers(errors))
+                deleted, upserted = self._apply_stage(writer)
+                if deleted + upserted:
+                    self._commit_changes(source, writer)
+
+                # Запоминаем строки с ошибками и отпечаток данных.
+                self._save_quarantine(source, errors)
+                self._save_fingerprint(source, fingerprint)
+
+            return deleted + upserted
+
+        # Получим дайджесты заказов источника из БД.
+        with span('sync', 'load_digests'):
+            db_digests: Dict[int, str] = dict(
+                Order.objects
+                .order_by()
+                .filter(source=source)
+                .values_list('order_number', 'digest')
+            )
 
-        # Создадим словарь, где ключ - номер заказа, значение - данные.
-        # Для удобства получения данных из таблицы по номеру заказа.
-        data_dict = self._create_orders_dict(data)
+        if self.__sync_processes > 1 and len(data) >= self.PARALLEL_MIN_ROWS:
+            # Большую таблицу разберем и сравним в нескольких процессах.
+            with span('sync', 'partitioned_diff', processes=self.__sync_processes):
+                changed_rows, inserted, order_numbers, errors = \
+                    PartitionedDiff(self.__sync_processes).run(data, db_digests, dollars_to_rubles)
+        else:
+            # Разберем строки таблицы. Строки с ошибками отложим в карантин.
+            with span('sync', 'parse'):
+                order_rows, errors = RowParser(dollars_to_rubles).parse(data)
+
+            # Создадим словарь, где ключ - номер заказа, значение - строка
+            # заказа. При повторе номера в таблице остается последняя строка.
+            data_dict = {row.order_number: row for row in order_rows}
+            with span('sync', 'diff'):
+                changed_rows, inserted = diff_orders(data_dict, db_digests)
+            order_numbers = data_dict.keys()
 
-        # Создадим множества номеров заказов из БД и из таблицы.
-        all_order_numbers = set(Order.objects.values_list('order_number', flat=True))
-        google_order_numbers = set(data_dict.keys())
+        # Все делаем в рамках одной транзакции.
+        with transaction.atomic():
+            # Сначала удалим заказы, которых нет в Google таблице. Заказы
+            # строк с ошибками остаются, пока строки не исправят.
+            with span('sync', 'delete'):
+                deleted = writer.delete(
+                    db_digests.keys() - order_numbers - get_error_order_numbers(errors)
+                )
+            count_rows('deleted', deleted)
+
+            # Добавляем новые и обновляем измененные заказы.
+            upserted = self._upsert_orders(writer, changed_rows, inserted)
+            if deleted + upserted:
+                self._commit_changes(source, writer)
+
+            # Запоминаем строки с ошибками и отпечаток данных.
+            self._save_quarantine(source, errors)
+            self._save_fingerprint(source, fingerprint)
+
+        return deleted + upserted
+
+    def _sync_pages(self, source: SheetSource, dollars_to_rubles: Decimal) -> int:
+        """
+        Постраничная синхронизация заказов с диапазоном таблицы.
 
-        # Получим множества номеров заказов для удаления, обновления и создания.
-        deleting_order_numbers = all_order_numbers.difference(google_order_numbers)
-        updating_order_numbers = all_order_numbers.intersection(google_order_numbers)
-        new_order_numbers = google_order_numbers.difference(all_order_numbers)
+        Страницы обрабатываются и записываются в БД по мере получения,
+        поэтому в памяти одновременно находится только одна страница.
+        При GS_SYNC_ENGINE=python в памяти дополнительно копится множество
+        номеров прочитанных заказов, нужное для удаления отсутствующих.
 
-        # Получим курс доллара за сегодняшний день.
-        dollars_to_rubles = self._get_dollars_to_rubs()
+        :param source: Источник данных.
+        :param dollars_to_rubles: Курс доллара к рублю.
+        :return: Количество удаленных и записанных заказов.
+        """
+
+        reader = SheetReader(
+            self.__service,
+            source.spreadsheet_id,
+            source.range_name,
+            self.__read_page_size,
+            self.__read_pages_per_request,
+        )
+        pages = iter_span('sync', 'sheets_fetch', reader.iter_pages())
+
+        # Получаем первую страницу. Если таблица пуста, ничего не делаем.
+        first_page = next(pages, None)
+        if first_page is None:
+            return 0
+
+        # Удаляем заголовки из данных. Они не нужны. Порядковые номера
+        # строк данных отсчитываются от строки заголовков, как при чтении
+        # диапазона целиком.
+        first_page.rows.pop(0)
+        header_row_number = first_page.row_numbers.pop(0)
+
+        writer = get_bulk_writer(source.pk)
+        fingerprint = hashlib.sha256()
+        # Один разборщик на все страницы, чтобы даты разбирались один раз.
+        parser = RowParser(dollars_to_rubles)
+        errors: List[RowError] = []
+        synced_order_numbers: Set[int] = set()
+        changed = 0
 
         # Все делаем в рамках одной транзакции.
         with transaction.atomic():
-            # Сначала удалим заказы, которых нет в Google таблице.
-            Order.objects.filter(order_number__in=deleting_order_numbers).delete()
-
-            # Обновление заказов, которые нужно обновить.
-            self._update_orders(
-                data_dict,
-                updating_order_numbers,
-                dollars_to_rubles,
-            )
+            if self.__sync_engine == self.SyncEngine.SQL:
+                writer.create_stage()
+
+            for page, row_numbers in chain((first_page, ), pages):
+                count_rows('fetched', len(page))
+                with span('sync', 'fingerprint'):
+                    fingerprint.update(self._get_fingerprint(page).encode())
+
+                with span('sync', 'parse'):
+                    page_rows, page_errors = parser.parse(page)
+                # Пустые строки на странице пропущены, поэтому номера строк
+                # с ошибками берутся по их номерам на листе.
+                errors.extend(
+                    error._replace(position=row_numbers[error.position - 1] - header_row_number)
+                    for error in page_errors
+                )
+
+                if self.__sync_engine == self.SyncEngine.SQL:
+                    with span('sync', 'stage'):
+                        writer.load_stage(page_rows)
+                    continue
+
+                # Сравниваем страницу только с заказами из этой страницы.
+                page_dict = {row.order_number: row for row in page_rows}
+                with span('sync', 'load_digests'):
+                    db_digests: Dict[int, str] = dict(
+                        Order.objects
+                        .order_by()
+                        .filter(source=source, order_number__in=page_dict.keys())
+                        .values_list('order_number', 'digest')
+                    )
+                with span('sync', 'diff'):
+                    changed_rows, inserted = diff_orders(page_dict, db_digests)
+                changed += self._upsert_orders(writer, changed_rows, inserted)
+                synced_order_numbers.update(page_dict.keys())
+
+            # Удалим заказы, которых нет в Google таблице. Заказы строк
+            # с ошибками остаются, пока строки не исправят.
+            if self.__sync_engine == self.SyncEngine.SQL:
+                writer.keep(get_error_order_numbers(errors))
+                changed += sum(self._apply_stage(writer))
+            else:
+                synced_order_numbers.update(get_error_order_numbers(errors))
+                with span('sync', 'delete'):
+                    deleted = writer.delete([
+                        order_number
+                        for order_number in Order.objects
+                        .order_by()
+                        .filter(source=source)
+                        .values_list('order_number', flat=True)
+                        .iterator()
+                        if order_number not in synced_order_numbers
+                    ])
+                count_rows('deleted', deleted)
+                changed += deleted
+
+            if changed:
+                self._commit_changes(source, writer)
+
+            # Запоминаем строки с ошибками и отпечаток данных.
+            self._save_quarantine(source, errors)
+            self._save_fingerprint(source, fingerprint.hexdigest())
+
+        return changed
+
+    @staticmethod
+    def _upsert_orders(
+            writer: OrderBulkWriter,
+            changed_rows: List[OrderRow],
+            inserted: int,
+    ) -> int:
+        """
+        Запись новых заказов и заказов, у которых изменился дайджест.
 
-            # Создаем новые заказы.
-            self._create_orders(
-                data_dict,
-                new_order_numbers,
-                dollars_to_rubles,
-            )
+        :param writer: Объект записи заказов в БД.
+        :param changed_rows: Измененные строки заказов из Google-таблицы.
+        :param inserted: Количество новых заказов среди измененных.
+        :return: Количество записанных заказов.
+        """
 
-    def _update_orders(
-            self,
-            data_dict: Dict[int, List[str]],
-            updating_order_numbers: Set[int],
-            dollars_to_rubles: Decimal,
-    ) -> None:
+        with span('sync', 'upsert'):
+            upserted = writer.upsert(changed_rows)
+
+        # Повторы номера в таблице записываются одной строкой, поэтому
+        # записанных строк может быть меньше, чем измененных.
+        count_rows('inserted', min(inserted, upserted))
+        count_rows('updated', max(upserted - inserted, 0))
+
+        return upserted
+
+    @staticmethod
+    def _apply_stage(writer: OrderBulkWriter) -> Tuple[int, int]:
+        """
+        Применение промежуточной таблицы к таблице заказов.
+
+        :param writer: Объект записи заказов в БД.
+        :return: Количество удаленных и количество записанных заказов.
         """
-        Обновление заказов.
 
-        Обновляет только те заказы, у которых изменились данные.
+        with span('sync', 'apply_stage'):
+            deleted, upserted = writer.apply_stage()
 
-        :param data_dict: Словарь с данными из Google-таблицы.
-        :param updating_order_numbers:
-            Множество id заказов, которые, возможно, нужно обновить.
-        :param dollars_to_rubles: Курс доллара к рублю.
+        # Промежуточная таблица не различает добавленные и обновленные заказы.
+        count_rows('deleted', deleted)
+        count_rows('upserted', upserted)
+
+        return deleted, upserted
+
+    @staticmethod
+    def _commit_changes(source: SheetSource, writer: OrderBulkWriter) -> None:
         """
+        Пересчет сводок по дням и назначение ревизии записанным изменениям.
 
-        updating_orders = Order.objects \
-            .filter(order_number__in=updating_order_numbers)
-
-        for order in updating_orders:
-            # Получим табличные значения.
-            table_number = int(
-                data_dict[order.order_number][self.ColumnIndex.NUMBER])
-            table_dollars = Decimal(
-                data_dict[order.order_number][self.ColumnIndex.DOLLARS])
-            table_date = datetime.strptime(
-                data_dict[order.order_number]
-                [self.ColumnIndex.DELIVERY_TIME],
-                '%d.%m.%Y',
-            ).date()
-
-            # Обновляем данные, если нужно.
-            if order.number != table_number:
-                order.number = table_number
-
-            if order.dollars != table_dollars \
-                    or order.delivery_time != table_date:
-                # Обновим все значения.
-                order.dollars = table_dollars
-                order.delivery_time = table_date
-
-            # В любом случае для каждой старой записи обновляем рубли,
-            # т.к. курс на сегодня мог измениться.
-            order.rubles = table_dollars * dollars_to_rubles
-
-        # Обновляем заказы.
-        Order.objects.bulk_update(
-            updating_orders,
-            ['number', 'dollars', 'delivery_time', 'rubles'],
-        )
+        :param source: Источник данных.
+        :param writer: Объект записи заказов в БД, записавший изменения.
+        """
 
-    def _create_orders(
-            self,
-            data_dict: Dict[int, List[str]],
-            new_order_numbers: Set[int],
-            dollars_to_rubles: Decimal,
-    ) -> None:
+        with span('sync', 'day_summaries'):
+            refresh_day_summaries(source.pk, writer.vacated_days)
+        with span('sync', 'revision'):
+            commit_revision(source.pk)
+
+    @staticmethod
+    def _save_quarantine(source: SheetSource, errors: List[RowError]) -> None:
         """
-        Добавление новых заказов.
+        Замена строк источника с ошибками.
 
-        :param data_dict: Словарь с данными из Google-таблицы.
-        :param new_order_numbers: Множество id новых заказов.
-        :param dollars_to_rubles: Курс доллара к рублю.
+        :param source: Источник данных.
+        :param errors: Строки таблицы, которые не удалось разобрать.
         """
 
-        # Создаем новые объекты заказов из таблицы.
-        new_orders: List[Order] = []
-
-        for new_order_number in new_order_numbers:
-            # Получим табличные значения.
-            table_number = int(
-                data_dict[new_order_number][self.ColumnIndex.NUMBER])
-            table_order_number = int(
-                data_dict[new_order_number][self.ColumnIndex.ORDER_NUMBER])
-            table_dollars = Decimal(
-                data_dict[new_order_number][self.ColumnIndex.DOLLARS])
-            table_date = datetime.strptime(
-                data_dict[new_order_number][self.ColumnIndex.DELIVERY_TIME],
-                '%d.%m.%Y',
-            ).date()
-            new_rubles = table_dollars * dollars_to_rubles
-
-            # Создаем новый заказ и добавляем в список.
-            new_order = Order(
-                number=table_number,
-                order_number=table_order_number,
-                dollars=table_dollars,
-                delivery_time=table_date,
-                rubles=new_rubles,
+        with span('sync', 'quarantine', errors=len(errors)):
+            QuarantinedRow.objects.filter(source=source).delete()
+            QuarantinedRow.objects.bulk_create(
+                (
+                    QuarantinedRow(
+                        source=source,
+                        position=error.position,
+                        values=error.values,
+                        reason=error.reason[:255],
+                    )
+                    for error in errors
+                ),
+                batch_size=1000,
+            )
+        count_rows('quarantined', len(errors))
+
+        if errors:
+            logger.warning(
+                'Источник %s: %s строк таблицы не разобрано, первая - строка %s: %s',
+                source.pk,
+                len(errors),
+                errors[0].position,
+                errors[0].reason,
             )
-            new_orders.append(new_order)
 
-        # Добавляем новые заказы.
-        Order.objects.bulk_create(new_orders)
+    @staticmethod
+    def _save_fingerprint(source: SheetSource, fingerprint: str) -> None:
+        """
+        Сохранение отпечатка синхронизированных данных.
 
-    def _create_service_account(self):
+        :param source: Источник данных.
+        :param fingerprint: Отпечаток данных из таблицы.
         """
-        Получение сервисного аккаунта в качестве ресурса.
 
-        Необходим для работы с Google Cloud от лица сервисного аккаунта.
+        source.fingerprint = fingerprint
+        source.synced_at = timezone.now()
+        source.save(update_fields=('fingerprint', 'synced_at'))
+
+    def _reprice_orders(
+            self,
+            source: SheetSource,
+            dollars_to_rubles: Decimal,
+            initial_load: bool = False,
+    ) -> int:
+        """
+        Пересчет стоимости всех заказов источника в рублях.
+
+        Выполняется только если курс отличается от курса, по которому
+        рубли были посчитаны в прошлый раз. После первой загрузки курс
+        только запоминается: заказы уже посчитаны по нему. После пересчета
+        клиентам ленты изменений нужна полная перезагрузка, а сводки
+        источника по дням пересчитываются целиком.
+
+        :param source: Источник данных.
+        :param dollars_to_rubles: Курс доллара к рублю.
+        :param initial_load: Признак первой загрузки заказов источника.
+        :return: Количество пересчитанных заказов.
         """
 
-        # Путь до файла с учетными данными сервисного аккаунта в json-формате.
-        creds_json = settings.CREDS_DIR / settings.FILENAME_SERVICE_ACCOUNT_CREDS
-        # Список необходимых разрешений на работу с каким-либо API.
-        # В нашем случае - с Google Sheets.
-        scopes = (self.__gs_scopes, )
+        if source.rubles_rate == dollars_to_rubles:
+            return 0
+
+        repriced = 0
+        if not initial_load:
+            repriced = self._update_rubles(source, dollars_to_rubles)
 
-        # Создание учетных данных сервисного аккаунта.
-        creds_service = ServiceAccountCredentials \
-            .from_json_keyfile_name(creds_json, scopes) \
-            .authorize(httplib2.Http())
+        if repriced:
+            with span('sync', 'day_summaries'):
+                rebuild_day_summaries(source.pk)
+            with span('sync', 'revision'):
+                reset_revision()
 
-        # Создание объекта подключения к облаку на основе учетных данных
-        # сервисного аккаунта.
-        service = build(serviceName='sheets', version='v4', http=creds_service)
+        # Запоминаем курс, по которому посчитаны рубли.
+        source.rubles_rate = dollars_to_rubles
+        source.save(update_fields=('rubles_rate', ))
 
-        return service
+        return repriced
 
-    def _create_orders_dict(self, data: List[List[str]]) -> Dict[int, List[str]]:
+    def _update_rubles(self, source: SheetSource, dollars_to_rubles: Decimal) -> int:
         """
-        Создание словаря с заказами.
+        Пересчет рублей у всех заказов источника.
+
+        Рубли пересчитываются на стороне БД пачками по
+        ORDER_REPRICE_BATCH_SIZE заказов, чтобы не блокировать всю таблицу.
+        Границы пачек берутся из id существующих заказов источника, поэтому
+        пропуски в id после удалений и заказы других источников не дают
+        запросов, которые ничего не обновляют.
 
-        Ключ - номер заказа, значение - данные о заказе.
-        Необходим для быстрого получения данных из таблицы по номеру заказа.
+        :param source: Источник данных.
+        :param dollars_to_rubles: Курс доллара к рублю.
+        :return: Количество пересчитанных заказов.
+        """
+
+        orders = Order.objects.filter(source=source)
+        batch_size = self.__reprice_batch_size
+        repriced = 0
+        with span('sync', 'reprice'):
+            batch = orders
+            while True:
+                # id первого заказа следующей пачки.
+                next_pk = next(iter(
+                    batch
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[batch_size:batch_size + 1]
+                ), None)
+                if next_pk is None:
+                    repriced += batch.update(rubles=F('dollars') * dollars_to_rubles)
+                    break
+
+                repriced += batch \
+                    .filter(pk__lt=next_pk) \
+                    .update(rubles=F('dollars') * dollars_to_rubles)
+                batch = orders.filter(pk__gte=next_pk)
+        count_rows('repriced', repriced)
+
+        return repriced
+
+    @staticmethod
+    def _get_fingerprint(data: List[List[str]]) -> str:
+        """
+        Вычисление отпечатка данных из таблицы.
 
         :param data: Исходные данные.
-        :return: Словарь с данными о заказах.
+        :return: Хэш SHA-256 данных в виде hex-строки.
         """
 
-        keys = [int(row[self.ColumnIndex.ORDER_NUMBER]) for row in data]
-        result = dict(zip(keys, data))
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
 
-        return result
+        return hashlib.sha256(payload.encode()).hexdigest()
 
     def _get_dollars_to_rubs(self) -> Decimal:
         """
@@ -271,18 +617,4 @@ class OrderObserver:
         :return: Объект Decimal с точным значением курса доллара к рублю.
         """
 
-        # Переводим сегодняшнюю дату и переводим в нужный формат.
-        date_for_request = datetime.now().date().strftime('%d/%m/%Y')
-        # Делаем запрос к API ЦБ.
-        response = requests.get(self.__cbr_currencies_url.format(date_for_request))
-
-        # Получаем тело xml-документ.
-        xml_content = response.content
-        # Строим DOM-дерево и парсим значение доллара.
-        root = BeautifulSoup(xml_content, 'xml')
-        dollars_to_rubs = Decimal(
-            root.find('Valute', attrs={'ID': 'R01235'})
-                .find('Value').text.replace(',', '.')
-        )
-
-        return dollars_to_rubs
+        return self.__rate_provider.get_rate('USD')
@@ -0,0 +1,172 @@
+from datetime import date
+from itertools import islice
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DateField,
+    F,
+    Max,
+    Q,
+    QuerySet,
+    Sum,
+)
+from django.db.models.functions import Trunc
+
+from .models import (
+    Order,
+    OrderDaySummary,
+)
+
+
+# Максимальное количество дней в одном запросе пересчета.
+DAYS_BATCH_SIZE = 500
+# Периоды, по которым группируются итоги.
+BUCKETS = ('day', 'week', 'month')
+
+
+def refresh_day_summaries(source_id: int, days: Iterable[date] = ()) -> int:
+    """
+    Пересчет сводок источника данных за дни, в которые изменились заказы.
+
+    Пересчитываются переданные дни (дни удаленных заказов и прежние дни
+    заказов, у которых изменился срок поставки) и дни заказов, записанных
+    в текущей транзакции: у них еще нет ревизии. Поэтому должно вызываться
+    в транзакции изменений до commit_revision().
+
+    :param source_id: id источника данных.
+    :param days: Дни, из которых ушли заказы.
+    :return: Количество пересчитанных дней.
+    """
+
+    days = set(days)
+    days.update(
+        Order.objects
+        .order_by()
+        .filter(source_id=source_id, revision__isnull=True)
+        .values_list('delivery_time', flat=True)
+        .distinct()
+    )
+
+    days_iterator = iter(sorted(days))
+    while batch := list(islice(days_iterator, DAYS_BATCH_SIZE)):
+        _rebuild(source_id, batch)
+
+    return len(days)
+
+
+def rebuild_day_summaries(source_id: int) -> None:
+    """
+    Пересчет всех сводок источника данных.
+
+    Используется, когда изменились все заказы источника, например, при
+    пересчете рублей.
+
+    :param source_id: id источника данных.
+    """
+
+    with transaction.atomic():
+        _rebuild(source_id)
+
+
+def get_summary(summaries: QuerySet, today: date) -> Dict[str, Any]:
+    """
+    Получение итогов по сводкам за дни.
+
+    :param summaries: QuerySet сводок по дням.
+    :param today: Текущая дата. Заказы с более ранним сроком поставки
+        считаются просроченными.
+    :return: Количество заказов, количество просроченных заказов, суммы
+        в долларах и рублях и максимальная стоимость заказа в долларах.
+    """
+
+    # Имена итогов не должны совпадать с именами полей сводки.
+    totals = summaries.order_by().aggregate(
+        orders_count=Sum('count'),
+        overdue_count=Sum('count', filter=Q(delivery_time__lt=today)),
+        dollars=Sum('total_dollars'),
+        rubles=Sum('total_rubles'),
+        max_order_dollars=Max('max_dollars'),
+    )
+
+    return {
+        'count': totals['orders_count'] or 0,
+        'overdue_count': totals['overdue_count'] or 0,
+        'total_dollars': totals['dollars'],
+        'total_rubles': totals['rubles'],
+        'max_dollars': totals['max_order_dollars'],
+    }
+
+
+def get_bucket_totals(summaries: QuerySet, bucket: str = 'day') -> List[Dict[str, Any]]:
+    """
+    Получение итогов по периодам сроков поставки по всем источникам данных.
+
+    :param summaries: QuerySet сводок по дням.
+    :param bucket: Период: день, неделя или месяц (BUCKETS).
+    :return: Итоги по периодам в порядке сроков поставки. Срок поставки
+        итога - первый день периода.
+    """
+
+    if bucket == 'day':
+        bucket_start = F('delivery_time')
+    else:
+        bucket_start = Trunc('delivery_time', bucket, output_field=DateField())
+
+    return [
+        {
+            'delivery_time': row['bucket_start'],
+            'count': row['bucket_count'],
+            'total_dollars': row['bucket_dollars'],
+            'total_rubles': row['bucket_rubles'],
+            'max_dollars': row['bucket_max_dollars'],
+        }
+        for row in summaries
+        .order_by()
+        .annotate(bucket_start=bucket_start)
+        .values('bucket_start')
+        .annotate(
+            bucket_count=Sum('count'),
+            bucket_dollars=Sum('total_dollars'),
+            bucket_rubles=Sum('total_rubles'),
+            bucket_max_dollars=Max('max_dollars'),
+        )
+        .order_by('bucket_start')
+    ]
+
+
+def _rebuild(source_id: int, days: Optional[Iterable[date]] = None) -> None:
+    """
+    Пересчет сводок источника данных за указанные дни по таблице заказов.
+
+    :param source_id: id источника данных.
+    :param days: Дни или None, чтобы пересчитать все дни.
+    """
+
+    orders = Order.objects.order_by().filter(source_id=source_id)
+    summaries = OrderDaySummary.objects.filter(source_id=source_id)
+    if days is not None:
+        orders = orders.filter(delivery_time__in=days)
+        summaries = summaries.filter(delivery_time__in=days)
+
+    summaries.delete()
+    OrderDaySummary.objects.bulk_create(
+        (
+            OrderDaySummary(source_id=source_id, **row)
+            for row in orders
+            .values('delivery_time')
+            .annotate(
+                count=Count('id'),
+                total_dollars=Sum('dollars'),
+                total_rubles=Sum('rubles'),
+                max_dollars=Max('dollars'),
+            )
+        ),
+        batch_size=DAYS_BATCH_SIZE,
+    )
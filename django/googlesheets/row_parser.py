@@ -0,0 +1,267 @@
+import hashlib
+from enum import (
+    IntEnum,
+    auto,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Sequence,
+    Set,
+    Tuple,
+)
+from decimal import Decimal
+from datetime import (
+    date,
+    datetime,
+)
+
+from .bulk_writer import OrderRow
+
+
+class ColumnIndex(IntEnum):
+    """Индексы столбцов в Google-таблице"""
+
+    NUMBER = 0
+    ORDER_NUMBER = auto()
+    DOLLARS = auto()
+    DELIVERY_TIME = auto()
+
+
+# Количество столбцов, из которых строится заказ.
+ROW_WIDTH = len(ColumnIndex)
+
+
+class RowError(NamedTuple):
+    """Строка таблицы, которую не удалось разобрать"""
+
+    # Порядковый номер строки данных, начиная с 1.
+    position: int
+    values: List[str]
+    reason: str
+
+
+# Максимальное значение PositiveIntegerField.
+MAX_UNSIGNED = 2147483647
+# Граница стоимости в долларах и рублях:
+# DecimalField(max_digits=18, decimal_places=5).
+MAX_AMOUNT = Decimal(10) ** 13
+
+
+def parse_unsigned(cell: str) -> int:
+    """
+    Разбор неотрицательного целого числа.
+
+    :param cell: Значение ячейки.
+    :return: Число.
+    """
+
+    value = int(cell)
+    if not 0 <= value <= MAX_UNSIGNED:
+        raise ValueError('число вне допустимого диапазона')
+
+    return value
+
+
+class DateCache(Dict[str, date]):
+    """
+    Словарь разобранных дат формата dd.mm.yyyy.
+
+    Сроки поставки в таблице повторяются, поэтому каждая строка даты
+    разбирается strptime() один раз, а дальше берется из словаря.
+    """
+
+    def __missing__(self, cell: str) -> date:
+        value = datetime.strptime(cell, '%d.%m.%Y').date()
+        self[cell] = value
+
+        return value
+
+
+class RowParser:
+    """
+    Класс разбора строк Google-таблицы в строки заказов.
+
+    Страница разбирается по столбцам: каждый столбец целиком
+    преобразуется одной функцией через map(), и только если в столбце
+    есть ошибка, он разбирается по ячейкам, чтобы найти неверные значения.
+    Каждая строка даты разбирается один раз на все страницы, которые
+    разбирает объект. Строки с неверными значениями не прерывают
+    синхронизацию, а возвращаются отдельно с причиной ошибки.
+    """
+
+    def __init__(self, dollars_to_rubles: Decimal) -> None:
+        """
+        Инициализатор класса.
+
+        :param dollars_to_rubles: Курс доллара к рублю.
+        """
+
+        self.__dollars_to_rubles = dollars_to_rubles
+        # Граница стоимости в долларах, при которой и стоимость
+        # в рублях помещается в поле заказа.
+        self.__max_dollars = min(MAX_AMOUNT, MAX_AMOUNT / dollars_to_rubles)
+        self.__dates = DateCache()
+        # Столбцы: индекс, название для причины ошибки и функция разбора.
+        self.__columns: Tuple[Tuple[int, str, Callable[[str], Any]], ...] = (
+            (ColumnIndex.NUMBER, 'номер записи', parse_unsigned),
+            (ColumnIndex.ORDER_NUMBER, 'номер заказа', parse_unsigned),
+            (ColumnIndex.DOLLARS, 'стоимость', self._parse_dollars),
+            (ColumnIndex.DELIVERY_TIME, 'срок поставки', self.__dates.__getitem__),
+        )
+
+    def parse(
+            self,
+            rows: Sequence[List[str]],
+            start_position: int = 1,
+    ) -> Tuple[List[OrderRow], List[RowError]]:
+        """
+        Разбор строк таблицы.
+
+        :param rows: Строки таблицы без заголовков.
+        :param start_position: Порядковый номер первой строки.
+        :return: Строки заказов и строки с ошибками в порядке таблицы.
+        """
+
+        errors: List[RowError] = []
+
+        # Строки с незаполненными последними ячейками API возвращает
+        # короткими. Они не разбираются, чтобы столбцы не сдвинулись.
+        complete_rows = []
+        positions = []
+        for position, row in enumerate(rows, start_position):
+            if len(row) < ROW_WIDTH:
+                errors.append(RowError(position, row, 'заполнены не все столбцы'))
+            else:
+                complete_rows.append(row)
+                positions.append(position)
+
+        if not complete_rows:
+            return [], errors
+
+        columns = list(zip(*complete_rows))
+        cell_errors: Dict[int, str] = {}
+        numbers, order_numbers, dollars, delivery_times = (
+            self._parse_column(columns[index], name, parse_cell, cell_errors)
+            for index, name, parse_cell in self.__columns
+        )
+        rate = self.__dollars_to_rubles
+
+        # Строки заказов собираются из готовых столбцов без цикла по ячейкам.
+        order_rows = list(map(
+            OrderRow,
+            numbers,
+            order_numbers,
+            dollars,
+            delivery_times,
+            [value * rate if value is not None else None for value in dollars],
+            map(get_row_digest, complete_rows),
+        ))
+
+        if cell_errors:
+            if errors:
+                errors.extend(
+                    RowError(positions[i], complete_rows[i], reason)
+                    for i, reason in cell_errors.items()
+                )
+                errors.sort(key=lambda error: error.position)
+            else:
+                errors = [
+                    RowError(positions[i], complete_rows[i], cell_errors[i])
+                    for i in sorted(cell_errors)
+                ]
+            order_rows = [
+                row
+                for i, row in enumerate(order_rows)
+                if i not in cell_errors
+            ]
+
+        return order_rows, errors
+
+    def _parse_dollars(self, cell: str) -> Decimal:
+        """
+        Разбор стоимости в долларах.
+
+        :param cell: Значение ячейки.
+        :return: Стоимость.
+        """
+
+        value = Decimal(cell)
+        # Сравнение с NaN вызывает InvalidOperation.
+        if not 0 <= value < self.__max_dollars:
+            raise ValueError('стоимость вне допустимого диапазона')
+
+        return value
+
+    @staticmethod
+    def _parse_column(
+            column: Sequence[str],
+            name: str,
+            parse_cell: Callable[[str], Any],
+            cell_errors: Dict[int, str],
+    ) -> List[Any]:
+        """
+        Разбор одного столбца.
+
+        :param column: Значения столбца.
+        :param name: Название столбца.
+        :param parse_cell: Функция разбора значения.
+        :param cell_errors: Причины ошибок по индексам строк, куда
+            добавляются ошибки этого столбца. У строки сохраняется
+            первая ошибка.
+        :return: Разобранные значения. Вместо неверных значений - None.
+        """
+
+        try:
+            return list(map(parse_cell, column))
+        except (ValueError, ArithmeticError):
+            pass
+
+        values = []
+        for i, cell in enumerate(column):
+            try:
+                values.append(parse_cell(cell))
+            except (ValueError, ArithmeticError):
+                values.append(None)
+                cell_errors.setdefault(i, f'{name}: неверное значение {cell!r}')
+
+        return values
+
+
+def get_error_order_numbers(errors: Iterable[RowError]) -> Set[int]:
+    """
+    Получение номеров заказов из строк с ошибками.
+
+    Учитываются только строки, в которых верен сам номер заказа.
+
+    :param errors: Строки таблицы, которые не удалось разобрать.
+    :return: Номера заказов.
+    """
+
+    order_numbers = set()
+    for error in errors:
+        try:
+            order_numbers.add(parse_unsigned(error.values[ColumnIndex.ORDER_NUMBER]))
+        except (IndexError, TypeError, ValueError):
+            pass
+
+    return order_numbers
+
+
+def get_row_digest(row: List[str]) -> str:
+    """
+    Вычисление дайджеста строки таблицы.
+
+    Учитываются только ячейки, из которых строится заказ.
+
+    :param row: Строка Google-таблицы.
+    :return: Хэш BLAKE2b строки в виде hex-строки.
+    """
+
+    payload = '\x1f'.join(row[:ROW_WIDTH])
+
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
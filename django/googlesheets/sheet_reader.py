@@ -0,0 +1,146 @@
+import re
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+
+class SheetPage(NamedTuple):
+    """Страница строк Google-таблицы"""
+
+    # Непустые строки страницы.
+    rows: List[List[str]]
+    # Номера строк на листе, начиная с 1, для каждой строки страницы.
+    row_numbers: List[int]
+
+
+class SheetReader:
+    """
+    Класс постраничного чтения диапазона Google-таблицы.
+
+    Диапазон в A1-нотации разбивается на окна по page_size строк, которые
+    запрашиваются через values().batchGet по pages_per_request окон за
+    запрос. Количество строк листа берется из его метаданных, поэтому
+    чтение заканчивается на последней строке листа или диапазона.
+    """
+
+    # Диапазон в A1-нотации: [Лист!]A1:D или [Лист!]A:D.
+    RANGE_PATTERN = re.compile(
+        r'^(?:(?P<sheet>.+)!)?'
+        r'(?P<start_column>[A-Za-z]+)(?P<start_row>\d*)'
+        r'(?::(?P<end_column>[A-Za-z]+)(?P<end_row>\d*))?$'
+    )
+
+    def __init__(
+            self,
+            service,
+            spreadsheet_id: str,
+            range_name: str,
+            page_size: int,
+            pages_per_request: int = 1,
+    ) -> None:
+        """
+        Инициализатор класса.
+
+        :param service: Объект подключения к Google Sheets API.
+        :param spreadsheet_id: id таблицы в Google Sheets.
+        :param range_name: Диапазон ячеек в A1-нотации.
+        :param page_size: Количество строк в одном окне.
+        :param pages_per_request: Количество окон в одном запросе.
+        """
+
+        match = self.RANGE_PATTERN.match(range_name)
+        if match is None:
+            raise ValueError(f'Диапазон {range_name} не поддерживает постраничное чтение')
+
+        self.__service = service
+        self.__spreadsheet_id = spreadsheet_id
+        self.__page_size = page_size
+        self.__pages_per_request = pages_per_request
+
+        self.__sheet: Optional[str] = match['sheet']
+        self.__start_column: str = match['start_column']
+        self.__end_column: str = match['end_column'] or match['start_column']
+        self.__start_row = int(match['start_row'] or 1)
+        self.__end_row: Optional[int] = int(match['end_row']) \
+            if match['end_row'] else None
+
+    def iter_pages(self) -> Iterator[SheetPage]:
+        """
+        Постраничное чтение строк диапазона.
+
+        Пустые строки пропускаются, а у остальных сохраняются их номера
+        на листе, чтобы ошибки указывали на настоящие строки таблицы.
+
+        :return: Итератор по страницам строк таблицы.
+        """
+
+        last_row = self._get_row_count()
+        if self.__end_row is not None:
+            last_row = min(last_row, self.__end_row)
+
+        page_start = self.__start_row
+        while page_start <= last_row:
+            # Формируем окна для одного запроса.
+            ranges = []
+            window_starts = []
+            while page_start <= last_row and len(ranges) < self.__pages_per_request:
+                page_end = min(page_start + self.__page_size - 1, last_row)
+                ranges.append(self._get_window(page_start, page_end))
+                window_starts.append(page_start)
+                page_start = page_end + 1
+
+            result: Dict[str, Any] = self.__service.spreadsheets().values().batchGet(
+                spreadsheetId=self.__spreadsheet_id,
+                ranges=ranges,
+            ).execute()
+
+            # Окна возвращаются в порядке запроса. API не возвращает пустые
+            # строки в конце окна, а пустые строки внутри окна - возвращает.
+            for window_start, value_range in zip(window_starts, result.get('valueRanges', [])):
+                page = SheetPage([], [])
+                for row_number, row in enumerate(value_range.get('values', []), window_start):
+                    if row:
+                        page.rows.append(row)
+                        page.row_numbers.append(row_number)
+                if page.rows:
+                    yield page
+
+    def _get_row_count(self) -> int:
+        """
+        Получение количества строк листа из его метаданных.
+
+        :return: Количество строк листа.
+        """
+
+        params = {
+            'spreadsheetId': self.__spreadsheet_id,
+            'fields': 'sheets(properties(gridProperties(rowCount)))',
+        }
+        if self.__sheet is not None:
+            params['ranges'] = [self.__sheet]
+
+        result: Dict[str, Any] = self.__service.spreadsheets() \
+            .get(**params) \
+            .execute()
+
+        return result['sheets'][0]['properties']['gridProperties']['rowCount']
+
+    def _get_window(self, start_row: int, end_row: int) -> str:
+        """
+        Получение диапазона окна в A1-нотации.
+
+        :param start_row: Номер первой строки окна.
+        :param end_row: Номер последней строки окна.
+        :return: Диапазон окна.
+        """
+
+        window = f'{self.__start_column}{start_row}:{self.__end_column}{end_row}'
+        if self.__sheet is not None:
+            window = f'{self.__sheet}!{window}'
+
+        return window
@@ -0,0 +1,187 @@
+import uuid
+import threading
+from typing import Optional
+from django.core.cache import (
+    cache,
+    caches,
+)
+from django.core.cache.backends.redis import RedisCache
+from redis import Redis
+from redis.exceptions import LockError
+from redis.lock import Lock
+
+
+def get_redis_client() -> Optional[Redis]:
+    """
+    Получение клиента Redis общего кэша.
+
+    :return: Клиент или None, если кэш хранится не в Redis.
+    """
+
+    backend = caches['default']
+    if not isinstance(backend, RedisCache):
+        return None
+
+    return backend._cache.get_client(write=True)
+
+
+class LeaseLock:
+    """
+    Класс блокировки фоновой задачи между воркерами.
+
+    Блокировка хранится в общем кэше Django (Redis) и выдается в аренду
+    на lease секунд. Пока синхронизация идет, фоновый поток продлевает
+    аренду, поэтому долгая синхронизация не теряет блокировку, а
+    блокировка упавшего воркера освобождается сама по истечении аренды.
+    Продление и освобождение выполняются в Redis одним скриптом Lua
+    (redis.lock.Lock), который сверяет владельца блокировки: если аренда
+    истекла и блокировку получил другой воркер, его блокировка
+    не продлевается и не удаляется.
+
+    С кэшем не в Redis (только при DEBUG, см. CACHES в settings.py)
+    блокировка проверяется и изменяется двумя запросами к кэшу и
+    действует только внутри одного процесса.
+
+    Если блокировку получить не удалось, запуск помечается отложенным.
+    Владелец блокировки после ее освобождения может проверить метку
+    и запустить одну повторную задачу, сколько бы запусков ни пришлось
+    на время его работы.
+    """
+
+    def __init__(self, key: str, lease: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param key: Ключ блокировки в кэше.
+        :param lease: Время аренды блокировки в секундах.
+        """
+
+        self.__key = key
+        self.__pending_key = f'{self.__key}:pending'
+        self.__lease = lease
+        self.__token = uuid.uuid4().hex
+        self.__stop_heartbeat = threading.Event()
+        self.__heartbeat: Optional[threading.Thread] = None
+        redis = get_redis_client()
+        # Блокировку продлевает фоновый поток, поэтому ее владелец
+        # хранится не в локальных данных потока.
+        self.__redis_lock = Lock(
+            redis,
+            caches['default'].make_and_validate_key(key),
+            timeout=lease,
+            thread_local=False,
+        ) if redis is not None else None
+
+    def acquire(self) -> bool:
+        """
+        Получение блокировки.
+
+        Если блокировка занята, запуск помечается отложенным.
+
+        :return: True, если блокировка получена.
+        """
+
+        if self.__redis_lock is not None:
+            acquired = self.__redis_lock.acquire(blocking=False, token=self.__token)
+        else:
+            acquired = cache.add(self.__key, self.__token, timeout=self.__lease)
+        if not acquired:
+            self.mark_pending()
+            return False
+
+        self.__stop_heartbeat.clear()
+        self.__heartbeat = threading.Thread(
+            target=self._renew_lease,
+            name=f'{self.__key}:heartbeat',
+            daemon=True,
+        )
+        self.__heartbeat.start()
+
+        return True
+
+    def release(self) -> bool:
+        """
+        Освобождение блокировки.
+
+        :return: True, если во время работы был отложен запуск, и нужна
+            повторная синхронизация.
+        """
+
+        self.__stop_heartbeat.set()
+        if self.__heartbeat is not None:
+            self.__heartbeat.join()
+            self.__heartbeat = None
+
+        # Блокировку удаляем, только если она все еще наша.
+        if self.__redis_lock is not None:
+            try:
+                self.__redis_lock.release()
+            except LockError:
+                pass
+        elif cache.get(self.__key) == self.__token:
+            cache.delete(self.__key)
+
+        return cache.delete(self.__pending_key)
+
+    def is_locked(self) -> bool:
+        """
+        Проверка, идет ли сейчас синхронизация источника.
+
+        :return: True, если блокировка занята.
+        """
+
+        if self.__redis_lock is not None:
+            return self.__redis_lock.locked()
+
+        return cache.get(self.__key) is not None
+
+    def mark_pending(self) -> None:
+        """Пометка запуска отложенным до окончания текущей синхронизации"""
+
+        cache.set(self.__pending_key, True, timeout=self.__lease)
+
+    def _renew_lease(self) -> None:
+        """Периодическое продление аренды блокировки и метки отложенного запуска"""
+
+        while not self.__stop_heartbeat.wait(self.__lease / 3):
+            if not self._extend_lease():
+                # Аренда истекла, и блокировку получил другой воркер.
+                return
+            cache.touch(self.__pending_key, timeout=self.__lease)
+
+    def _extend_lease(self) -> bool:
+        """
+        Продление аренды блокировки, если она все еще наша.
+
+        :return: True, если аренда продлена.
+        """
+
+        if self.__redis_lock is not None:
+            try:
+                return self.__redis_lock.extend(self.__lease, replace_ttl=True)
+            except LockError:
+                return False
+
+        if cache.get(self.__key) != self.__token:
+            return False
+
+        return cache.touch(self.__key, timeout=self.__lease)
+
+
+class SourceSyncLock(LeaseLock):
+    """
+    Класс блокировки синхронизации источника данных.
+
+    Запуск, отложенный во время синхронизации, превращается в одну
+    повторную синхронизацию после ее окончания.
+    """
+
+    def __init__(self, source_id: int, lease: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param source_id: id источника данных.
+        :param lease: Время аренды блокировки в секундах.
+        """
+
+        super().__init__(f'sheet-source-sync:{source_id}', lease)
@@ -0,0 +1,222 @@
+import os
+from decimal import Decimal
+from itertools import chain
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Tuple,
+)
+from billiard import get_context
+
+from .bulk_writer import OrderRow
+from .row_parser import (
+    ColumnIndex,
+    RowError,
+    RowParser,
+)
+
+
+class PartitionResult(NamedTuple):
+    """Результат сравнения строк таблицы с заказами в БД"""
+
+    # Новые заказы и заказы, у которых изменился дайджест.
+    changed_rows: List[OrderRow]
+    # Количество новых заказов среди измененных.
+    inserted: int
+    # Номера заказов, которые есть в таблице.
+    order_numbers: List[int]
+    # Строки таблицы, которые не удалось разобрать.
+    errors: List[RowError]
+
+
+def diff_orders(
+        data_dict: Dict[int, OrderRow],
+        db_digests: Dict[int, str],
+) -> Tuple[List[OrderRow], int]:
+    """
+    Поиск новых заказов и заказов, у которых изменился дайджест.
+
+    :param data_dict: Словарь, где ключ - номер заказа, значение -
+        строка заказа из Google-таблицы.
+    :param db_digests:
+        Словарь, где ключ - номер заказа, значение - дайджест заказа в БД.
+    :return: Измененные строки заказов и количество новых среди них.
+    """
+
+    changed_rows = []
+    inserted = 0
+    for order_number, row in data_dict.items():
+        db_digest = db_digests.get(order_number)
+        if db_digest != row.digest:
+            changed_rows.append(row)
+            if db_digest is None:
+                inserted += 1
+
+    return changed_rows, inserted
+
+
+def get_processes_count(processes: int) -> int:
+    """
+    Получение количества процессов сравнения.
+
+    :param processes: Настройка GS_SYNC_PROCESSES. 0 - по количеству
+        ядер, доступных процессу.
+    :return: Количество процессов.
+    """
+
+    if processes > 0:
+        return processes
+
+    return len(os.sched_getaffinity(0))
+
+
+class PartitionedDiff:
+    """
+    Класс разбора и сравнения строк таблицы в нескольких процессах.
+
+    Строки делятся на части по остатку от деления номера заказа на
+    количество процессов, поэтому повторы номера попадают в одну часть
+    и сравниваются так же, как при разборе в одном процессе. Каждая часть
+    разбирается и сравнивается с дайджестами заказов в БД в отдельном
+    процессе, а результаты объединяются для записи одной транзакцией
+    в основном процессе.
+
+    Процессы создаются через fork, поэтому строки таблицы и дайджесты
+    передаются им без сериализации, а обратно по каналу передается
+    только результат части. Процессы не обращаются к БД и не пишут
+    метрики: соединения с БД и файлы метрик остаются за основным
+    процессом. Процессы создаются через billiard: процессы воркера
+    Celery - демоны, и multiprocessing из стандартной библиотеки
+    не дает им создавать дочерние процессы.
+    """
+
+    def __init__(self, processes: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param processes: Количество процессов.
+        """
+
+        self.__processes = processes
+
+    def run(
+            self,
+            data: List[List[str]],
+            db_digests: Dict[int, str],
+            dollars_to_rubles: Decimal,
+    ) -> PartitionResult:
+        """
+        Разбор строк таблицы и сравнение с заказами в БД.
+
+        :param data: Данные из таблицы без заголовков.
+        :param db_digests:
+            Словарь, где ключ - номер заказа, значение - дайджест заказа в БД.
+        :param dollars_to_rubles: Курс доллара к рублю.
+        :return: Объединенный результат всех частей.
+        """
+
+        context = get_context('fork')
+        workers = []
+        results = []
+        try:
+            for partition, positions in zip(*self._partition(data)):
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_diff_partition,
+                    args=(partition, positions, db_digests, dollars_to_rubles, sender),
+                    daemon=True,
+                )
+                process.start()
+                # Канал остается открытым на запись только в процессе части,
+                # чтобы при его падении чтение завершилось ошибкой.
+                sender.close()
+                workers.append((process, receiver))
+
+            for index, (process, receiver) in enumerate(workers):
+                try:
+                    results.append(receiver.recv())
+                except EOFError:
+                    process.join()
+                    raise RuntimeError(
+                        f'Процесс сравнения части {index} завершился '
+                        f'с кодом {process.exitcode}'
+                    ) from None
+        finally:
+            for process, receiver in workers:
+                receiver.close()
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+        errors = list(chain.from_iterable(result.errors for result in results))
+        errors.sort(key=lambda error: error.position)
+
+        return PartitionResult(
+            changed_rows=list(chain.from_iterable(result.changed_rows for result in results)),
+            inserted=sum(result.inserted for result in results),
+            order_numbers=list(chain.from_iterable(result.order_numbers for result in results)),
+            errors=errors,
+        )
+
+    def _partition(self, data: List[List[str]]) -> Tuple[List[List[List[str]]], List[List[int]]]:
+        """
+        Деление строк таблицы на части по номеру заказа.
+
+        Строки с неверным номером заказа попадают в первую часть,
+        где разборщик отложит их в карантин.
+
+        :param data: Данные из таблицы без заголовков.
+        :return: Строки каждой части и их порядковые номера в таблице.
+        """
+
+        partitions: List[List[List[str]]] = [[] for _ in range(self.__processes)]
+        positions: List[List[int]] = [[] for _ in range(self.__processes)]
+        for position, row in enumerate(data, 1):
+            try:
+                index = int(row[ColumnIndex.ORDER_NUMBER]) % self.__processes
+            except (IndexError, ValueError):
+                index = 0
+            partitions[index].append(row)
+            positions[index].append(position)
+
+        return partitions, positions
+
+
+def _diff_partition(
+        partition: List[List[str]],
+        positions: List[int],
+        db_digests: Dict[int, str],
+        dollars_to_rubles: Decimal,
+        sender,
+) -> None:
+    """
+    Разбор и сравнение одной части строк в дочернем процессе.
+
+    :param partition: Строки части.
+    :param positions: Порядковые номера строк части в таблице.
+    :param db_digests:
+        Словарь, где ключ - номер заказа, значение - дайджест заказа в БД.
+    :param dollars_to_rubles: Курс доллара к рублю.
+    :param sender: Канал, в который отправляется результат части.
+    """
+
+    order_rows, errors = RowParser(dollars_to_rubles).parse(partition)
+
+    # Вернем ошибкам порядковые номера строк в таблице.
+    errors = [
+        error._replace(position=positions[error.position - 1])
+        for error in errors
+    ]
+
+    # При повторе номера в таблице остается последняя строка.
+    data_dict = {row.order_number: row for row in order_rows}
+    changed_rows, inserted = diff_orders(data_dict, db_digests)
+
+    sender.send(PartitionResult(
+        changed_rows=changed_rows,
+        inserted=inserted,
+        order_numbers=list(data_dict),
+        errors=errors,
+    ))
+    sender.close()
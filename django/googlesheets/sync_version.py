@@ -0,0 +1,52 @@
+import time
+from django.core.cache import cache
+from django.db import transaction
+
+from channelservice.db_router import pin_primary
+
+
+# Ключ версии данных о заказах в общем кэше.
+SYNC_VERSION_KEY = 'orders-sync-version'
+
+
+def get_sync_version() -> int:
+    """
+    Получение текущей версии данных о заказах.
+
+    Версия меняется при каждом изменении заказов и хранится в общем кэше
+    (Redis), поэтому воркер Celery, изменивший заказы, и веб-сервер видят
+    одну и ту же версию. Если версии в кэше нет, например, после
+    перезапуска Redis, она начинается с текущего времени в миллисекундах,
+    чтобы не совпасть с уже выданными версиями.
+
+    :return: Версия данных.
+    """
+
+    version = cache.get(SYNC_VERSION_KEY)
+    if version is None:
+        cache.add(SYNC_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(SYNC_VERSION_KEY)
+
+    return version
+
+
+def bump_sync_version() -> None:
+    """
+    Увеличение версии данных о заказах после фиксации транзакции.
+
+    Вне транзакции версия увеличивается сразу.
+    """
+
+    transaction.on_commit(_incr_sync_version)
+
+
+def _incr_sync_version() -> None:
+    """Увеличение версии данных о заказах"""
+
+    # Новую версию читают из основной БД, пока реплика ее догоняет.
+    pin_primary()
+    try:
+        cache.incr(SYNC_VERSION_KEY)
+    except ValueError:
+        # Версии в кэше нет, новая версия будет создана при чтении.
+        pass
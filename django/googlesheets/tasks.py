@@ -1,29 +1,211 @@
-from datetime import datetime
-from celery import shared_task
+import logging
+from datetime import timedelta
+from celery import (
+    group,
+    shared_task,
+)
+from celery.signals import (
+    worker_process_init,
+    worker_process_shutdown,
+)
+from decouple import config
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
 
-from .models import Order
+from .models import (
+    Order,
+    SheetSource,
+)
 from .order_observer import OrderObserver
 from .notifier_expired_orders import NotifierExpiredOrders
+from .google_client import get_sheets_service
+from .sync_lock import (
+    LeaseLock,
+    SourceSyncLock,
+)
+from .change_log import compact_changes
+from .metrics import (
+    span,
+    mark_process_dead,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Ключ блокировки уведомления о просроченных заказах.
+NOTIFY_LOCK_KEY = 'notify-expired-orders'
+
+
+@worker_process_init.connect
+def init_google_client(**kwargs) -> None:
+    """
+    Подготовка подключения к Google Sheets API при запуске процесса воркера.
+
+    Подключение создается заранее, чтобы первая задача не тратила время на
+    чтение учетных данных и получение токена.
+    """
+
+    try:
+        get_sheets_service(config('GS_SCOPES'))
+    except Exception:
+        logger.exception('Не удалось подключиться к Google Sheets API')
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid: int, **kwargs) -> None:
+    """Отметка завершения процесса воркера для сбора метрик"""
+
+    mark_process_dead(pid)
+
+
+@shared_task
+def observe_orders() -> None:
+    """
+    Задание на мониторинг всех активных источников данных.
+
+    Для каждого источника ставится отдельное задание observe_order, поэтому
+    таблицы синхронизируются параллельно на всех свободных воркерах.
+    Источники, которые еще синхронизируются, в очередь не ставятся: их
+    повторная синхронизация будет запущена по окончании текущей.
+    """
+
+    source_ids = SheetSource.objects \
+        .filter(is_active=True) \
+        .order_by('pk') \
+        .values_list('pk', flat=True)
+
+    tasks = []
+    for source_id in source_ids:
+        lock = SourceSyncLock(source_id, settings.GS_SYNC_LOCK_LEASE)
+        if lock.is_locked():
+            lock.mark_pending()
+        else:
+            tasks.append(observe_order.s(source_id).set(
+                expires=settings.GS_OBSERVE_INTERVAL))
+
+    group(tasks).apply_async()
+
+
+@shared_task
+def observe_order(source_id: int) -> None:
+    """
+    Задание на мониторинг и обработку указанного источника данных.
+
+    Одновременно источник синхронизирует только одно задание. Задание,
+    запущенное во время синхронизации, не выполняется, а превращается в
+    одну повторную синхронизацию после окончания текущей.
+
+    :param source_id: id источника данных - диапазона ячеек Google Sheet.
+    """
+
+    lock = SourceSyncLock(source_id, settings.GS_SYNC_LOCK_LEASE)
+    if not lock.acquire():
+        return
+
+    try:
+        source = SheetSource.objects.filter(pk=source_id, is_active=True).first()
+        # Источник мог быть удален или отключен после постановки задания.
+        if source is not None:
+            # Синхронизируем данные в Google-таблице с данными в БД.
+            observer = OrderObserver(source)
+            observer.run()
+    finally:
+        rerun = lock.release()
+
+    if rerun:
+        observe_order.apply_async(
+            (source_id, ),
+            expires=settings.GS_OBSERVE_INTERVAL,
+        )
 
 
 @shared_task
-def observe_order(spreadsheet_id: str, range_name: str) -> None:
+def notify_expired_orders() -> None:
     """
-    Задание на мониторинг и обработку указанной Google Sheet.
+    Задание на уведомление о заказах, просроченных с прошлой проверки.
 
-    :param spreadsheet_id: id таблицы в Google Sheets.
-    :param range_name:
-        Диапазон ячеек, из которых необходимо считывать значения.
+    Каждый заказ попадает в уведомление один раз. Заново - только если у
+    него изменился срок поставки. Если отчет не получил ни один чат,
+    заказы попадут в уведомление при следующей проверке. Одновременно
+    уведомление отправляет только одно задание, иначе заказы попали бы
+    в отчет дважды.
     """
 
-    # Синхронизируем данные в Google-таблице с данными в БД.
-    observer = OrderObserver(spreadsheet_id, range_name)
-    observer.run()
+    lock = LeaseLock(NOTIFY_LOCK_KEY, settings.TELEGRAM_NOTIFY_INTERVAL)
+    if not lock.acquire():
+        return
+
+    try:
+        _notify_expired_orders()
+    finally:
+        # Отложенный запуск не повторяется: новые просроченные заказы
+        # подберет следующая проверка.
+        lock.release()
 
-    # Ищем все просроченные заказы и уведомляем об этом в Telegram.
-    expired_orders = Order.objects.filter(
-        delivery_time__lt=datetime.now().date())
+
+def _notify_expired_orders() -> None:
+    """Отправка уведомления о новых просроченных заказах и их пометка"""
+
+    with span('notify', 'load_orders'):
+        expired_orders = list(
+            _get_expired_orders().filter(expired_notified_at__isnull=True))
+    if not expired_orders:
+        return
 
     # Генерируем и отправляем отчет.
-    notifier = NotifierExpiredOrders(expired_orders)
+    notifier = NotifierExpiredOrders(expired_orders, 'Новые просроченные заказы')
+    if not notifier.send_report():
+        logger.warning(
+            'Уведомление о %d просроченных заказах не доставлено, '
+            'повтор при следующей проверке',
+            len(expired_orders),
+        )
+        return
+
+    # Запоминаем, о каких заказах уже уведомили.
+    notified_at = timezone.now()
+    order_ids = [order.pk for order in expired_orders]
+    with span('notify', 'mark_notified'):
+        for i in range(0, len(order_ids), 1000):
+            Order.objects \
+                .filter(pk__in=order_ids[i:i + 1000], expired_notified_at__isnull=True) \
+                .update(expired_notified_at=notified_at)
+
+
+@shared_task
+def send_expired_orders_digest() -> None:
+    """Задание на отправку сводки по всем просроченным заказам"""
+
+    notifier = NotifierExpiredOrders(_get_expired_orders())
     notifier.send_report()
+
+
+@shared_task
+def compact_order_changes() -> None:
+    """Задание на удаление устаревших записей ленты изменений заказов"""
+
+    compact_changes(timedelta(hours=settings.ORDER_CHANGES_RETENTION_HOURS))
+
+
+def _get_expired_orders() -> QuerySet:
+    """
+    Получение просроченных заказов для отчета.
+
+    Загружаются только поля, которые используются в отчете.
+
+    :return: QuerySet просроченных заказов, упорядоченных по источникам.
+    """
+
+    return Order.objects \
+        .filter(delivery_time__lt=timezone.localdate()) \
+        .select_related('source') \
+        .only(
+            'order_number',
+            'delivery_time',
+            'dollars',
+            'source__title',
+            'source__spreadsheet_id',
+            'source__range_name',
+        ) \
+        .order_by('source_id', 'delivery_time')
@@ -0,0 +1,327 @@
+import time
+import logging
+import threading
+import telebot
+from typing import (
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+from concurrent.futures import ThreadPoolExecutor
+from telebot.apihelper import ApiTelegramException
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .metrics import (
+    TELEGRAM_MESSAGES,
+    TELEGRAM_SEND_SECONDS,
+)
+from .sync_lock import get_redis_client
+
+
+logger = logging.getLogger(__name__)
+
+# Ключ общего кэша с моментом следующей отправки сообщения ботом.
+GLOBAL_RATE_KEY = 'telegram-global-rate'
+
+
+class RetryAfter(Exception):
+    """Исключение превышения ограничения частоты сообщений Telegram"""
+
+    def __init__(self, retry_after: float) -> None:
+        """
+        Инициализатор класса.
+
+        :param retry_after: Через сколько секунд можно повторить отправку.
+        """
+
+        super().__init__(f'Повторить отправку через {retry_after} с')
+        self.retry_after = retry_after
+
+
+class BaseTransport:
+    """Базовый класс транспорта сообщений в Telegram"""
+
+    def send_message(self, chat_id: str, text: str) -> None:
+        """
+        Отправка сообщения в чат.
+
+        :param chat_id: id чата.
+        :param text: Текст сообщения.
+        :raises RetryAfter: Если Telegram просит повторить отправку позже.
+        """
+
+        raise NotImplementedError
+
+
+class TelebotTransport(BaseTransport):
+    """Класс транспорта сообщений через Telegram Bot API"""
+
+    def __init__(self) -> None:
+        """Инициализатор класса"""
+
+        self.__bot = telebot.TeleBot(settings.TELEGRAM_TOKEN)
+
+    def send_message(self, chat_id: str, text: str) -> None:
+        """
+        Отправка сообщения в чат.
+
+        :param chat_id: id чата.
+        :param text: Текст сообщения.
+        :raises RetryAfter: Если Telegram ответил 429 Too Many Requests.
+        """
+
+        try:
+            self.__bot.send_message(chat_id, text)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                parameters = e.result_json.get('parameters') or {}
+                raise RetryAfter(parameters.get('retry_after', 1)) from e
+            raise
+
+
+class FakeTransport(BaseTransport):
+    """
+    Класс транспорта, сохраняющего сообщения в памяти.
+
+    Используется в тестах и при локальной разработке. Отправленные
+    сообщения доступны в FakeTransport.outbox.
+    """
+
+    # Отправленные сообщения: id чата и текст.
+    outbox: List[Tuple[str, str]] = []
+    _lock = threading.Lock()
+
+    def send_message(self, chat_id: str, text: str) -> None:
+        """
+        Сохранение сообщения в памяти.
+
+        :param chat_id: id чата.
+        :param text: Текст сообщения.
+        """
+
+        with self._lock:
+            self.outbox.append((chat_id, text))
+
+
+class RateLimiter:
+    """
+    Класс ограничения частоты отправки сообщений.
+
+    Выдает потокам моменты отправки не чаще rate раз в секунду.
+    """
+
+    def __init__(self, rate: float) -> None:
+        """
+        Инициализатор класса.
+
+        :param rate: Максимальное количество сообщений в секунду.
+        """
+
+        self.__interval = 1 / rate
+        self.__next_time = 0.0
+        self.__lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Ожидание момента, когда можно отправить сообщение"""
+
+        with self.__lock:
+            now = time.monotonic()
+            send_time = max(now, self.__next_time)
+            self.__next_time = send_time + self.__interval
+
+        time.sleep(send_time - now)
+
+    def delay(self, seconds: float) -> None:
+        """
+        Запрет отправки на указанное время.
+
+        :param seconds: Время в секундах.
+        """
+
+        with self.__lock:
+            self.__next_time = max(self.__next_time, time.monotonic() + seconds)
+
+
+class SharedRateLimiter:
+    """
+    Класс ограничения частоты отправки сообщений всеми процессами.
+
+    Момент следующей отправки хранится в Redis общего кэша и выдается
+    скриптом Lua по часам Redis, поэтому ограничение действует на все
+    потоки, задачи и воркеры Celery вместе. С кэшем не в Redis (только
+    при DEBUG, см. CACHES в settings.py) ограничение действует в пределах
+    одного объекта, как у RateLimiter.
+    """
+
+    # Скрипт выдачи момента отправки: возвращает, сколько секунд ждать.
+    # Ключ живет, пока выданные моменты отправки не прошли.
+    SCRIPT = """
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local send_time = math.max(now, tonumber(redis.call('GET', KEYS[1]) or 0))
+        local next_time = send_time + tonumber(ARGV[1])
+        redis.call('SET', KEYS[1], tostring(next_time), 'PX', math.ceil((next_time - now) * 1000) + 1000)
+        return tostring(send_time - now)
+    """
+
+    def __init__(self, key: str, rate: float) -> None:
+        """
+        Инициализатор класса.
+
+        :param key: Ключ ограничения в общем кэше.
+        :param rate: Максимальное количество сообщений в секунду.
+        """
+
+        self.__interval = 1 / rate
+        self.__local_limiter: Optional[RateLimiter] = None
+        redis = get_redis_client()
+        if redis is None:
+            self.__local_limiter = RateLimiter(rate)
+        else:
+            self.__script = redis.register_script(self.SCRIPT)
+            self.__key = caches['default'].make_and_validate_key(key)
+
+    def wait(self) -> None:
+        """Ожидание момента, когда можно отправить сообщение"""
+
+        if self.__local_limiter is not None:
+            self.__local_limiter.wait()
+            return
+
+        delay = float(self.__script(keys=[self.__key], args=[repr(self.__interval)]))
+        time.sleep(delay)
+
+
+def split_message(text: str, limit: int) -> List[str]:
+    """
+    Разбиение текста на сообщения не длиннее limit символов.
+
+    Текст разбивается по строкам. Строки длиннее limit разрезаются.
+
+    :param text: Текст.
+    :param limit: Максимальная длина сообщения.
+    :return: Список сообщений.
+    """
+
+    chunks: List[str] = []
+    current = ''
+    for line in text.split('\n'):
+        pieces = [line[i:i + limit] for i in range(0, len(line), limit)] or ['']
+        for piece in pieces:
+            candidate = f'{current}\n{piece}' if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+class TelegramDelivery:
+    """
+    Класс отправки сообщений в Telegram нескольким получателям.
+
+    Длинный текст разбивается на сообщения, допустимые Telegram. Каждый
+    чат обслуживается отдельным потоком, поэтому медленный или
+    недоступный чат не задерживает остальных. Частота сообщений
+    ограничивается для каждого чата и для бота в целом - общим для всех
+    процессов SharedRateLimiter, а при ответе 429 отправка в чат
+    откладывается на указанное Telegram время.
+    """
+
+    # Максимальная длина сообщения в Telegram.
+    MESSAGE_LIMIT = 4096
+
+    def __init__(self, transport: Optional[BaseTransport] = None) -> None:
+        """
+        Инициализатор класса.
+
+        :param transport:
+            Транспорт сообщений. По умолчанию - класс из настройки
+            TELEGRAM_TRANSPORT.
+        """
+
+        self.__transport = transport if transport is not None \
+            else import_string(settings.TELEGRAM_TRANSPORT)()
+        self.__max_workers: int = settings.TELEGRAM_MAX_WORKERS
+        self.__max_retries: int = settings.TELEGRAM_MAX_RETRIES
+        self.__chat_rate: float = settings.TELEGRAM_CHAT_RATE
+        self.__global_limiter = SharedRateLimiter(GLOBAL_RATE_KEY, settings.TELEGRAM_GLOBAL_RATE)
+
+    def send(self, chat_ids: Iterable[str], text: str) -> int:
+        """
+        Отправка текста всем получателям.
+
+        :param chat_ids: id чатов получателей.
+        :param text: Текст.
+        :return: Количество чатов, получивших текст целиком.
+        """
+
+        chat_ids = list(chat_ids)
+        chunks = split_message(text, self.MESSAGE_LIMIT)
+        if not chat_ids or not chunks:
+            return 0
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(chat_ids), self.__max_workers),
+            thread_name_prefix='telegram-delivery',
+        ) as executor:
+            delivered = executor.map(
+                lambda chat_id: self._send_chunks(chat_id, chunks),
+                chat_ids,
+            )
+
+            return sum(delivered)
+
+    def _send_chunks(self, chat_id: str, chunks: List[str]) -> bool:
+        """
+        Отправка сообщений в один чат по порядку.
+
+        :param chat_id: id чата.
+        :param chunks: Сообщения.
+        :return: True, если все сообщения отправлены.
+        """
+
+        chat_limiter = RateLimiter(self.__chat_rate)
+        try:
+            for chunk in chunks:
+                self._send_chunk(chat_id, chunk, chat_limiter)
+        except Exception:
+            logger.exception('Не удалось отправить сообщение в чат %s', chat_id)
+            return False
+
+        return True
+
+    def _send_chunk(self, chat_id: str, chunk: str, chat_limiter: RateLimiter) -> None:
+        """
+        Отправка одного сообщения с повторами при превышении частоты.
+
+        :param chat_id: id чата.
+        :param chunk: Сообщение.
+        :param chat_limiter: Ограничитель частоты сообщений в чат.
+        """
+
+        for attempt in range(self.__max_retries + 1):
+            chat_limiter.wait()
+            self.__global_limiter.wait()
+            try:
+                with TELEGRAM_SEND_SECONDS.time():
+                    self.__transport.send_message(chat_id, chunk)
+            except RetryAfter as e:
+                TELEGRAM_MESSAGES.labels('rate_limited').inc()
+                if attempt == self.__max_retries:
+                    raise
+                chat_limiter.delay(e.retry_after)
+            except Exception:
+                TELEGRAM_MESSAGES.labels('failed').inc()
+                raise
+            else:
+                TELEGRAM_MESSAGES.labels('sent').inc()
+                return
@@ -1,3 +1,1554 @@
-from django.test import TestCase
+import io
+import os
+import re
+import json
+import tempfile
+import random
+from datetime import (
+    date,
+    timedelta,
+)
+from decimal import Decimal
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from unittest import mock
+from django.contrib.admin import site
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import (
+    Count,
+    Max,
+    Sum,
+)
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from prometheus_client.values import MultiProcessValue
+from redis.exceptions import LockNotOwnedError
 
-# Create your tests here.
+from .models import (
+    Order,
+    OrderDaySummary,
+    OrderTombstone,
+    QuarantinedRow,
+    SheetSource,
+    CurrencyRate,
+    SyncRevision,
+)
+from .admin import OrderAdmin
+from . import (
+    benchmark,
+    google_client,
+    metrics,
+    tasks,
+)
+from .order_observer import OrderObserver
+from .sheet_reader import SheetReader
+from .row_parser import (
+    RowParser,
+    get_error_order_numbers,
+)
+from .sync_partitions import (
+    PartitionedDiff,
+    diff_orders,
+    get_processes_count,
+)
+from .downsampling import lttb
+from .bulk_writer import (
+    OrderRow,
+    get_bulk_writer,
+)
+from .currency_rates import CbrRateProvider
+from .broadcast import (
+    InMemoryBroadcast,
+    get_broadcast,
+)
+from .change_log import SYNC_REVISION_PK
+from .google_client import get_sheets_service
+from .order_summary import (
+    get_bucket_totals,
+    get_summary,
+    rebuild_day_summaries,
+)
+from .sync_lock import (
+    LeaseLock,
+    SourceSyncLock,
+)
+from .telegram_delivery import (
+    FakeTransport,
+    RateLimiter,
+    RetryAfter,
+    SharedRateLimiter,
+    TelegramDelivery,
+    split_message,
+)
+
+
+class FakeRequest:
+    """Запрос к Google Sheets API с готовым результатом"""
+
+    def __init__(self, result: Dict[str, Any]) -> None:
+        """
+        Инициализатор класса.
+
+        :param result: Результат запроса.
+        """
+
+        self.__result = result
+
+    def execute(self) -> Dict[str, Any]:
+        """Выполнение запроса"""
+
+        return self.__result
+
+
+class FakeSheetValues:
+    """Значения ячеек Google-таблицы в памяти"""
+
+    # Номера первой и последней строки окна в A1-нотации.
+    WINDOW_PATTERN = re.compile(r'(\d+):[A-Z]+(\d+)$')
+
+    def __init__(self, rows: List[List[str]]) -> None:
+        """
+        Инициализатор класса.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        """
+
+        self.__rows = rows
+
+    def get(self, spreadsheetId: str, range: str) -> FakeRequest:
+        """Получение всех строк диапазона"""
+
+        if not self.__rows:
+            return FakeRequest({})
+
+        return FakeRequest({'values': [list(row) for row in self.__rows]})
+
+    def batchGet(self, spreadsheetId: str, ranges: List[str]) -> FakeRequest:
+        """Получение строк окон диапазона"""
+
+        value_ranges = []
+        for window in ranges:
+            match = self.WINDOW_PATTERN.search(window)
+            rows = [list(row) for row in self.__rows[int(match[1]) - 1:int(match[2])]]
+            # Как и API, пустые строки в конце окна не возвращаются.
+            while rows and not rows[-1]:
+                rows.pop()
+            value_ranges.append({'range': window, 'values': rows} if rows else {'range': window})
+
+        return FakeRequest({'valueRanges': value_ranges})
+
+
+class FakeSheetsService:
+    """Объект подключения к Google Sheets API с таблицей в памяти"""
+
+    def __init__(self, rows: List[List[str]]) -> None:
+        """
+        Инициализатор класса.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        """
+
+        self.__rows = rows
+
+    def spreadsheets(self) -> 'FakeSheetsService':
+        """Ресурс таблиц"""
+
+        return self
+
+    def values(self) -> FakeSheetValues:
+        """Ресурс значений ячеек"""
+
+        return FakeSheetValues(self.__rows)
+
+    def get(self, spreadsheetId: str, fields: str, ranges=None) -> FakeRequest:
+        """Получение метаданных листа"""
+
+        return FakeRequest({
+            'sheets': [{'properties': {'gridProperties': {'rowCount': len(self.__rows)}}}],
+        })
+
+
+def get_sample(name: str, **labels: str) -> float:
+    """
+    Получение значения метрики текущего процесса.
+
+    :param name: Имя значения метрики, например, с суффиксом _total.
+    :param labels: Метки значения.
+    :return: Значение или 0, если значение еще не записано.
+    """
+
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def make_rows(count: int, seed: int = 0) -> List[List[str]]:
+    """
+    Генерация строк Google-таблицы с заказами.
+
+    :param count: Количество заказов.
+    :param seed: Начальное значение генератора случайных чисел.
+    :return: Строки таблицы вместе с заголовками.
+    """
+
+    generator = random.Random(seed)
+    rows = [['№', 'заказ №', 'стоимость,$', 'срок поставки']]
+    for number in range(1, count + 1):
+        rows.append([
+            str(number),
+            str(1000 + number),
+            str(generator.randint(1, 5000)),
+            f'{generator.randint(1, 28):02d}.{generator.randint(1, 12):02d}.2022',
+        ])
+
+    return rows
+
+
+@override_settings(ORDERS_BROADCAST_BACKEND='googlesheets.broadcast.InMemoryBroadcast')
+class SyncTestCase(TestCase):
+    """Базовый класс тестов синхронизации с таблицей в памяти"""
+
+    # Курс доллара к рублю на сегодняшний день.
+    rate = Decimal('60')
+
+    def setUp(self) -> None:
+        cache.clear()
+        get_broadcast.cache_clear()
+        self.addCleanup(get_broadcast.cache_clear)
+        CbrRateProvider._local_cache.clear()
+        self.set_rate(self.rate)
+        # Источник, зарегистрированный миграцией по GS_SPREADSHEET_ID,
+        # в тестах не синхронизируется.
+        SheetSource.objects.all().delete()
+        self.source = SheetSource.objects.create(spreadsheet_id='sheet', range_name='A1:D')
+
+    def set_rate(self, rate: Decimal) -> None:
+        """
+        Сохранение курса доллара к рублю на сегодняшний день.
+
+        :param rate: Курс.
+        """
+
+        CbrRateProvider._local_cache.clear()
+        cache.clear()
+        CurrencyRate.objects.update_or_create(
+            char_code='USD',
+            date=timezone.localdate(),
+            defaults={'value': rate},
+        )
+
+    def sync(self, rows: List[List[str]], **env: str) -> None:
+        """
+        Синхронизация источника с таблицей.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        :param env: Переменные окружения на время синхронизации.
+        """
+
+        self.source.refresh_from_db()
+        with mock.patch.dict(os.environ, env):
+            OrderObserver(self.source, FakeSheetsService(rows)).run()
+
+    def get_revision(self) -> int:
+        """Получение последней ревизии"""
+
+        return SyncRevision.objects.get(pk=SYNC_REVISION_PK).value
+
+    def get_orders(self) -> Set[Tuple[int, int, Decimal, date, Decimal]]:
+        """Получение заказов источника без id и служебных полей"""
+
+        return set(
+            Order.objects
+            .filter(source=self.source)
+            .values_list('number', 'order_number', 'dollars', 'delivery_time', 'rubles')
+        )
+
+    def assertOrdersMatch(self, rows: List[List[str]], rate: Optional[Decimal] = None) -> None:
+        """
+        Проверка, что заказы источника совпадают со строками таблицы.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        :param rate: Курс, по которому посчитаны рубли.
+        """
+
+        rate = rate if rate is not None else self.rate
+        expected = set()
+        for number, order_number, dollars, delivery_time in rows[1:]:
+            day, month, year = map(int, delivery_time.split('.'))
+            expected.add((
+                int(number),
+                int(order_number),
+                Decimal(dollars),
+                date(year, month, day),
+                Decimal(dollars) * rate,
+            ))
+
+        self.assertEqual(self.get_orders(), expected)
+
+
+class OrderObserverTests(SyncTestCase):
+    """Тесты синхронизации заказов с Google-таблицей"""
+
+    def test_initial_sync_creates_orders(self):
+        rows = make_rows(50)
+        self.sync(rows)
+
+        self.assertOrdersMatch(rows)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.rubles_rate, self.rate)
+        self.assertTrue(self.source.fingerprint)
+        self.assertFalse(Order.objects.filter(revision__isnull=True).exists())
+
+    def test_unchanged_sheet_is_not_written(self):
+        rows = make_rows(20)
+        self.sync(rows)
+        revision = self.get_revision()
+
+        with mock.patch('googlesheets.order_observer.get_bulk_writer') as get_bulk_writer:
+            self.sync(make_rows(20))
+
+        get_bulk_writer.assert_not_called()
+        self.assertEqual(self.get_revision(), revision)
+
+    def test_only_changed_rows_are_written(self):
+        rows = make_rows(20)
+        self.sync(rows)
+        first_revision = self.get_revision()
+
+        rows[3][2] = '12345'
+        self.sync(rows)
+
+        self.assertOrdersMatch(rows)
+        changed = Order.objects.filter(revision__gt=first_revision)
+        self.assertEqual(list(changed.values_list('order_number', flat=True)), [int(rows[3][1])])
+
+    def test_removed_rows_are_deleted(self):
+        rows = make_rows(20)
+        self.sync(rows)
+        removed = rows.pop(5)
+
+        self.sync(rows)
+
+        self.assertOrdersMatch(rows)
+        tombstone = OrderTombstone.objects.get()
+        self.assertEqual(tombstone.order_number, int(removed[1]))
+        self.assertEqual(tombstone.revision, self.get_revision())
+
+    def test_empty_sheet_keeps_orders(self):
+        rows = make_rows(5)
+        self.sync(rows)
+
+        self.sync([])
+
+        self.assertOrdersMatch(rows)
+
+
+class RepriceTests(SyncTestCase):
+    """Тесты пересчета рублей при изменении курса"""
+
+    def test_initial_load_is_not_repriced(self):
+        with mock.patch.object(OrderObserver, '_update_rubles') as update_rubles:
+            self.sync(make_rows(10))
+
+        update_rubles.assert_not_called()
+        self.assertEqual(SyncRevision.objects.get(pk=SYNC_REVISION_PK).reset_value, 0)
+
+    def test_same_rate_is_not_repriced(self):
+        rows = make_rows(10)
+        self.sync(rows)
+        rows[1][2] = '7'
+
+        with mock.patch.object(OrderObserver, '_update_rubles') as update_rubles:
+            self.sync(rows)
+
+        update_rubles.assert_not_called()
+        self.assertOrdersMatch(rows)
+
+    def test_rate_change_reprices_all_orders(self):
+        rows = make_rows(30)
+        self.sync(rows)
+
+        self.set_rate(Decimal('72.5'))
+        self.sync(rows)
+
+        self.assertOrdersMatch(rows, Decimal('72.5'))
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.rubles_rate, Decimal('72.5'))
+        # Клиентам ленты изменений нужна полная перезагрузка.
+        counter = SyncRevision.objects.get(pk=SYNC_REVISION_PK)
+        self.assertEqual(counter.reset_value, counter.value)
+
+    @mock.patch.dict(os.environ, {'ORDER_REPRICE_BATCH_SIZE': '7'})
+    def test_reprice_in_batches(self):
+        rows = make_rows(30)
+        self.sync(rows)
+
+        self.set_rate(Decimal('61'))
+        self.sync(rows)
+
+        self.assertOrdersMatch(rows, Decimal('61'))
+
+    @mock.patch.dict(os.environ, {'ORDER_REPRICE_BATCH_SIZE': '5'})
+    def test_batches_follow_existing_orders(self):
+        rows = make_rows(40)
+        self.sync(rows)
+        # Пропуски в id: после удалений остаются 10 заказов.
+        rows = rows[:1] + rows[1::4]
+        self.sync(rows)
+
+        self.set_rate(Decimal('61'))
+        with CaptureQueriesContext(connection) as queries:
+            self.sync(rows)
+
+        updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(f'UPDATE {connection.ops.quote_name(Order._meta.db_table)}')
+        ]
+        # 10 заказов - две пачки по 5, без запросов по пропускам в id.
+        self.assertEqual(len(updates), 2)
+        self.assertOrdersMatch(rows, Decimal('61'))
+
+
+class SyncModeTests(SyncTestCase):
+    """Тесты способов сравнения и чтения таблицы"""
+
+    def check_sync(self, **env: str) -> None:
+        """
+        Проверка добавления, изменения и удаления заказов.
+
+        :param env: Переменные окружения, задающие способ синхронизации.
+        """
+
+        rows = make_rows(40)
+        self.sync(rows, **env)
+        self.assertOrdersMatch(rows)
+
+        rows[2][2] = '999'
+        rows[3][0], rows[4][0] = rows[4][0], rows[3][0]
+        removed = rows.pop(10)
+        rows.append(['41', '5000', '15', '01.01.2023'])
+        self.sync(rows, **env)
+
+        self.assertOrdersMatch(rows)
+        self.assertEqual(
+            list(OrderTombstone.objects.values_list('order_number', flat=True)),
+            [int(removed[1])],
+        )
+        self.assertFalse(Order.objects.filter(revision__isnull=True).exists())
+
+    def test_python_engine(self):
+        self.check_sync(GS_SYNC_ENGINE='python')
+
+    def test_sql_engine(self):
+        self.check_sync(GS_SYNC_ENGINE='sql')
+
+    def test_paged_read(self):
+        self.check_sync(GS_READ_PAGE_SIZE='7')
+
+    def test_paged_read_sql_engine(self):
+        self.check_sync(GS_READ_PAGE_SIZE='7', GS_SYNC_ENGINE='sql')
+
+    def test_paged_read_several_pages_per_request(self):
+        self.check_sync(GS_READ_PAGE_SIZE='5', GS_READ_PAGES_PER_REQUEST='3')
+
+
+class SheetReaderTests(TestCase):
+    """Тесты постраничного чтения таблицы"""
+
+    def test_pages_cover_range(self):
+        rows = make_rows(10)
+        reader = SheetReader(FakeSheetsService(rows), 'sheet', 'A1:D', 4, 2)
+
+        pages = list(reader.iter_pages())
+
+        self.assertEqual([len(page.rows) for page in pages], [4, 4, 3])
+        self.assertEqual([row for page in pages for row in page.rows], rows)
+        self.assertEqual([number for page in pages for number in page.row_numbers], list(range(1, 12)))
+
+    def test_range_end_limits_pages(self):
+        rows = make_rows(10)
+        reader = SheetReader(FakeSheetsService(rows), 'sheet', 'A2:D6', 2)
+
+        self.assertEqual(
+            list(reader.iter_pages()),
+            [(rows[1:3], [2, 3]), (rows[3:5], [4, 5]), (rows[5:6], [6])],
+        )
+
+    def test_empty_rows_keep_row_numbers(self):
+        rows = make_rows(6)
+        # Пустые строки внутри окна и в конце окна.
+        rows[2:2] = [[]]
+        rows[6:6] = [[], []]
+        reader = SheetReader(FakeSheetsService(rows), 'sheet', 'A1:D', 3)
+
+        pages = list(reader.iter_pages())
+
+        self.assertEqual([page.row_numbers for page in pages], [[1, 2], [4, 5, 6], [9], [10]])
+        self.assertEqual(
+            [row for page in pages for row in page.rows],
+            [row for row in rows if row],
+        )
+
+    def test_open_range_is_not_paged(self):
+        with self.assertRaises(ValueError):
+            SheetReader(FakeSheetsService([]), 'sheet', 'orders_range', 10)
+
+
+# Ответ API ЦБ с курсами двух валют.
+CBR_RESPONSE = (
+    b'<?xml version="1.0" encoding="windows-1251"?>'
+    b'<ValCurs Date="05.03.2022" name="Foreign Currency Market">'
+    b'<Valute ID="R01010"><NumCode>036</NumCode><CharCode>AUD</CharCode>'
+    b'<Nominal>1</Nominal><Value>40,1234</Value></Valute>'
+    b'<Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode>'
+    b'<Nominal>10</Nominal><Value>605,5</Value></Valute>'
+    b'</ValCurs>'
+)
+
+
+class FakeCbrResponse:
+    """Потоковый ответ API ЦБ"""
+
+    def __init__(self, content: bytes) -> None:
+        """
+        Инициализатор класса.
+
+        :param content: Тело ответа.
+        """
+
+        self.raw = io.BytesIO(content)
+
+    def __enter__(self) -> 'FakeCbrResponse':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.raw.close()
+
+    def raise_for_status(self) -> None:
+        """Проверка статуса ответа"""
+
+
+class CbrRateProviderTests(TestCase):
+    """Тесты получения курсов валют ЦБ"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        CbrRateProvider._local_cache.clear()
+        patcher = mock.patch(
+            'googlesheets.currency_rates.requests.get',
+            side_effect=lambda *args, **kwargs: FakeCbrResponse(CBR_RESPONSE),
+        )
+        self.requests_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_is_fetched_once(self):
+        rate_date = date(2022, 3, 5)
+
+        rate = CbrRateProvider().get_rate('USD', rate_date)
+
+        self.assertEqual(rate, Decimal('60.55'))
+        self.assertIn('05/03/2022', self.requests_get.call_args.args[0])
+        self.assertEqual(CurrencyRate.objects.get(char_code='USD', date=rate_date).value, rate)
+
+        # Курс берется из памяти процесса, а затем из общего кэша.
+        self.assertEqual(CbrRateProvider().get_rate('USD', rate_date), rate)
+        CbrRateProvider._local_cache.clear()
+        self.assertEqual(CbrRateProvider().get_rate('USD', rate_date), rate)
+        self.assertEqual(self.requests_get.call_count, 1)
+
+    def test_stored_rate_is_not_fetched(self):
+        CurrencyRate.objects.create(char_code='USD', date=timezone.localdate(), value=Decimal('59.9'))
+
+        self.assertEqual(CbrRateProvider().get_rate('USD'), Decimal('59.9'))
+        self.requests_get.assert_not_called()
+
+    def test_missing_currency_raises(self):
+        self.requests_get.side_effect = lambda *args, **kwargs: FakeCbrResponse(
+            CBR_RESPONSE.replace(b'R01235', b'R00000'))
+
+        with self.assertRaises(ValueError):
+            CbrRateProvider().get_rate('USD', date(2022, 3, 5))
+        self.assertFalse(CurrencyRate.objects.exists())
+
+
+class BulkWriterTests(TestCase):
+    """Тесты записи заказов пачками"""
+
+    def setUp(self) -> None:
+        self.source = SheetSource.objects.create(spreadsheet_id='sheet', range_name='A1:D')
+        self.writer = get_bulk_writer(self.source.pk)
+        self.writer.batch_size = 2
+
+    @staticmethod
+    def make_row(number: int, dollars: str, delivery_time: date) -> OrderRow:
+        """
+        Создание строки заказа.
+
+        :param number: Номер записи. Номер заказа на 1000 больше.
+        :param dollars: Стоимость в долларах.
+        :param delivery_time: Срок поставки.
+        :return: Строка заказа.
+        """
+
+        return OrderRow(
+            number,
+            1000 + number,
+            Decimal(dollars),
+            delivery_time,
+            Decimal(dollars) * 60,
+            f'digest-{number}-{dollars}',
+        )
+
+    def test_upsert_inserts_and_updates(self):
+        rows = [self.make_row(number, '10', date(2022, 1, number)) for number in range(1, 6)]
+        self.assertEqual(self.writer.upsert(rows), 5)
+        ids = dict(Order.objects.values_list('order_number', 'pk'))
+
+        writer = get_bulk_writer(self.source.pk)
+        upserted = writer.upsert([
+            self.make_row(2, '25.5', date(2022, 2, 1)),
+            self.make_row(6, '1', date(2022, 1, 6)),
+        ])
+
+        self.assertEqual(upserted, 2)
+        self.assertEqual(Order.objects.count(), 6)
+        order = Order.objects.get(order_number=1002)
+        self.assertEqual(order.pk, ids[1002])
+        self.assertEqual((order.dollars, order.delivery_time), (Decimal('25.5'), date(2022, 2, 1)))
+        self.assertEqual(order.digest, 'digest-2-25.5')
+        self.assertIsNone(order.revision)
+        # Заказ ушел из прежнего дня поставки.
+        self.assertEqual(writer.vacated_days, {date(2022, 1, 2)})
+
+    def test_delete_creates_tombstones(self):
+        rows = [self.make_row(number, '10', date(2022, 1, number)) for number in range(1, 6)]
+        self.writer.upsert(rows)
+        ids = dict(Order.objects.values_list('order_number', 'pk'))
+
+        writer = get_bulk_writer(self.source.pk)
+        deleted = writer.delete([1001, 1003, 1005, 9999])
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(set(Order.objects.values_list('order_number', flat=True)), {1002, 1004})
+        self.assertEqual(
+            set(OrderTombstone.objects.values_list('order_id', 'order_number', 'revision')),
+            {(ids[1001], 1001, None), (ids[1003], 1003, None), (ids[1005], 1005, None)},
+        )
+        self.assertEqual(writer.vacated_days, {date(2022, 1, 1), date(2022, 1, 3), date(2022, 1, 5)})
+
+
+class SheetsServiceTests(TestCase):
+    """Тесты переиспользования подключения к Google Sheets API"""
+
+    def setUp(self) -> None:
+        google_client._local.__dict__.clear()
+        self.addCleanup(google_client._local.__dict__.clear)
+        for target in ('SheetsClient', 'httplib2shim'):
+            patcher = mock.patch.object(google_client, target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        google_client.SheetsClient.side_effect = self.make_client
+
+    @staticmethod
+    def make_client(scopes: str) -> mock.Mock:
+        """
+        Создание подключения к API.
+
+        :param scopes: Разрешения на работу с API.
+        :return: Подключение.
+        """
+
+        return mock.Mock(pid=os.getpid(), scopes=scopes)
+
+    def test_service_is_reused(self):
+        service = get_sheets_service('scope')
+
+        self.assertIs(get_sheets_service('scope'), service)
+        google_client.SheetsClient.assert_called_once_with('scope')
+
+    def test_service_is_recreated_for_other_scopes(self):
+        get_sheets_service('scope')
+        get_sheets_service('other-scope')
+
+        self.assertEqual(google_client.SheetsClient.call_count, 2)
+
+    def test_service_is_recreated_after_fork(self):
+        get_sheets_service('scope')
+
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            get_sheets_service('scope')
+
+        self.assertEqual(google_client.SheetsClient.call_count, 2)
+
+
+class ObserveOrdersTaskTests(SyncTestCase):
+    """Тесты заданий синхронизации источников данных"""
+
+    def test_active_sources_are_queued_separately(self):
+        other = SheetSource.objects.create(spreadsheet_id='other', range_name='A1:D')
+        SheetSource.objects.create(spreadsheet_id='inactive', range_name='A1:D', is_active=False)
+
+        with mock.patch('googlesheets.tasks.group') as group:
+            tasks.observe_orders()
+
+        queued = group.call_args.args[0]
+        self.assertEqual([task.args for task in queued], [(self.source.pk, ), (other.pk, )])
+        group.return_value.apply_async.assert_called_once_with()
+
+    def test_task_syncs_source(self):
+        rows = make_rows(10)
+
+        with mock.patch(
+            'googlesheets.order_observer.get_sheets_service',
+            return_value=FakeSheetsService(rows),
+        ):
+            tasks.observe_order(self.source.pk)
+
+        self.assertOrdersMatch(rows)
+
+    def test_task_skips_inactive_source(self):
+        self.source.is_active = False
+        self.source.save()
+
+        with mock.patch('googlesheets.tasks.OrderObserver') as observer:
+            tasks.observe_order(self.source.pk)
+
+        observer.assert_not_called()
+
+
+class SyncLockTests(SyncTestCase):
+    """Тесты блокировки синхронизации источника данных"""
+
+    def test_lock_is_exclusive(self):
+        lock = SourceSyncLock(self.source.pk, 60)
+        other = SourceSyncLock(self.source.pk, 60)
+
+        self.assertTrue(lock.acquire())
+        self.assertTrue(other.is_locked())
+        self.assertFalse(other.acquire())
+        # Запуск во время синхронизации превращается в одну повторную.
+        self.assertTrue(lock.release())
+        self.assertFalse(other.is_locked())
+        self.assertTrue(other.acquire())
+        self.assertFalse(other.release())
+
+    def test_release_keeps_lock_of_other_worker(self):
+        lock = SourceSyncLock(self.source.pk, 60)
+        lock.acquire()
+        # Аренда истекла, и блокировку получил другой воркер.
+        cache.set(f'sheet-source-sync:{self.source.pk}', 'other-token')
+
+        lock.release()
+
+        self.assertTrue(lock.is_locked())
+
+    def test_locked_source_is_not_queued(self):
+        lock = SourceSyncLock(self.source.pk, 60)
+        lock.acquire()
+        self.addCleanup(lock.release)
+
+        with mock.patch('googlesheets.tasks.group') as group:
+            tasks.observe_orders()
+
+        self.assertEqual(group.call_args.args[0], [])
+
+    def test_locked_source_is_not_synced(self):
+        lock = SourceSyncLock(self.source.pk, 60)
+        lock.acquire()
+        self.addCleanup(lock.release)
+
+        with mock.patch('googlesheets.tasks.OrderObserver') as observer:
+            tasks.observe_order(self.source.pk)
+
+        observer.assert_not_called()
+
+    def test_run_during_sync_is_repeated_once(self):
+        def run():
+            # Два запуска, пришедшие во время синхронизации.
+            tasks.observe_order(self.source.pk)
+            tasks.observe_order(self.source.pk)
+
+        with mock.patch('googlesheets.tasks.OrderObserver') as observer, \
+                mock.patch.object(tasks.observe_order, 'apply_async') as apply_async:
+            observer.return_value.run.side_effect = run
+            tasks.observe_order(self.source.pk)
+
+        observer.assert_called_once()
+        apply_async.assert_called_once_with((self.source.pk, ), expires=mock.ANY)
+        self.assertFalse(SourceSyncLock(self.source.pk, 60).is_locked())
+
+    def patch_redis_lock(self) -> mock.MagicMock:
+        """
+        Подмена блокировки Redis, как при кэше в Redis.
+
+        :return: Подмененная блокировка Redis.
+        """
+
+        patchers = (
+            mock.patch('googlesheets.sync_lock.get_redis_client', return_value=mock.Mock()),
+            mock.patch('googlesheets.sync_lock.Lock'),
+        )
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+        return mocks[1].return_value
+
+    def test_redis_lock_is_released_by_owner_only(self):
+        redis_lock = self.patch_redis_lock()
+        lock = SourceSyncLock(self.source.pk, 60)
+
+        self.assertTrue(lock.acquire())
+        token = redis_lock.acquire.call_args.kwargs['token']
+        redis_lock.acquire.assert_called_once_with(blocking=False, token=token)
+        # Аренда истекла, и блокировку получил другой воркер: скрипт
+        # освобождения сверяет владельца и не удаляет чужую блокировку.
+        redis_lock.release.side_effect = LockNotOwnedError
+
+        self.assertFalse(lock.release())
+        redis_lock.release.assert_called_once_with()
+
+    def test_busy_redis_lock_marks_pending(self):
+        redis_lock = self.patch_redis_lock()
+        redis_lock.acquire.return_value = False
+        lock = SourceSyncLock(self.source.pk, 60)
+
+        self.assertFalse(lock.acquire())
+        self.assertTrue(lock.release())
+
+    def test_heartbeat_stops_when_redis_lease_is_lost(self):
+        redis_lock = self.patch_redis_lock()
+        redis_lock.extend.side_effect = [True, LockNotOwnedError]
+        lock = LeaseLock('lease-test', 0.03)
+
+        lock._renew_lease()
+
+        self.assertEqual(redis_lock.extend.call_args_list, [mock.call(0.03, replace_ttl=True)] * 2)
+
+
+@override_settings(
+    TELEGRAM_TRANSPORT='googlesheets.telegram_delivery.FakeTransport',
+    TELEGRAM_ACCESS_USER_ID=['1', '2'],
+    TELEGRAM_CHAT_RATE=1000,
+    TELEGRAM_GLOBAL_RATE=1000,
+)
+class NotifyExpiredOrdersTests(TestCase):
+    """Тесты уведомления о просроченных заказах"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        FakeTransport.outbox.clear()
+        self.addCleanup(FakeTransport.outbox.clear)
+        self.source = SheetSource.objects.create(title='Заказы', spreadsheet_id='sheet', range_name='A1:D')
+        today = timezone.localdate()
+        for number, delivery_time in enumerate(
+            (today - timedelta(days=2), today - timedelta(days=1), today),
+            1,
+        ):
+            Order.objects.create(
+                source=self.source,
+                number=number,
+                order_number=1000 + number,
+                dollars=Decimal(10),
+                delivery_time=delivery_time,
+                rubles=Decimal(600),
+            )
+
+    def get_notified(self) -> Set[int]:
+        """Получение номеров заказов, о просрочке которых уведомили"""
+
+        return set(
+            Order.objects
+            .filter(expired_notified_at__isnull=False)
+            .values_list('order_number', flat=True)
+        )
+
+    def test_expired_orders_are_notified_once(self):
+        tasks.notify_expired_orders()
+
+        self.assertEqual(sorted(chat_id for chat_id, _ in FakeTransport.outbox), ['1', '2'])
+        text = FakeTransport.outbox[0][1]
+        self.assertIn('Заказ#1001', text)
+        self.assertIn('Заказ#1002', text)
+        self.assertNotIn('Заказ#1003', text)
+        self.assertEqual(self.get_notified(), {1001, 1002})
+
+        tasks.notify_expired_orders()
+
+        self.assertEqual(len(FakeTransport.outbox), 2)
+
+    def test_undelivered_orders_are_not_marked(self):
+        with mock.patch.object(FakeTransport, 'send_message', side_effect=ConnectionError), \
+                self.assertLogs('googlesheets', 'WARNING') as logs:
+            tasks.notify_expired_orders()
+
+        self.assertEqual(self.get_notified(), set())
+        self.assertIn('повтор при следующей проверке', logs.output[-1])
+
+        tasks.notify_expired_orders()
+
+        self.assertEqual(self.get_notified(), {1001, 1002})
+
+    def test_locked_task_does_not_notify(self):
+        lock = LeaseLock(tasks.NOTIFY_LOCK_KEY, 60)
+        lock.acquire()
+        self.addCleanup(lock.release)
+
+        tasks.notify_expired_orders()
+
+        self.assertEqual(FakeTransport.outbox, [])
+        self.assertEqual(self.get_notified(), set())
+
+    def test_digest_includes_notified_orders(self):
+        tasks.notify_expired_orders()
+        FakeTransport.outbox.clear()
+
+        tasks.send_expired_orders_digest()
+
+        self.assertEqual(len(FakeTransport.outbox), 2)
+        self.assertIn('Заказ#1001', FakeTransport.outbox[0][1])
+        self.assertIn('Заказ#1002', FakeTransport.outbox[0][1])
+
+
+class RateLimitedTransport(FakeTransport):
+    """Транспорт, отвечающий 429 на первые попытки отправки в каждый чат"""
+
+    def __init__(self, failures: int) -> None:
+        """
+        Инициализатор класса.
+
+        :param failures: Количество ответов 429 для каждого чата.
+        """
+
+        self.failures: Dict[str, int] = {}
+        self.__failures = failures
+
+    def send_message(self, chat_id: str, text: str) -> None:
+        with self._lock:
+            failures = self.failures[chat_id] = self.failures.get(chat_id, 0) + 1
+        if failures <= self.__failures:
+            raise RetryAfter(0.01)
+
+        super().send_message(chat_id, text)
+
+
+@override_settings(
+    TELEGRAM_CHAT_RATE=1000,
+    TELEGRAM_GLOBAL_RATE=1000,
+    TELEGRAM_MAX_RETRIES=2,
+)
+class TelegramDeliveryTests(TestCase):
+    """Тесты отправки сообщений в Telegram"""
+
+    def setUp(self) -> None:
+        FakeTransport.outbox.clear()
+        self.addCleanup(FakeTransport.outbox.clear)
+
+    def test_split_message_respects_limit(self):
+        text = '\n'.join(f'{i}. Заказ#{1000 + i}' for i in range(200))
+
+        chunks = split_message(text, 100)
+
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual('\n'.join(chunks), text)
+
+    def test_split_message_cuts_long_lines(self):
+        self.assertEqual(split_message('abcdefghij\nk', 4), ['abcd', 'efgh', 'ij\nk'])
+        self.assertEqual(split_message('', 4), [])
+
+    def test_chunks_are_sent_in_order(self):
+        delivery = TelegramDelivery(FakeTransport())
+        delivery.MESSAGE_LIMIT = 20
+        text = '\n'.join(f'line {i}' for i in range(10))
+
+        delivered = delivery.send(['1', '2'], text)
+
+        self.assertEqual(delivered, 2)
+        for chat_id in ('1', '2'):
+            chunks = [chunk for chat, chunk in FakeTransport.outbox if chat == chat_id]
+            self.assertEqual(chunks, split_message(text, 20))
+
+    def test_rate_limited_message_is_retried(self):
+        transport = RateLimitedTransport(failures=2)
+
+        delivered = TelegramDelivery(transport).send(['1', '2'], 'report')
+
+        self.assertEqual(delivered, 2)
+        self.assertEqual(transport.failures, {'1': 3, '2': 3})
+        self.assertEqual(sorted(FakeTransport.outbox), [('1', 'report'), ('2', 'report')])
+
+    def test_retries_are_limited(self):
+        transport = RateLimitedTransport(failures=3)
+
+        with self.assertLogs('googlesheets.telegram_delivery', 'ERROR'):
+            delivered = TelegramDelivery(transport).send(['1'], 'report')
+
+        self.assertEqual(delivered, 0)
+        self.assertEqual(FakeTransport.outbox, [])
+
+    def test_failed_chat_does_not_stop_others(self):
+        transport = FakeTransport()
+        send_message = transport.send_message
+
+        def fail_first_chat(chat_id: str, text: str) -> None:
+            if chat_id == '1':
+                raise ConnectionError
+            send_message(chat_id, text)
+
+        transport.send_message = fail_first_chat
+        with self.assertLogs('googlesheets.telegram_delivery', 'ERROR'):
+            delivered = TelegramDelivery(transport).send(['1', '2', '3'], 'report')
+
+        self.assertEqual(delivered, 2)
+        self.assertEqual(sorted(chat_id for chat_id, _ in FakeTransport.outbox), ['2', '3'])
+
+
+class RateLimiterTests(TestCase):
+    """Тесты ограничения частоты отправки сообщений"""
+
+    @mock.patch('googlesheets.telegram_delivery.time.sleep')
+    def test_waits_are_spaced(self, sleep):
+        limiter = RateLimiter(10)
+
+        for _ in range(3):
+            limiter.wait()
+        limiter.delay(1)
+        limiter.wait()
+
+        delays = [call.args[0] for call in sleep.call_args_list]
+        for delay, expected in zip(delays, (0, 0.1, 0.2, 1)):
+            self.assertAlmostEqual(delay, expected, delta=0.05)
+
+    @mock.patch('googlesheets.telegram_delivery.time.sleep')
+    def test_shared_limiter_waits_for_redis(self, sleep):
+        redis = mock.Mock()
+        script = redis.register_script.return_value
+        script.return_value = b'0.25'
+        with mock.patch('googlesheets.telegram_delivery.get_redis_client', return_value=redis):
+            limiter = SharedRateLimiter('rate-test', 10)
+        limiter.wait()
+
+        # Момент отправки выдается одним скриптом для всех процессов.
+        redis.register_script.assert_called_once_with(SharedRateLimiter.SCRIPT)
+        script.assert_called_once_with(keys=[cache.make_and_validate_key('rate-test')], args=['0.1'])
+        sleep.assert_called_once_with(0.25)
+
+    @mock.patch('googlesheets.telegram_delivery.time.sleep')
+    def test_shared_limiter_without_redis_is_local(self, sleep):
+        limiter = SharedRateLimiter('rate-test', 10)
+
+        for _ in range(3):
+            limiter.wait()
+
+        delays = [call.args[0] for call in sleep.call_args_list]
+        for delay, expected in zip(delays, (0, 0.1, 0.2)):
+            self.assertAlmostEqual(delay, expected, delta=0.05)
+
+
+class PublishRevisionTests(SyncTestCase):
+    """Тесты публикации изменений ревизии подписчикам"""
+
+    def sync_and_publish(self, rows: List[List[str]]) -> List[Dict[str, Any]]:
+        """
+        Синхронизация с публикацией изменений после фиксации транзакции.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        :return: Опубликованные сообщения.
+        """
+
+        with mock.patch.object(InMemoryBroadcast, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.sync(rows)
+
+        return [call.args[0] for call in publish.call_args_list]
+
+    def test_changes_are_published(self):
+        rows = make_rows(10)
+        self.sync_and_publish(rows)
+        rows[1][2] = '77'
+        removed = rows.pop(2)
+
+        message, = self.sync_and_publish(rows)
+
+        revision = self.get_revision()
+        order = Order.objects.get(order_number=1001)
+        self.assertEqual(message['revision'], revision)
+        self.assertEqual(message['base_revision'], revision - 1)
+        self.assertFalse(message['reset'])
+        self.assertEqual(message['upserted'], [{
+            'id': order.pk,
+            'source': self.source.pk,
+            'number': 1,
+            'order_number': 1001,
+            'dollars': '77.00000',
+            'delivery_time': order.delivery_time.isoformat(),
+            'rubles': '4620.00000',
+        }])
+        self.assertEqual(
+            [(tombstone['order_number'], tombstone['revision']) for tombstone in message['deleted']],
+            [(int(removed[1]), revision)],
+        )
+        self.assertEqual(message['total_dollars'], float(sum(Decimal(row[2]) for row in rows[1:])))
+
+    @override_settings(ORDERS_PUSH_MAX_CHANGES=5)
+    def test_large_revision_is_published_without_orders(self):
+        message, = self.sync_and_publish(make_rows(10))
+
+        self.assertEqual((message['upserted'], message['deleted']), (None, None))
+        self.assertEqual(message['revision'], self.get_revision())
+
+    def test_reprice_is_published_as_reset(self):
+        rows = make_rows(10)
+        self.sync_and_publish(rows)
+        self.set_rate(Decimal('70'))
+
+        messages = self.sync_and_publish(rows)
+
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0]['reset'])
+        self.assertIsNone(messages[0]['upserted'])
+
+
+class DaySummaryTests(SyncTestCase):
+    """Тесты сводок по заказам за дни поставки"""
+
+    def assertSummariesMatch(self) -> None:
+        """Проверка, что сводки совпадают с итогами по таблице заказов"""
+
+        expected = {
+            (row['source'], row['delivery_time']): (
+                row['count'], row['total_dollars'], row['total_rubles'], row['max_dollars'])
+            for row in Order.objects
+            .order_by()
+            .values('source', 'delivery_time')
+            .annotate(
+                count=Count('id'),
+                total_dollars=Sum('dollars'),
+                total_rubles=Sum('rubles'),
+                max_dollars=Max('dollars'),
+            )
+        }
+        summaries = {
+            (summary.source_id, summary.delivery_time): (
+                summary.count, summary.total_dollars, summary.total_rubles, summary.max_dollars)
+            for summary in OrderDaySummary.objects.all()
+        }
+
+        self.assertEqual(summaries, expected)
+
+    def check_summaries(self, **env: str) -> None:
+        """
+        Проверка сводок после изменений таблицы.
+
+        :param env: Переменные окружения, задающие способ синхронизации.
+        """
+
+        rows = make_rows(60)
+        self.sync(rows, **env)
+        self.assertSummariesMatch()
+
+        # Перенос срока поставки, изменение стоимости и удаление заказов.
+        rows[1][3] = '15.06.2023'
+        rows[2][2] = '1'
+        del rows[3:10]
+        self.sync(rows, **env)
+        self.assertSummariesMatch()
+
+        self.set_rate(Decimal('65'))
+        self.sync(rows, **env)
+        self.assertSummariesMatch()
+
+    def test_python_engine(self):
+        self.check_summaries(GS_SYNC_ENGINE='python')
+
+    def test_sql_engine(self):
+        self.check_summaries(GS_SYNC_ENGINE='sql')
+
+    def test_paged_read(self):
+        self.check_summaries(GS_READ_PAGE_SIZE='9')
+
+    def test_summary_totals(self):
+        self.sync(make_rows(40))
+        today = timezone.localdate()
+        Order.objects.filter(number__lte=4).update(delivery_time=today)
+        rebuild_day_summaries(self.source.pk)
+
+        summary = get_summary(OrderDaySummary.objects.all(), today)
+
+        totals = Order.objects.aggregate(
+            total_dollars=Sum('dollars'),
+            total_rubles=Sum('rubles'),
+            max_dollars=Max('dollars'),
+        )
+        self.assertEqual(summary, {
+            'count': 40,
+            'overdue_count': 36,
+            **totals,
+        })
+
+    def test_bucket_totals(self):
+        self.sync(make_rows(100))
+
+        months = get_bucket_totals(OrderDaySummary.objects.all(), 'month')
+
+        self.assertEqual([month['delivery_time'] for month in months], [
+            date(2022, month, 1)
+            for month in sorted({int(row[3][3:5]) for row in make_rows(100)[1:]})
+        ])
+        for month in months:
+            orders = Order.objects.filter(
+                delivery_time__year=2022,
+                delivery_time__month=month['delivery_time'].month,
+            )
+            self.assertEqual(month['count'], orders.count())
+            self.assertEqual(month['total_dollars'], orders.aggregate(Sum('dollars'))['dollars__sum'])
+
+
+class LttbTests(TestCase):
+    """Тесты прореживания ряда точек"""
+
+    @staticmethod
+    def downsample(points: List[Tuple[int, float]], threshold: int) -> List[Tuple[int, float]]:
+        """
+        Прореживание точек (x, y).
+
+        :param points: Точки.
+        :param threshold: Количество точек в результате.
+        :return: Выбранные точки.
+        """
+
+        return lttb(points, threshold, x=lambda point: point[0], y=lambda point: point[1])
+
+    def test_short_series_is_unchanged(self):
+        points = [(i, float(i)) for i in range(5)]
+
+        self.assertEqual(self.downsample(points, 5), points)
+        self.assertEqual(self.downsample(points, 10), points)
+        self.assertEqual(self.downsample(points, 2), points)
+
+    def test_size_and_ends_are_kept(self):
+        generator = random.Random(0)
+        points = [(i, generator.random()) for i in range(1000)]
+
+        sampled = self.downsample(points, 50)
+
+        self.assertEqual(len(sampled), 50)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+
+    def test_peaks_are_kept(self):
+        points = [(i, 0.0) for i in range(100)]
+        points[37] = (37, 100.0)
+        points[71] = (71, -100.0)
+
+        sampled = self.downsample(points, 10)
+
+        self.assertIn(points[37], sampled)
+        self.assertIn(points[71], sampled)
+
+
+class SyntheticSheetTests(SyncTestCase):
+    """Тесты синтетической таблицы замера производительности"""
+
+    def test_rows_are_deterministic(self):
+        sheet = benchmark.SyntheticSheet(100, seed=1)
+
+        self.assertEqual(len(sheet.rows), 101)
+        self.assertEqual(sheet.rows, benchmark.SyntheticSheet(100, seed=1).rows)
+        self.assertNotEqual(sheet.rows, benchmark.SyntheticSheet(100, seed=2).rows)
+
+    def test_churn_keeps_size(self):
+        sheet = benchmark.SyntheticSheet(300, seed=1)
+        numbers = {row[0] for row in sheet.rows[1:]}
+
+        self.assertEqual(sheet.apply_churn(0.1), 30)
+        self.assertEqual(len(sheet.rows), 301)
+        # Удаленные строки заменены новыми.
+        self.assertEqual(len({row[0] for row in sheet.rows[1:]} - numbers), 10)
+
+    def test_sync_from_fake_service(self):
+        sheet = benchmark.SyntheticSheet(200, seed=1)
+        for env in ({}, {'GS_READ_PAGE_SIZE': '30'}):
+            with self.subTest(env=env):
+                sheet.apply_churn(0.1)
+                self.source.refresh_from_db()
+                with mock.patch.dict(os.environ, env):
+                    OrderObserver(self.source, benchmark.FakeSheetsService(sheet)).run()
+
+                self.assertOrdersMatch(sheet.rows)
+
+
+class MetricsTests(SyncTestCase):
+    """Тесты метрик синхронизации"""
+
+    def test_sync_rows_are_counted(self):
+        rows = make_rows(10)
+        fetched = get_sample('channelservice_sync_rows_total', operation='fetched')
+        inserted = get_sample('channelservice_sync_rows_total', operation='inserted')
+        updated = get_sample('channelservice_sync_rows_total', operation='updated')
+        self.sync(rows)
+
+        rows[1][2] = str(int(rows[1][2]) + 1)
+        rows[2][2] = str(int(rows[2][2]) + 1)
+        self.sync(rows)
+
+        self.assertEqual(get_sample('channelservice_sync_rows_total', operation='fetched') - fetched, 20)
+        self.assertEqual(get_sample('channelservice_sync_rows_total', operation='inserted') - inserted, 10)
+        self.assertEqual(get_sample('channelservice_sync_rows_total', operation='updated') - updated, 2)
+
+    def test_sync_phases_are_timed(self):
+        count = get_sample('channelservice_phase_seconds_count', task='sync', phase='total')
+        queries = get_sample('channelservice_phase_db_queries_total', task='sync', phase='upsert')
+        self.sync(make_rows(10))
+
+        self.assertEqual(get_sample('channelservice_phase_seconds_count', task='sync', phase='total') - count, 1)
+        self.assertGreater(get_sample('channelservice_phase_db_queries_total', task='sync', phase='upsert'), queries)
+
+    @override_settings(METRICS_LOG_JSON=True)
+    def test_failed_span_is_logged(self):
+        count = get_sample('channelservice_phase_seconds_count', task='test', phase='fail')
+        with self.assertLogs(metrics.logger, 'INFO') as logs, self.assertRaises(ValueError):
+            with metrics.span('test', 'fail', source_id=1) as fields:
+                fields['rows'] = 2
+                raise ValueError
+
+        self.assertEqual(get_sample('channelservice_phase_seconds_count', task='test', phase='fail') - count, 1)
+        event = json.loads(logs.records[0].getMessage())
+        self.assertEqual(
+            {key: event[key] for key in ('event', 'task', 'phase', 'error', 'source_id', 'rows')},
+            {'event': 'span', 'task': 'test', 'phase': 'fail', 'error': 'ValueError', 'source_id': 1, 'rows': 2},
+        )
+
+
+class MultiServiceMetricsTests(TestCase):
+    """Тесты сбора метрик процессов нескольких служб"""
+
+    def write_counter(self, path: str, value: float) -> None:
+        """
+        Запись счетчика процесса службы в ее каталог метрик.
+
+        :param path: Каталог метрик процессов службы.
+        :param value: Значение счетчика.
+        """
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+            counter = MultiProcessValue(lambda: 1)('counter', 'test_jobs', 'test_jobs_total', (), ())
+            counter.inc(value)
+
+    def test_services_are_aggregated(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        web, celery = os.path.join(root.name, 'web'), os.path.join(root.name, 'celery')
+        for path, value in ((web, 2), (celery, 3)):
+            os.mkdir(path)
+            self.write_counter(path, value)
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': web}):
+            with override_settings(METRICS_MULTIPROC_ROOT=root.name):
+                self.assertIn(b'test_jobs_total 5.0', metrics.get_metrics())
+            # Без общего каталога собираются только процессы своей службы.
+            with override_settings(METRICS_MULTIPROC_ROOT=''):
+                self.assertIn(b'test_jobs_total 2.0', metrics.get_metrics())
+
+
+class QuarantineTests(SyncTestCase):
+    """Тесты строк таблицы с ошибками"""
+
+    def test_parser_returns_errors(self):
+        rows = make_rows(6)[1:]
+        rows[1][2] = 'abc'
+        rows[2] = rows[2][:3]
+        rows[3][3] = '31.02.2022'
+        rows[4][1] = '-1'
+        order_rows, errors = RowParser(Decimal(60)).parse(rows, start_position=11)
+
+        self.assertEqual([row.number for row in order_rows], [1, 6])
+        self.assertEqual(
+            [(error.position, error.reason) for error in errors],
+            [
+                (12, "стоимость: неверное значение 'abc'"),
+                (13, 'заполнены не все столбцы'),
+                (14, "срок поставки: неверное значение '31.02.2022'"),
+                (15, "номер заказа: неверное значение '-1'"),
+            ],
+        )
+        self.assertEqual(get_error_order_numbers(errors), {1002, 1003, 1004})
+
+    def sync_with_errors(self, rows: List[List[str]], **env: str) -> None:
+        """
+        Синхронизация источника с таблицей, в которой есть ошибки.
+
+        :param rows: Строки таблицы вместе с заголовками.
+        :param env: Переменные окружения на время синхронизации.
+        """
+
+        with self.assertLogs('googlesheets.order_observer', 'WARNING'):
+            self.sync(rows, **env)
+
+    def check_quarantine(self, **env: str) -> None:
+        """
+        Проверка, что заказы строк с ошибками не меняются и не удаляются.
+
+        :param env: Переменные окружения, задающие способ синхронизации.
+        """
+
+        rows = make_rows(20)
+        self.sync(rows, **env)
+
+        broken = [list(row) for row in rows]
+        broken[2][2] = 'abc'
+        broken[3] = broken[3][:2]
+        broken[5][2] = '777'
+        self.sync_with_errors(broken, **env)
+
+        # Заказы строк с ошибками остаются прежними.
+        expected = [list(row) for row in broken]
+        expected[2], expected[3] = rows[2], rows[3]
+        self.assertOrdersMatch(expected)
+        quarantined = QuarantinedRow.objects.filter(source=self.source).order_by('position')
+        self.assertEqual(
+            list(quarantined.values_list('position', 'values')),
+            [(2, broken[2]), (3, broken[3])],
+        )
+        self.assertFalse(OrderTombstone.objects.exists())
+
+        self.sync(rows, **env)
+        self.assertOrdersMatch(rows)
+        self.assertFalse(QuarantinedRow.objects.exists())
+
+    def test_python_engine(self):
+        self.check_quarantine(GS_SYNC_ENGINE='python')
+
+    def test_sql_engine(self):
+        self.check_quarantine(GS_SYNC_ENGINE='sql')
+
+    def test_paged_read(self):
+        self.check_quarantine(GS_READ_PAGE_SIZE='7')
+
+    def test_paged_read_sql_engine(self):
+        self.check_quarantine(GS_READ_PAGE_SIZE='7', GS_SYNC_ENGINE='sql')
+
+    def test_paged_positions_skip_empty_rows(self):
+        rows = make_rows(20)
+        rows[4:4] = [[]]
+        rows[9:9] = [[], []]
+        rows[15][2] = 'abc'
+        for env in ({}, {'GS_READ_PAGE_SIZE': '4'}):
+            with self.subTest(env=env):
+                self.sync_with_errors(rows, **env)
+
+                # Номер строки данных совпадает при чтении целиком
+                # и постранично, несмотря на пропущенные пустые строки.
+                self.assertIn(
+                    (15, rows[15]),
+                    list(QuarantinedRow.objects.values_list('position', 'values')),
+                )
+
+    def test_order_of_broken_order_number_is_deleted(self):
+        rows = make_rows(10)
+        self.sync(rows)
+
+        rows[4][1] = 'x'
+        self.sync_with_errors(rows)
+
+        self.assertOrdersMatch(rows[:4] + rows[5:])
+        self.assertEqual(list(OrderTombstone.objects.values_list('order_number', flat=True)), [1004])
+
+
+class PartitionedDiffTests(SyncTestCase):
+    """Тесты разбора и сравнения таблицы в нескольких процессах"""
+
+    def test_result_matches_single_process(self):
+        rows = make_rows(60)
+        self.sync(rows)
+        db_digests = dict(Order.objects.values_list('order_number', 'digest'))
+
+        data = [list(row) for row in rows[1:]]
+        data[3][2] = '1'
+        data[7][2] = 'abc'
+        data[9][1] = 'x'
+        data.append(['61', '5000', '15', '01.01.2023'])
+        order_rows, errors = RowParser(self.rate).parse(data)
+        data_dict = {row.order_number: row for row in order_rows}
+        changed_rows, inserted = diff_orders(data_dict, db_digests)
+
+        result = PartitionedDiff(3).run(data, db_digests, self.rate)
+
+        self.assertCountEqual(result.changed_rows, changed_rows)
+        self.assertEqual(result.inserted, inserted)
+        self.assertCountEqual(result.order_numbers, data_dict.keys())
+        self.assertEqual(result.errors, errors)
+
+    def test_partitioned_sync(self):
+        count = get_sample('channelservice_phase_seconds_count', task='sync', phase='partitioned_diff')
+        rows = make_rows(40)
+        with mock.patch.object(OrderObserver, 'PARALLEL_MIN_ROWS', 10):
+            self.sync(rows, GS_SYNC_PROCESSES='2')
+
+            rows[2][2] = '999'
+            removed = rows.pop(10)
+            rows.append(['41', '5000', '15', '01.01.2023'])
+            self.sync(rows, GS_SYNC_PROCESSES='2')
+
+        self.assertOrdersMatch(rows)
+        self.assertEqual(
+            list(OrderTombstone.objects.values_list('order_number', flat=True)),
+            [int(removed[1])],
+        )
+        self.assertEqual(
+            get_sample('channelservice_phase_seconds_count', task='sync', phase='partitioned_diff') - count,
+            2,
+        )
+
+    def test_failed_partition_raises(self):
+        with mock.patch('googlesheets.sync_partitions._diff_partition', side_effect=lambda *args: os._exit(1)):
+            with self.assertRaisesMessage(RuntimeError, 'завершился с кодом 1'):
+                PartitionedDiff(2).run(make_rows(10)[1:], {}, self.rate)
+
+    def test_processes_count(self):
+        self.assertEqual(get_processes_count(3), 3)
+        self.assertEqual(get_processes_count(0), len(os.sched_getaffinity(0)))
+
+
+class OrderAdminTests(SyncTestCase):
+    """Тесты изменения заказов в админке"""
+
+    def check_admin_changes_are_synced(self, **env: str) -> None:
+        """
+        Проверка, что синхронизация возвращает заказы из таблицы после
+        изменения и удаления в админке.
+
+        :param env: Переменные окружения, задающие способ синхронизации.
+        """
+
+        rows = make_rows(10)
+        self.sync(rows, **env)
+        order_admin = OrderAdmin(Order, site)
+
+        order = Order.objects.get(order_number=1001)
+        order.dollars = Decimal('999')
+        order_admin.save_model(None, order, None, True)
+        order_admin.delete_model(None, Order.objects.get(order_number=1002))
+        order_admin.delete_queryset(None, Order.objects.filter(order_number__in=[1003, 1004]))
+
+        self.sync(rows, **env)
+        self.assertOrdersMatch(rows)
+
+    def test_python_engine(self):
+        self.check_admin_changes_are_synced(GS_SYNC_ENGINE='python')
+
+    def test_sql_engine(self):
+        self.check_admin_changes_are_synced(GS_SYNC_ENGINE='sql')
+
+    def test_paged_read(self):
+        self.check_admin_changes_are_synced(GS_READ_PAGE_SIZE='4')
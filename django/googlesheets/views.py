@@ -0,0 +1,34 @@
+import hmac
+
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+)
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from .metrics import get_metrics
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Отдача метрик в текстовом формате Prometheus.
+
+    Метрики отдаются только по токену METRICS_TOKEN в заголовке
+    Authorization: Bearer. Без настроенного токена адрес не существует.
+
+    :param request: Запрос.
+    :return: Ответ с метриками всех процессов.
+    """
+
+    if not settings.METRICS_TOKEN:
+        raise Http404
+
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode()):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+
+    return HttpResponse(get_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,10 @@
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker) -> None:
+    """Отметка завершения процесса воркера для сбора метрик"""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
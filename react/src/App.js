@@ -4,41 +4,109 @@ import Table from './Table';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts';
 
 
+const API_URL = 'http://127.0.0.1:8000/api/googlesheets/orders/';
+// Количество точек графика: сервер прореживает ряд до этого размера.
+const CHART_POINTS = 500;
+
+// Заказы в порядке выдачи API: по сроку поставки и id.
+function sortOrders(orders) {
+  return orders.sort((a, b) => {
+    if (a.delivery_time !== b.delivery_time) {
+      return a.delivery_time < b.delivery_time ? -1 : 1;
+    }
+    return a.id - b.id;
+  });
+}
+
+
 function App() {
   const [orders, setOrders] = React.useState([]);
   const [loading, setLoading] = React.useState(true);
-  const [max_dollars, setMaxDollars] = React.useState(0);
+  const [chart, setChart] = React.useState([]);
   const [total_dollars, setTotalDollars] = React.useState(0);
 
-  const httpFetch = async () => {
-    const response = await fetch('http://127.0.0.1:8000/api/googlesheets/orders/', {
+  // Заказы по id, последняя полученная ревизия и очередь обработки
+  // событий: события применяются строго по порядку.
+  const ordersById = React.useRef(new Map());
+  const revision = React.useRef(null);
+  const queue = React.useRef(Promise.resolve());
+
+  const render = () => {
+    setOrders(sortOrders(Array.from(ordersById.current.values())));
+    setLoading(false);
+  }
+
+  const getJSON = async (url) => {
+    const response = await fetch(url, {
         headers: { 
             'Content-Type': 'application/json',
             'Accept': 'application/json',
           }
-        }).then(response => response.json())
-          .then(response => {
-            setOrders(response.orders);
-            let _max_dollars = max_dollars;
-            response.orders.forEach(element => {
-              let element_dollars = Number(element.dollars);
-              if (element_dollars > _max_dollars) {
-                _max_dollars = element_dollars;
-              }
-            });
-            setMaxDollars(_max_dollars);
-            setTotalDollars(response.total_dollars);
-            setLoading(false);
-          });
+        });
+    return response.json();
+  }
+
+  // Сумма заказов и точки графика берутся из сводок по дням, которые
+  // сервер пересчитывает при синхронизации.
+  const summaryFetch = async () => {
+    const [summary, chartData] = await Promise.all([
+      getJSON(API_URL + 'summary/'),
+      getJSON(API_URL + `chart/?points=${CHART_POINTS}`),
+    ]);
+    setTotalDollars(Number(summary.total_dollars));
+    setChart(chartData.points.map(point => ({
+      ...point,
+      total_dollars: Number(point.total_dollars),
+    })));
+  }
+
+  const applyChanges = (changes) => {
+    if (changes.reset) {
+      ordersById.current.clear();
+    }
+    changes.upserted.forEach(order => ordersById.current.set(order.id, order));
+    changes.deleted.forEach(tombstone => ordersById.current.delete(tombstone.order_id));
+    revision.current = changes.revision;
+    render();
+  }
+
+  // Догрузка изменений после последней полученной ревизии через ленту
+  // изменений. Без ревизии лента возвращает все заказы.
+  const httpFetch = async () => {
+    const query = revision.current === null ? '' : `?since=${revision.current}`;
+    applyChanges(await getJSON(API_URL + 'changes/' + query));
+    await summaryFetch();
+  }
+
+  const enqueue = (handler) => {
+    queue.current = queue.current.then(handler).catch(console.error);
   }
 
   useEffect(() => {
-    const link_interval = setInterval(async () => {
-      await httpFetch();
-    }, 3000);
+    const events = new EventSource(API_URL + 'events/');
+
+    // После подключения и каждого переподключения догружаем изменения,
+    // которые могли быть пропущены без соединения.
+    events.onopen = () => enqueue(httpFetch);
+
+    events.addEventListener('orders', (event) => {
+      const message = JSON.parse(event.data);
+      enqueue(async () => {
+        // Эти изменения уже получены через ленту изменений.
+        if (revision.current !== null && message.revision <= revision.current) {
+          return;
+        }
+        if (message.upserted !== null && message.base_revision === revision.current) {
+          applyChanges(message);
+          await summaryFetch();
+        } else {
+          await httpFetch();
+        }
+      });
+    });
 
     return () => {
-      clearInterval(link_interval);
+      events.close();
     }
   }, []);
 
@@ -50,10 +118,10 @@ function App() {
 
       {loading && <Loader />}
 
-      {orders.length ? (
+      {chart.length ? (
         <ResponsiveContainer width="100%" aspect={3}>
           <LineChart
-            data={orders}
+            data={chart}
             margin={{
               top: 15,
               right: 30,
@@ -63,11 +131,11 @@ function App() {
           >
             <CartesianGrid  horizontal="true" vertical="" stroke="black"/>
             <XAxis dataKey="delivery_time" />
-            <YAxis type="number" domain={[0, max_dollars]} />
+            <YAxis type="number" domain={[0, 'auto']} />
             <Tooltip contentStyle={{ backgroundColor: "#f5f5f5", color: "gray", 
                       border: "1px solid silver", borderRadius: "8px" }} 
                       itemStyle={{ color: "gray" }} cursor={false}/>
-            <Line type="monotone" dataKey="dollars" stroke="#1a8ef3" />
+            <Line type="monotone" dataKey="total_dollars" stroke="#1a8ef3" />
           </LineChart>
         </ResponsiveContainer>
       ) : loading ? null : (